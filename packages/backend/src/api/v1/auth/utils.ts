@@ -98,8 +98,11 @@ const publicRoutes = [
   new RegExp(`/v1/runs/.+/public`), // public run data
   new RegExp(`/v1/runs/.+/feedback`), // getFeedback in SDKs
   new RegExp(`/v1/runs/exports/.+`), // run exports
+  `/v1/templates/latest`, // warmTemplates in SDKs, scoped to the key's project
   `/v1/template_versions/latest`,
   `/v1/template-versions/latest`,
+  `/v1/template_versions/changes`,
+  `/v1/template-versions/changes`,
   "/v1/users/verify-email",
   "/v1/users/send-verification",
   new RegExp(`/v1/datasets/.+`), // getDataSets in SDKs
@@ -1,6 +1,11 @@
 import sql, { createSqlClient } from "@/src/utils/db";
 import { clearUndefined } from "@/src/utils/ingest";
 import { unCamelObject } from "@/src/utils/misc";
+import {
+  getChangedTemplates,
+  TemplateChange,
+  templateChanges,
+} from "@/src/utils/template-changes";
 import { Context } from "koa";
 import Router from "koa-router";
 import { hasAccess } from "shared";
@@ -28,6 +33,38 @@ export function unCamelExtras(version: any) {
   version.extra = unCamelObject(version.extra);
   return version;
 }
+
+// Published versions can still be edited, which sets a new `published_at`,
+// so it's part of the ETag along with the version id
+export function getVersionEtag(id: string, publishedAt: Date | string | null) {
+  const publishedTime = publishedAt ? new Date(publishedAt).getTime() : 0;
+  return `"${id}-${publishedTime}"`;
+}
+
+function matchesIfNoneMatch(header: string | undefined, etag: string) {
+  if (!header) {
+    return false;
+  }
+  return header.split(",").some((candidate) => {
+    const tag = candidate.trim().replace(/^W\//, "");
+    return tag === "*" || tag === etag;
+  });
+}
+
+// Longest a request to /changes waits for, in seconds. Longer timeouts are cut
+// to it, so a waiting request never outlives the proxies in front of the API.
+const MAX_CHANGES_TIMEOUT = 55;
+
+function changesBody(changes: TemplateChange[]) {
+  const cursor = Math.max(
+    ...changes.map(({ changedAt }) => new Date(changedAt).getTime()),
+  );
+  return {
+    cursor: new Date(cursor).toISOString(),
+    templates: changes.map(({ id, slug }) => ({ id, slug })),
+  };
+}
+
 /**
  * @openapi
  * /v1/template-versions/latest:
@@ -41,6 +78,9 @@ export function unCamelExtras(version: any) {
  *       This route differs from all the next ones in that:
  *       - it requires only the `slug` parameter to reference a template
  *       - it doesn't require using a Private Key to authenticate the request (Public Key is enough)
+ *
+ *       Responses have an `ETag` header. Send it back in `If-None-Match` to get an empty 304 response
+ *       when the template hasn't changed.
  *     tags: [Templates]
  *     parameters:
  *       - in: query
@@ -49,13 +89,25 @@ export function unCamelExtras(version: any) {
  *         schema:
  *           type: string
  *         description: Slug of the template
+ *       - in: header
+ *         name: If-None-Match
+ *         required: false
+ *         schema:
+ *           type: string
+ *         description: ETag of the version already known by the client
  *     responses:
  *       200:
  *         description: Latest version of the template
+ *         headers:
+ *           ETag:
+ *             schema:
+ *               type: string
  *         content:
  *           application/json:
  *             schema:
  *               $ref: '#/components/schemas/TemplateVersion'
+ *       304:
+ *         description: The latest version is the one matching `If-None-Match`
  *       404:
  *         description: Template not found
  */
@@ -75,7 +127,8 @@ versions.get("/latest", async (ctx: Context) => {
       tv.content, 
       tv.extra, 
       tv.created_at, 
-      tv.version
+      tv.version,
+      tv.published_at
     from 
       template t
       inner join template_version tv on t.id = tv.template_id
@@ -91,15 +144,113 @@ versions.get("/latest", async (ctx: Context) => {
     ctx.throw("Template not found, is the project ID correct?", 404);
   }
 
+  const { published_at: publishedAt, ...version } = latestVersion;
+  const etag = getVersionEtag(version.id, publishedAt);
+  ctx.set("ETag", etag);
+
+  if (matchesIfNoneMatch(ctx.request.headers["if-none-match"], etag)) {
+    ctx.status = 304;
+    return;
+  }
+
   // This makes sure OpenAI messages are not camel cased as used in the app
   // For example: message.toolCallId instead of message.tool_call_id
-  if (typeof latestVersion.content !== "string") {
-    latestVersion.content = latestVersion.content?.map((c: any) =>
-      unCamelObject(c),
+  if (typeof version.content !== "string") {
+    version.content = version.content?.map((c: any) => unCamelObject(c));
+  }
+
+  ctx.body = unCamelExtras(version);
+});
+
+/**
+ * @openapi
+ * /v1/template-versions/changes:
+ *   get:
+ *     summary: Wait for template changes
+ *     description: |
+ *       Long-polling route used by the Lunary SDKs to refresh their cached templates as soon as
+ *       a new version is published, instead of waiting for them to expire.
+ *
+ *       Without `since`, it returns right away with a cursor to pass in the next request.
+ *       Otherwise, it returns as soon as templates have been published after `since`, or after
+ *       `timeout` seconds with no templates. Timeouts above 55 seconds are reduced to 55.
+ *       Like `/latest`, it can be called with a Public Key.
+ *     tags: [Templates]
+ *     parameters:
+ *       - in: query
+ *         name: since
+ *         required: false
+ *         schema:
+ *           type: string
+ *           format: date-time
+ *         description: Cursor returned by the previous request
+ *       - in: query
+ *         name: timeout
+ *         required: false
+ *         schema:
+ *           type: number
+ *           minimum: 0
+ *           default: 25
+ *         description: Seconds to wait for changes
+ *     responses:
+ *       200:
+ *         description: Templates published since the cursor, if any
+ *         content:
+ *           application/json:
+ *             schema:
+ *               type: object
+ *               properties:
+ *                 cursor:
+ *                   type: string
+ *                   format: date-time
+ *                 templates:
+ *                   type: array
+ *                   items:
+ *                     type: object
+ *                     properties:
+ *                       id:
+ *                         type: string
+ *                       slug:
+ *                         type: string
+ */
+versions.get("/changes", async (ctx: Context) => {
+  const { projectId } = ctx.state;
+
+  const querySchema = z.object({
+    since: z.string().datetime({ offset: true }).optional(),
+    timeout: z.coerce
+      .number()
+      .min(0)
+      .default(25)
+      .transform((timeout) => Math.min(timeout, MAX_CHANGES_TIMEOUT)),
+  });
+  const { since, timeout } = querySchema.parse(ctx.request.query);
+
+  if (!since) {
+    const [{ now }] = await sql`select date_trunc('milliseconds', now()) as now`;
+    ctx.body = { cursor: new Date(now).toISOString(), templates: [] };
+    return;
+  }
+
+  // Changes the client missed since its cursor are returned right away
+  let changes = await getChangedTemplates(projectId, new Date(since));
+
+  if (!changes.length && timeout > 0) {
+    ctx.request.socket?.setTimeout(0);
+    const closed = new AbortController();
+    ctx.res?.on("close", () => closed.abort());
+
+    changes = await templateChanges.wait(
+      projectId,
+      new Date(since),
+      timeout * 1000,
+      closed.signal,
     );
   }
 
-  ctx.body = unCamelExtras(latestVersion);
+  ctx.body = changes.length
+    ? changesBody(changes)
+    : { cursor: since, templates: [] };
 });
 
 versions.get("/:id", async (ctx: Context) => {
@@ -62,6 +62,11 @@ templates.get("/", async (ctx: Context) => {
 });
 
 templates.get("/latest", async (ctx: Context) => {
+  // Public route: without an API key there is no project to read the templates of
+  if (!ctx.state.projectId) {
+    ctx.throw(401, "An API key is required");
+  }
+
   const templateVersions = await sql`
     select 
       distinct on (tv.template_id)
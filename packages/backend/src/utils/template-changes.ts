@@ -0,0 +1,168 @@
+import sql from "@/src/utils/db";
+import { sleep } from "@/src/utils/misc";
+
+// How often the database is checked while requests to /changes are waiting
+export const CHANGES_CHECK_INTERVAL = 1000;
+
+export interface TemplateChange {
+  id: string;
+  slug: string;
+  changedAt: Date;
+}
+
+interface Waiter {
+  projectId: string;
+  since: Date;
+  resolve: (changes: TemplateChange[]) => void;
+}
+
+// Times are truncated to milliseconds, the precision of the cursors sent to clients,
+// so a change is never reported again after the cursor it was reported with
+export async function getChangedTemplates(
+  projectId: string,
+  since: Date,
+): Promise<TemplateChange[]> {
+  return sql`
+    select
+      t.id::text,
+      t.slug,
+      max(date_trunc('milliseconds', greatest(tv.created_at, tv.published_at))) as changed_at
+    from
+      template t
+      inner join template_version tv on t.id = tv.template_id
+    where
+      t.project_id = ${projectId}
+      and tv.is_draft = false
+      and date_trunc('milliseconds', greatest(tv.created_at, tv.published_at)) > ${since}
+    group by
+      t.id,
+      t.slug
+  ` as any;
+}
+
+/**
+ * Waits for templates to be published, for every request to /changes handled by this
+ * instance at once: while requests are waiting, a single query checks all their projects
+ * every `checkInterval` ms, and each request gets the changes of its own project.
+ */
+export class TemplateChangeNotifier {
+  private waiters = new Set<Waiter>();
+  private running = false;
+
+  constructor(private checkInterval = CHANGES_CHECK_INTERVAL) {}
+
+  get waiting() {
+    return this.waiters.size;
+  }
+
+  /**
+   * Resolves with the templates of the project published after `since`, or with no
+   * templates after `timeout` ms or once `signal` is aborted (e.g. the client left).
+   */
+  wait(
+    projectId: string,
+    since: Date,
+    timeout: number,
+    signal?: AbortSignal,
+  ): Promise<TemplateChange[]> {
+    return new Promise((resolve) => {
+      const waiter: Waiter = {
+        projectId,
+        since,
+        resolve: (changes) => {
+          clearTimeout(timer);
+          signal?.removeEventListener("abort", stop);
+          this.waiters.delete(waiter);
+          resolve(changes);
+        },
+      };
+      const stop = () => waiter.resolve([]);
+      const timer = setTimeout(stop, timeout);
+
+      if (signal?.aborted) {
+        return stop();
+      }
+      signal?.addEventListener("abort", stop);
+      this.waiters.add(waiter);
+
+      if (!this.running) {
+        this.run();
+      }
+    });
+  }
+
+  private async run() {
+    this.running = true;
+    try {
+      while (this.waiters.size) {
+        await sleep(this.checkInterval);
+        if (this.waiters.size) {
+          await this.check();
+        }
+      }
+    } finally {
+      this.running = false;
+    }
+  }
+
+  private async check() {
+    const waiters = [...this.waiters];
+
+    // Templates are only read from the oldest cursor of each project
+    const oldest = new Map<string, Date>();
+    for (const { projectId, since } of waiters) {
+      const current = oldest.get(projectId);
+      if (!current || since < current) {
+        oldest.set(projectId, since);
+      }
+    }
+
+    let rows: (TemplateChange & { projectId: string })[];
+    try {
+      rows = (await sql`
+        select
+          t.project_id::text,
+          t.id::text,
+          t.slug,
+          max(date_trunc('milliseconds', greatest(tv.created_at, tv.published_at))) as changed_at
+        from
+          unnest(
+            ${sql.array([...oldest.keys()])}::uuid[],
+            ${sql.array([...oldest.values()].map((since) => since.toISOString()))}::timestamptz[]
+          ) as w(project_id, since)
+          inner join template t on t.project_id = w.project_id
+          inner join template_version tv on t.id = tv.template_id
+        where
+          tv.is_draft = false
+          and date_trunc('milliseconds', greatest(tv.created_at, tv.published_at)) > w.since
+        group by
+          t.project_id,
+          t.id,
+          t.slug
+      `) as any;
+    } catch (error) {
+      // Waiting requests are checked again on the next interval, or time out
+      console.error("Error checking for template changes", error);
+      return;
+    }
+
+    if (!rows.length) {
+      return;
+    }
+
+    for (const waiter of waiters) {
+      const changes = rows.filter(
+        ({ projectId, changedAt }) =>
+          projectId === waiter.projectId &&
+          new Date(changedAt) > waiter.since,
+      );
+      if (changes.length) {
+        waiter.resolve(
+          changes.map(({ id, slug, changedAt }) => ({ id, slug, changedAt })),
+        );
+      }
+    }
+  }
+}
+
+export const templateChanges = new TemplateChangeNotifier();
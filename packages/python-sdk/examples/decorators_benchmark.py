@@ -0,0 +1,51 @@
+import timeit
+
+import lunary
+
+# Per-call overhead of the tracing decorators compared with an undecorated
+# function. Events are dropped instead of being queued, so this measures the
+# decorator and `track_event`, not the network. Runs offline.
+
+lunary.queue.append = lambda event: None
+
+
+def plain(x, y=1):
+    return x
+
+
+@lunary.chain()
+def chain(x, y=1):
+    return x
+
+
+@lunary.chain(input_arg="x")
+def chain_input_arg(x, y=1):
+    return x
+
+
+@lunary.tool()
+def tool(x, y=1):
+    return x
+
+
+class Bot:
+    @lunary.class_chain(app_id=lambda bot: "app", input_arg="x")
+    def answer(self, x):
+        return x
+
+
+bot = Bot()
+
+
+def best(fn, number=20_000):
+    return min(timeit.repeat(fn, number=number, repeat=7)) / number * 1e6
+
+
+baseline = best(lambda: plain(1, y=2))
+for label, fn in (
+    ("chain()", lambda: chain(1, y=2)),
+    ("chain(input_arg=...)", lambda: chain_input_arg(1, y=2)),
+    ("tool()", lambda: tool(1, y=2)),
+    ("class_chain(input_arg, app_id=callable)", lambda: bot.answer(1)),
+):
+    print(f"{label:42s} {best(fn) - baseline:6.1f} us per call")
@@ -0,0 +1,76 @@
+import timeit
+
+from openai.types.chat import ChatCompletionChunk
+from lunary.openai_utils import OpenAIStreamAccumulator
+
+# Accumulates a long streamed chat completion (text, then 4 parallel tool calls)
+# the way the stream handlers used to (string concatenation and a scan of the
+# tool calls per delta, mutating the chunks) and with OpenAIStreamAccumulator.
+# Runs offline.
+
+CHUNKS = 10_000
+
+
+def make_chunks():
+    chunks = [{"index": 0, "delta": {"role": "assistant", "content": ""}}]
+    chunks += [{"index": 0, "delta": {"content": "word "}} for _ in range(CHUNKS // 2)]
+    chunks += [
+        {
+            "index": 0,
+            "delta": {
+                "tool_calls": [
+                    {"index": i, "id": f"call_{i}", "type": "function", "function": {"name": f"tool_{i}", "arguments": ""}}
+                ]
+            },
+        }
+        for i in range(4)
+    ]
+    chunks += [
+        {"index": 0, "delta": {"tool_calls": [{"index": i % 4, "function": {"arguments": "ab"}}]}}
+        for i in range(CHUNKS - len(chunks))
+    ]
+    return [
+        ChatCompletionChunk.model_validate(
+            {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o", "choices": [choice]}
+        )
+        for choice in chunks
+    ]
+
+
+def accumulate_previous(chunks):
+    message = {"role": None, "content": "", "tool_calls": []}
+    for chunk in chunks:
+        delta = chunk.choices[0].delta
+        if delta.role:
+            message["role"] = delta.role
+        if delta.content:
+            message["content"] += delta.content
+        for tool_call in delta.tool_calls or []:
+            existing = next((tc for tc in message["tool_calls"] if tc.index == tool_call.index), None)
+            if existing is None:
+                message["tool_calls"].append(tool_call)
+            else:
+                existing.function.arguments += tool_call.function.arguments
+    return message
+
+
+def accumulate(chunks):
+    accumulator = OpenAIStreamAccumulator()
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.get_output()
+
+
+output = accumulate(make_chunks())
+previous = accumulate_previous(make_chunks())
+assert output["content"] == previous["content"]
+assert [tc["function"]["arguments"] for tc in output["tool_calls"]] == [
+    tc.function.arguments for tc in previous["tool_calls"]
+]
+
+timings = []
+for run in (accumulate_previous, accumulate):
+    # The previous approach mutates the chunks, so each run gets fresh ones
+    runs = [make_chunks() for _ in range(5)]
+    timings.append(min(timeit.timeit(lambda: run(chunks), number=1) for chunks in runs) * 1e3)
+print(f"{CHUNKS} chunks: {timings[0]:.1f} ms -> {timings[1]:.1f} ms ({timings[0] / timings[1]:.1f}x)")
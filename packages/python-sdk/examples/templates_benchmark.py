@@ -0,0 +1,67 @@
+import copy
+import timeit
+
+import chevron
+from lunary.template_utils import compile_template
+
+# Renders typical templates the way `render_template` used to (deepcopy + chevron
+# on every call) and with their compiled version. Runs offline.
+
+chat_template = {
+    "id": "3c1b6f0e-0000-4000-8000-000000000001",
+    "content": [
+        {"role": "system", "content": "You are {{assistant_name}}, a helpful assistant for {{company}}. Answer in {{language}}. Today is {{date}}."},
+        {"role": "user", "content": "Context:\n{{context}}\n\nQuestion: {{question}}"},
+        {"role": "assistant", "content": "Sure, let me look into {{topic}}."},
+        {"role": "user", "content": "Please keep it under {{max_words}} words and cite {{source}}."},
+    ],
+    "extra": {
+        "model": "gpt-4o",
+        "temperature": 0.2,
+        "max_tokens": 512,
+        "tools": [{"type": "function", "function": {"name": "lookup", "parameters": {"type": "object"}}}],
+    },
+}
+text_template = {
+    "id": "3c1b6f0e-0000-4000-8000-000000000002",
+    "content": "Summarize {{doc}} for {{audience}} in {{n}} bullet points.",
+    "extra": {"model": "gpt-4o-mini"},
+}
+data = {
+    "assistant_name": "Luna",
+    "company": "Acme",
+    "language": "English",
+    "date": "2024-10-01",
+    "context": "lorem ipsum " * 20,
+    "question": "What is <x>?",
+    "topic": "x",
+    "max_words": 100,
+    "source": "the docs",
+    "doc": "the report",
+    "audience": "engineers",
+    "n": 5,
+}
+
+
+def render_uncompiled(raw_template, data):
+    content = copy.deepcopy(raw_template["content"])
+    extra = copy.deepcopy(raw_template["extra"])
+    extra_headers = {"Template-Id": str(raw_template["id"])}
+    if isinstance(content, str):
+        return {"text": chevron.render(content, data), "extra_headers": extra_headers, **extra}
+    for message in content:
+        message["content"] = chevron.render(message["content"], data)
+    return {"messages": content, "extra_headers": extra_headers, **extra}
+
+
+def render_compiled(raw_template, data):
+    return compile_template(raw_template).render(data)
+
+
+for name, template in (("chat, 4 messages + tools", chat_template), ("text", text_template)):
+    assert render_uncompiled(template, data) == render_compiled(template, data)
+    timings = []
+    for render in (render_uncompiled, render_compiled):
+        best = min(timeit.repeat(lambda: render(template, data), number=2000, repeat=7))
+        timings.append(best / 2000 * 1e6)
+    print(f"{name}: {timings[0]:.1f} us -> {timings[1]:.1f} us per render ({timings[0] / timings[1]:.1f}x)")
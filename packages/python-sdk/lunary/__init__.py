@@ -13,8 +13,8 @@ if os.getenv("LUNARY_VERBOSE") == "True" or os.getenv("LUNARY_VERBOSE") == "true
     logger.setLevel(logging.DEBUG)
     logger.propagate = False # Avoid the global logging config to prevent verbose logs to be logged
 
-from inspect import signature
-import traceback, copy, time, chevron, aiohttp, copy
+from inspect import signature, iscoroutinefunction, isasyncgenfunction, isgeneratorfunction
+import asyncio, traceback, copy, time, json, chevron, aiohttp, copy, weakref, warnings
 from functools import wraps
 
 
@@ -22,20 +22,26 @@ from packaging import version
 from importlib.metadata import PackageNotFoundError
 from contextvars import ContextVar
 from datetime import datetime, timezone
-from typing import Optional, Any, Callable, Union, Dict
+from typing import Optional, Any, Callable, Union, Dict, Iterable
 import jsonpickle
 from pydantic import BaseModel
 import humps
 
 from .exceptions import *
 from .parsers import default_input_parser, default_output_parser, filter_params, method_input_parser, PydanticHandler
-from .openai_utils import OpenAIUtils
+from .openai_utils import OpenAIUtils, OpenAIStreamAccumulator, ResponsesStreamAccumulator, BATCH_RUN_TYPES
 from .ibm_utils import IBMUtils
+from .anthropic_utils import AnthropicUtils, AnthropicStreamAccumulator, MessageStreamManagerProxy, AsyncMessageStreamManagerProxy, get_stream_snapshot, is_token_event
 from .event_queue import EventQueue
 from .thread import Thread
 from .utils import clean_nones, create_uuid_from_string
 from .config import get_config, set_config
-from .run_manager import RunManager
+from .run_manager import RunManager, Run
+from .stats import get_stats
+from .stream_metrics import StreamTimer
+from .output_buffer import OutputBuffer, OutputMode, DEFAULT_OUTPUT_LIMITS
+from .template_cache import TemplateCache, TemplateDiskStore, TemplatePoller, TemplateSubscriber, NOT_MODIFIED, SUBSCRIPTION_POLL_TIMEOUT
+from .template_utils import RenderCache, compile_template, get_langchain_prompt, render_rows, render_rows_async
 
 from .users import (
     user_ctx,
@@ -53,8 +59,34 @@ event_queue_ctx.set(EventQueue())
 queue = event_queue_ctx.get()
 
 run_manager = RunManager()
+template_cache = TemplateCache()
+render_cache = RenderCache()
+if os.getenv("LUNARY_TEMPLATE_CACHE_DIR"):
+    template_cache.disk = TemplateDiskStore(os.environ["LUNARY_TEMPLATE_CACHE_DIR"])
 
-from contextvars import ContextVar
+
+class _LegacyTemplateCache:
+    """
+    Stands in for the `templateCache` dict replaced by `template_cache`. Like the dict,
+    `clear()` only empties the cache in memory, the versions stored on disk are kept.
+    """
+
+    def clear(self) -> None:
+        template_cache.invalidate(disk=False)
+
+    def __len__(self) -> int:
+        return len(template_cache)
+
+
+def __getattr__(name: str):
+    if name == "templateCache":
+        warnings.warn(
+            "lunary.templateCache is deprecated, use lunary.template_cache.invalidate() to clear the template cache",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return _LegacyTemplateCache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class LunaryException(Exception):
     pass
@@ -67,8 +99,26 @@ def config(
     api_url: str | None = None,
     disable_ssl_verify: bool | None = None,
     ssl_verify: bool | str | None = None,
+    template_cache_ttl: float | None = None,
+    template_cache_size: int | None = None,
+    template_max_stale: float | None = None,
+    template_cache_dir: str | None = None,
+    render_cache_size: int | None = None,
 ):
     set_config(app_id, verbose, api_url, disable_ssl_verify, ssl_verify)
+    if template_cache_ttl is not None:
+        template_cache.ttl = template_cache_ttl
+    if template_cache_size is not None:
+        template_cache.max_size = template_cache_size
+    if template_max_stale is not None:
+        template_cache.max_stale = template_max_stale
+    if template_cache_dir is not None:
+        # An empty string disables the on-disk cache
+        template_cache.disk = TemplateDiskStore(template_cache_dir) if template_cache_dir else None
+    if render_cache_size is not None:
+        render_cache.max_size = render_cache_size
+        if not render_cache_size:
+            render_cache.clear()
 
 
 def get_parent_run_id(parent_run_id: str, run_type: str, app_id: str, run_id: str):
@@ -167,180 +217,168 @@ def track_event(
         logger.exception("Error in `track_event`")
 
 
-def default_stream_handler(fn, run_id, name, type, *args, **kwargs):
-    try:
-        stream = fn(*args, **kwargs)
+# Clients whose server rejected `stream_options`, e.g. older Azure API versions
+_stream_options_unsupported = weakref.WeakSet()
 
-        choices = []
-        tokens = 0
 
-        for chunk in stream:
-            tokens += 1
-            if not chunk.choices:
-                # Azure
-                continue
-
-            choice = chunk.choices[0]
-            index = choice.index
-
-            content = choice.delta.content
-            role = choice.delta.role
-            function_call = choice.delta.function_call
-            tool_calls = choice.delta.tool_calls
-
-            if len(choices) <= index:
-                choices.append(
-                    {
-                        "message": {
-                            "role": role,
-                            "content": content or "",
-                            "function_call": {},
-                            "tool_calls": [],
-                        }
-                    }
-                )
+def _request_stream_usage(fn, kwargs) -> bool:
+    """
+    Asks the server to send the token usage in a last chunk, unless the caller
+    already set `stream_options`. Returns whether that chunk must be hidden from the caller.
+    """
+    if "stream_options" in kwargs or fn in _stream_options_unsupported:
+        return False
+    kwargs["stream_options"] = {"include_usage": True}
+    return True
 
-            if content:
-                choices[index]["message"]["content"] += content
 
-            if role:
-                choices[index]["message"]["role"] = role
+def _is_stream_options_error(e: Exception) -> bool:
+    return getattr(e, "status_code", None) in (400, 422) and "stream_options" in str(e)
 
-            if hasattr(function_call, "name"):
-                choices[index]["message"]["function_call"]["name"] = function_call.name
 
-            if hasattr(function_call, "arguments"):
-                choices[index]["message"]["function_call"].setdefault("arguments", "")
-                choices[index]["message"]["function_call"][
-                    "arguments"
-                ] += function_call.arguments
+def _is_usage_chunk(chunk) -> bool:
+    return not chunk.choices and getattr(chunk, "usage", None) is not None
 
-            if isinstance(tool_calls, list):
-                for tool_call in tool_calls:
-                    existing_call_index = next(
-                        (
-                            index
-                            for (index, tc) in enumerate(
-                                choices[index]["message"]["tool_calls"]
-                            )
-                            if tc.index == tool_call.index
-                        ),
-                        -1,
-                    )
 
-                if existing_call_index == -1:
-                    choices[index]["message"]["tool_calls"].append(tool_call)
+def default_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    hide_usage_chunk = _request_stream_usage(fn, kwargs)
+    # Created outside of the `try` below, so errors raised by the API reach the caller as they are
+    try:
+        stream = fn(*args, **kwargs)
+    except Exception as e:
+        if not hide_usage_chunk or not _is_stream_options_error(e):
+            raise
+        _stream_options_unsupported.add(fn)
+        hide_usage_chunk = False
+        kwargs.pop("stream_options")
+        stream = fn(*args, **kwargs)
 
-                else:
-                    existing_call = choices[index]["message"]["tool_calls"][
-                        existing_call_index
-                    ]
-                    if hasattr(tool_call, "function") and hasattr(
-                        tool_call.function, "arguments"
-                    ):
-                        existing_call.function.arguments += tool_call.function.arguments
+    try:
+        accumulator = OpenAIStreamAccumulator()
 
+        for chunk in stream:
+            accumulator.add(chunk)
+            if hide_usage_chunk and _is_usage_chunk(chunk):
+                continue
+            timer.tick()
             yield chunk
     finally:
         stream.close()
 
-    output = OpenAIUtils.parse_message(choices[0]["message"])
+    token_usage = accumulator.get_token_usage()
     track_event(
         type,
         "end",
         run_id,
         name=name,
-        output=output,
-        token_usage={"completion": tokens, "prompt": None},
+        output=accumulator.get_output(),
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(token_usage["completion"])},
     )
     return
 
 
 async def async_stream_handler(fn, run_id, name, type, *args, **kwargs):
-    stream = await fn(*args, **kwargs)
-
-    choices = []
-    tokens = 0
+    timer = StreamTimer()
+    hide_usage_chunk = _request_stream_usage(fn, kwargs)
+    try:
+        stream = await fn(*args, **kwargs)
+    except Exception as e:
+        if not hide_usage_chunk or not _is_stream_options_error(e):
+            raise
+        _stream_options_unsupported.add(fn)
+        hide_usage_chunk = False
+        kwargs.pop("stream_options")
+        stream = await fn(*args, **kwargs)
+    accumulator = OpenAIStreamAccumulator()
 
     async for chunk in stream:
-        tokens += 1
-        if not chunk.choices:
-            # Happens with Azure
+        accumulator.add(chunk)
+        if hide_usage_chunk and _is_usage_chunk(chunk):
             continue
+        timer.tick()
+        yield chunk
 
-        choice = chunk.choices[0]
-        index = choice.index
-
-        content = choice.delta.content
-        role = choice.delta.role
-        tool_calls = choice.delta.tool_calls
-
-        if len(choices) <= index:
-            choices.append(
-                {
-                    "message": {
-                        "role": role,
-                        "content": content or "",
-                        "function_call": {},
-                        "tool_calls": [],
-                    }
-                }
-            )
-
-        if content:
-            choices[index]["message"]["content"] += content
-
-        if role:
-            choices[index]["message"]["role"] = role
-
-        if isinstance(tool_calls, list):
-            for tool_call in tool_calls:
-                existing_call_index = next(
-                    (
-                        index
-                        for (index, tc) in enumerate(
-                            choices[index]["message"]["tool_calls"]
-                        )
-                        if tc.index == tool_call.index
-                    ),
-                    -1,
-                )
-
-            if existing_call_index == -1:
-                choices[index]["message"]["tool_calls"].append(tool_call)
-
-            else:
-                existing_call = choices[index]["message"]["tool_calls"][
-                    existing_call_index
-                ]
-                if hasattr(tool_call, "function") and hasattr(
-                    tool_call.function, "arguments"
-                ):
-                    existing_call.function.arguments += tool_call.function.arguments
+    token_usage = accumulator.get_token_usage()
+    track_event(
+        type,
+        "end",
+        run_id,
+        name=name,
+        output=accumulator.get_output(),
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(token_usage["completion"])},
+    )
+    return
 
-        yield chunk
+def _track_responses_stream_end(type, run_id, name, accumulator, timer):
+    error = accumulator.error
+    if error is not None:
+        track_event(
+            type,
+            "error",
+            run_id,
+            error={"message": getattr(error, "message", None) or str(error)},
+        )
+        return
 
-    output = OpenAIUtils.parse_message(choices[0]["message"])
+    token_usage = accumulator.get_token_usage()
     track_event(
         type,
         "end",
         run_id,
         name=name,
-        output=output,
-        token_usage={"completion": tokens, "prompt": None},
+        output=accumulator.get_output(),
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(token_usage["completion"])},
     )
+
+
+def responses_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    stream = fn(*args, **kwargs)
+    try:
+        accumulator = ResponsesStreamAccumulator()
+
+        for event in stream:
+            accumulator.add(event)
+            if event.type.endswith(".delta"):
+                timer.tick()
+            yield event
+    finally:
+        stream.close()
+
+    _track_responses_stream_end(type, run_id, name, accumulator, timer)
+    return
+
+
+async def async_responses_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    stream = await fn(*args, **kwargs)
+    accumulator = ResponsesStreamAccumulator()
+
+    async for event in stream:
+        accumulator.add(event)
+        if event.type.endswith(".delta"):
+            timer.tick()
+        yield event
+
+    _track_responses_stream_end(type, run_id, name, accumulator, timer)
     return
 
+
 def ibm_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    stream = fn(*args, **kwargs)
     try:
-        stream = fn(*args, **kwargs)
-
         content = ""
         tool_call = {} ## TODO: handle multiple tool calls in response
         prompt_tokens = 0
         completion_tokens = 0
 
         for chunk in stream:
+            timer.tick()
             prompt_tokens = chunk['usage']['prompt_tokens']
             completion_tokens = chunk['usage'].get('completion_tokens', 0)
 
@@ -380,11 +418,103 @@ def ibm_stream_handler(fn, run_id, name, type, *args, **kwargs):
         run_id,
         name=name,
         output=output,
-        token_usage=token_usage
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(completion_tokens)},
+    )
+    return
+
+
+def anthropic_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    stream = fn(*args, **kwargs)
+    try:
+        accumulator = AnthropicStreamAccumulator()
+
+        for event in stream:
+            if is_token_event(event):
+                timer.tick()
+            accumulator.add(event)
+            yield event
+    finally:
+        stream.close()
+
+    token_usage = accumulator.get_token_usage()
+    track_event(
+        type,
+        "end",
+        run_id,
+        name=name,
+        output=accumulator.get_output(),
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(token_usage["completion"])},
     )
     return
 
 
+async def async_anthropic_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    timer = StreamTimer()
+    stream = await fn(*args, **kwargs)
+    accumulator = AnthropicStreamAccumulator()
+
+    async for event in stream:
+        if is_token_event(event):
+            timer.tick()
+        accumulator.add(event)
+        yield event
+
+    token_usage = accumulator.get_token_usage()
+    track_event(
+        type,
+        "end",
+        run_id,
+        name=name,
+        output=accumulator.get_output(),
+        token_usage=token_usage,
+        metadata={"metrics": timer.get_metrics(token_usage["completion"])},
+    )
+    return
+
+
+def anthropic_message_stream_handler(fn, run_id, name, type, *args, **kwargs):
+    """
+    Handles `messages.stream()`, which returns a context manager instead of an iterator.
+    The SDK already accumulates the message, so its final snapshot is reported when the stream is closed.
+    """
+    timer = StreamTimer()
+    manager = fn(*args, **kwargs)
+
+    def on_end(stream, error):
+        if error is not None:
+            track_event(
+                type,
+                "error",
+                run_id,
+                error={"message": str(error), "stack": "".join(traceback.format_exception(error))},
+            )
+            return
+
+        snapshot = get_stream_snapshot(stream)
+        parsed_output = AnthropicUtils.parse_output(snapshot) if snapshot is not None else None
+        token_usage = parsed_output["tokensUsage"] if parsed_output else None
+        track_event(
+            type,
+            "end",
+            run_id,
+            name=name,
+            output=parsed_output["output"] if parsed_output else None,
+            token_usage=token_usage,
+            metadata={"metrics": timer.get_metrics(token_usage["completion"] if token_usage else None)},
+        )
+
+    def on_event(event):
+        if is_token_event(event):
+            timer.tick()
+
+    if hasattr(manager, "__aenter__"):
+        return AsyncMessageStreamManagerProxy(manager, on_end, on_event)
+    return MessageStreamManagerProxy(manager, on_end, on_event)
+
+
 def wrap(
     fn,
     type=None,
@@ -401,8 +531,7 @@ def wrap(
 ):
     def sync_wrapper(*args, **kwargs):
         output = None
-        nonlocal stream
-        stream = stream or kwargs.get("stream", False)
+        is_stream = stream or kwargs.get("stream", False)
 
         parent_run_id = kwargs.pop("parent", run_manager.current_run_id) 
         run = run_manager.start_run(run_id, parent_run_id)
@@ -437,7 +566,7 @@ def wrap(
             except Exception as e:
                 logger.exception(e)
 
-            if stream == True:
+            if is_stream == True:
                 return stream_handler(
                     fn, run.id, name or parsed_input["name"], type, *args, **kwargs
                 )
@@ -458,7 +587,7 @@ def wrap(
                 raise e
 
             try:
-                parsed_output = output_parser(output, stream)
+                parsed_output = output_parser(output, is_stream)
 
                 track_event(
                     type,
@@ -494,6 +623,7 @@ def async_wrap(
     output_parser=default_output_parser,
     app_id=None,
     stream: bool = False,
+    stream_handler=async_stream_handler,
 ):
     async def wrapper(*args, **kwargs):
         async def async_wrapper(*args, **kwargs):
@@ -605,15 +735,13 @@ def async_wrap(
                 except Exception as e:
                     logger.exception(e)
 
-                return async_stream_handler(
+                return stream_handler(
                     fn, run.id, name or parsed_input["name"], type, *args, **kwargs
                 )
             finally:
                 run_manager.end_run(run.id)
 
-        nonlocal stream
-        stream = stream or kwargs.get("stream", False)
-        if stream == True:
+        if stream or kwargs.get("stream", False) == True:
             return async_stream_wrapper(*args, **kwargs)
         else:
             return await async_wrapper(*args, **kwargs)
@@ -621,7 +749,15 @@ def async_wrap(
     return wrapper
 
 
-def monitor(object):
+def monitor(object, hash_embedding_inputs: bool = False):
+    """
+    Monitors the LLM calls made with an OpenAI, Anthropic or IBM watsonx client.
+
+    Parameters:
+        object: The client to monitor.
+        hash_embedding_inputs (bool, optional): Sends a short hash of each embedded
+            input, so identical inputs can be spotted. Embedded texts and vectors are never sent.
+    """
     try:
         package_name = object.__class__.__module__.split(".")[0]
 
@@ -656,10 +792,40 @@ def monitor(object):
                 logger.warning("Version 1.0.0 or higher of ibm-watsonx-ai is required")
             return
 
+        if package_name == "anthropic":
+            client_name = getattr(type(object), "__name__", None)
+            if (client_name or "").startswith("Async"):
+                object.messages.create = async_wrap(
+                    object.messages.create,
+                    "llm",
+                    input_parser=AnthropicUtils.parse_input,
+                    output_parser=AnthropicUtils.parse_output,
+                    stream_handler=async_anthropic_stream_handler,
+                )
+            else:
+                object.messages.create = wrap(
+                    object.messages.create,
+                    "llm",
+                    input_parser=AnthropicUtils.parse_input,
+                    output_parser=AnthropicUtils.parse_output,
+                    stream_handler=anthropic_stream_handler,
+                )
+            # `messages.stream()` is a regular function for both clients, it returns a context manager
+            object.messages.stream = wrap(
+                object.messages.stream,
+                "llm",
+                input_parser=AnthropicUtils.parse_input,
+                output_parser=AnthropicUtils.parse_output,
+                stream=True,
+                stream_handler=anthropic_message_stream_handler,
+            )
+            return
+
         if package_name == "openai":    
             installed_version = importlib.metadata.version("openai")
             if version.parse(installed_version) >= version.parse("1.0.0"):
                 client_name = getattr(type(object), "__name__", None)
+                embedding_input_parser = OpenAIUtils.embedding_input_parser(hash_embedding_inputs)
                 if client_name == "openai" or client_name == "OpenAI" or client_name == "AzureOpenAI":
                     try:
                         object.chat.completions.create = wrap(
@@ -668,6 +834,20 @@ def monitor(object):
                             input_parser=OpenAIUtils.parse_input,
                             output_parser=OpenAIUtils.parse_output,
                         )
+                        object.embeddings.create = wrap(
+                            object.embeddings.create,
+                            "embed",
+                            input_parser=embedding_input_parser,
+                            output_parser=OpenAIUtils.parse_embedding_output,
+                        )
+                        if hasattr(object, "responses"):
+                            object.responses.create = wrap(
+                                object.responses.create,
+                                "llm",
+                                input_parser=OpenAIUtils.parse_responses_input,
+                                output_parser=OpenAIUtils.parse_responses_output,
+                                stream_handler=responses_stream_handler,
+                            )
                     except Exception as e:
                         logger.warning(
                             "Please use `lunary.monitor(openai)` or `lunary.monitor(client)` after setting the OpenAI api key"
@@ -679,146 +859,766 @@ def monitor(object):
                         input_parser=OpenAIUtils.parse_input,
                         output_parser=OpenAIUtils.parse_output,
                     )
+                    object.embeddings.create = async_wrap(
+                        object.embeddings.create,
+                        "embed",
+                        input_parser=embedding_input_parser,
+                        output_parser=OpenAIUtils.parse_embedding_output,
+                    )
+                    if hasattr(object, "responses"):
+                        object.responses.create = async_wrap(
+                            object.responses.create,
+                            "llm",
+                            input_parser=OpenAIUtils.parse_responses_input,
+                            output_parser=OpenAIUtils.parse_responses_output,
+                            stream_handler=async_responses_stream_handler,
+                        )
                 return
     except PackageNotFoundError:
-        logger.warning("You need to install either `openai` or `ibm-watsonx-ai` to monitor your LLM calls.")
+        logger.warning("You need to install either `openai`, `anthropic` or `ibm-watsonx-ai` to monitor your LLM calls.")
+
+
+# Number of events added to the queue at once when tracking a batch
+BATCH_EVENTS_CHUNK_SIZE = 1000
+
+
+def _iter_openai_file_lines(client, file_id):
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if line:
+                yield line
+
+
+def _timestamp_to_iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+def track_openai_batch(
+    client,
+    batch,
+    include_input: bool = True,
+    hash_embedding_inputs: bool = False,
+    app_id: str | None = None,
+) -> int:
+    """
+    Reports each request of a finished OpenAI batch as its own run, with its token usage.
+
+    The results are streamed line by line and their events added to the queue in
+    chunks. Run ids are derived from the batch id and the `custom_id` of each request.
+
+    Parameters:
+        client: The (sync) OpenAI client the batch was created with.
+        batch: The batch, or its id.
+        include_input (bool, optional): Also reads the batch input file to report the
+            input of each request. Inputs are kept in memory until their result is read.
+        hash_embedding_inputs (bool, optional): Same as in `monitor()`, for embedding batches.
+        app_id (str, optional): The project to report the runs to.
+
+    Returns:
+        The number of runs tracked.
+    """
+    if isinstance(batch, str):
+        batch = client.batches.retrieve(batch)
+
+    result_file_ids = [file_id for file_id in (batch.output_file_id, batch.error_file_id) if file_id]
+    if not result_file_ids:
+        logger.warning(f"Batch {batch.id} has no results yet (status: {batch.status})")
+        return 0
+
+    # custom_id -> (endpoint, parsed input, params)
+    requests_by_id = {}
+    if include_input and batch.input_file_id:
+        for line in _iter_openai_file_lines(client, batch.input_file_id):
+            try:
+                request = json.loads(line)
+                body = request.get("body") or {}
+                endpoint = request.get("url") or batch.endpoint
+                requests_by_id[request["custom_id"]] = (
+                    endpoint,
+                    OpenAIUtils.parse_batch_request(endpoint, body, hash_embedding_inputs),
+                    filter_params(body),
+                )
+            except Exception:
+                logger.exception("Error parsing batch input line")
+
+    parent_run_id = run_manager.current_run_id
+    started_at = _timestamp_to_iso(batch.in_progress_at or batch.created_at)
+    tracked = 0
+    events = []
+
+    try:
+        for file_id in result_file_ids:
+            for line in _iter_openai_file_lines(client, file_id):
+                try:
+                    result = json.loads(line)
+                    custom_id = result.get("custom_id")
+                    response = result.get("response") or {}
+                    body = response.get("body") or {}
+
+                    endpoint, parsed_input, params = requests_by_id.pop(custom_id, (batch.endpoint, None, None))
+                    run_type = BATCH_RUN_TYPES.get(endpoint)
+                    if run_type is None:
+                        continue
+
+                    name = body.get("model") or (parsed_input or {}).get("name")
+                    run_id = str(create_uuid_from_string(f"{batch.id}:{custom_id}"))
+                    ended_at = _timestamp_to_iso(body.get("created") or body.get("created_at") or batch.completed_at)
+
+                    track_event(
+                        run_type,
+                        "start",
+                        run_id,
+                        parent_run_id=parent_run_id,
+                        name=name,
+                        input=parsed_input["input"] if parsed_input else None,
+                        params=params,
+                        metadata={"batch_id": batch.id, "custom_id": custom_id},
+                        timestamp=started_at,
+                        app_id=app_id,
+                        callback_queue=events,
+                    )
+
+                    error = result.get("error")
+                    if error is None and (response.get("status_code") or 200) >= 400:
+                        error = body.get("error") or {"message": f"HTTP {response.get('status_code')}"}
+
+                    if error is not None:
+                        track_event(
+                            run_type,
+                            "error",
+                            run_id,
+                            error={"message": error.get("message") or json.dumps(error)},
+                            timestamp=ended_at,
+                            app_id=app_id,
+                            callback_queue=events,
+                        )
+                    else:
+                        parsed_output = OpenAIUtils.parse_batch_response(endpoint, body) or {}
+                        track_event(
+                            run_type,
+                            "end",
+                            run_id,
+                            name=name,
+                            output=parsed_output.get("output"),
+                            token_usage=parsed_output.get("tokensUsage"),
+                            timestamp=ended_at,
+                            app_id=app_id,
+                            callback_queue=events,
+                        )
+                    tracked += 1
+                except Exception:
+                    logger.exception("Error parsing batch result line")
+
+                if len(events) >= BATCH_EVENTS_CHUNK_SIZE:
+                    queue.append(events)
+                    events = []
+    finally:
+        if events:
+            queue.append(events)
+
+    return tracked
+
+
+class _TracePlan:
+    """
+    Everything a decorated function reports that doesn't depend on the call,
+    resolved once at decoration time and shared by all its calls.
+    """
+
+    __slots__ = (
+        "type",
+        "name",
+        "user_id",
+        "user_props",
+        "tags",
+        "app_id",
+        "get_app_id",
+        "get_input",
+        "output_mode",
+        "output_limit",
+    )
+
+    def __init__(
+        self,
+        type,
+        name,
+        user_id,
+        user_props,
+        tags,
+        app_id,
+        get_input,
+        is_method=False,
+        output_mode: OutputMode = "join",
+        output_limit: int | None = None,
+    ):
+        if output_mode not in DEFAULT_OUTPUT_LIMITS:
+            raise ValueError(f"Invalid output_mode '{output_mode}', expected one of {list(DEFAULT_OUTPUT_LIMITS)}")
+        self.type = type
+        self.name = name
+        self.user_id = user_id
+        self.user_props = user_props
+        self.tags = tags
+        # `class_chain` accepts a callable returning the app id of the instance
+        self.app_id = None if is_method and callable(app_id) else app_id
+        self.get_app_id = app_id if is_method and callable(app_id) else None
+        self.get_input = get_input
+        # How the items yielded by generators are reported
+        self.output_mode = output_mode
+        self.output_limit = output_limit
+
+    def resolve_app_id(self, args):
+        if self.get_app_id is None:
+            return self.app_id
+        return self.get_app_id(args[0])
+
+    def start(self, args, kwargs, app_id) -> Run:
+        """
+        Starts the run of a call. The Lunary specific keyword arguments (`parent`,
+        `metadata`, `user_id`, `user_props`, `tags`) are removed from `kwargs`.
+        """
+        params = {}
+        metadata = template_id = call_user_id = call_user_props = call_tags = None
+        if kwargs:
+            parent_run_id = kwargs.pop("parent") if "parent" in kwargs else run_manager.current_run_id
+            params = filter_params(kwargs)
+            metadata = kwargs.pop("metadata", None)
+        else:
+            parent_run_id = run_manager.current_run_id
+
+        # Raises a ValueError when `input_arg` is missing, before any run is started
+        input = self.get_input(args, kwargs)
+
+        if kwargs:
+            call_user_id = kwargs.pop("user_id", None)
+            call_user_props = kwargs.pop("user_props", None)
+            call_tags = kwargs.pop("tags", None)
+            template_id = (kwargs.get("extra_headers") or {}).get("Template-Id")
+
+        run = run_manager.start_run(parent_run_id=parent_run_id)
+        try:
+            track_event(
+                self.type,
+                "start",
+                run_id=run.id,
+                parent_run_id=parent_run_id,
+                input=input,
+                name=self.name,
+                user_id=call_user_id or user_ctx.get() or self.user_id,
+                user_props=call_user_props or self.user_props or user_props_ctx.get(),
+                params=params,
+                metadata=metadata,
+                tags=call_tags or self.tags or tags_ctx.get(),
+                template_id=template_id,
+                app_id=app_id,
+            )
+        except Exception as e:
+            logger.exception(e)
+        return run
+
+    def end(self, run: Run, output, app_id, metadata=None) -> None:
+        try:
+            track_event(
+                self.type,
+                "end",
+                run.id,
+                name=self.name,
+                output=default_output_parser(output)["output"],
+                metadata=metadata,
+                app_id=app_id,
+            )
+        except Exception as e:
+            logger.exception(e)
+
+    def error(self, run: Run, e: BaseException, app_id) -> None:
+        track_event(
+            self.type,
+            "error",
+            run.id,
+            error={"message": str(e), "stack": traceback.format_exc()},
+            app_id=app_id,
+        )
+
+
+def _default_input_getter(args, kwargs):
+    return default_input_parser(*args, **kwargs)["input"]
+
+
+def _chain_input_getter(fn, input_arg: str | None, is_method: bool = False):
+    """
+    Returns the function extracting the input of a `chain` or `class_chain` call.
+    The position of `input_arg` in the signature of `fn` is looked up only once.
+    """
+    if input_arg is None:
+        parser = method_input_parser if is_method else default_input_parser
+        return lambda args, kwargs: parser(*args, **kwargs)
+
+    param_names = list(signature(fn).parameters.keys())
+    arg_index = param_names.index(input_arg) if input_arg in param_names else None
+    if is_method and arg_index == 0:
+        # `self` is never the input
+        arg_index = None
+    error_message = f"Specified input argument '{input_arg}' not found in {'method' if is_method else 'function'} call"
+
+    def get_input(args, kwargs):
+        input_value = None
+        if arg_index is not None and arg_index < len(args):
+            input_value = args[arg_index]
+
+        if input_arg in kwargs:
+            input_value = kwargs[input_arg]
+
+        if input_value is None:
+            raise ValueError(error_message)
+
+        return input_value
+
+    return get_input
+
+
+def _trace_function(fn, plan: _TracePlan):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        app_id = plan.resolve_app_id(args)
+        run = plan.start(args, kwargs, app_id)
+        try:
+            try:
+                output = fn(*args, **kwargs)
+            except Exception as e:
+                plan.error(run, e, app_id)
+                raise
+
+            plan.end(run, output, app_id)
+            return output
+        finally:
+            run_manager.end_run(run.id)
+
+    return wrapper
+
+
+def _trace_coroutine_function(fn, plan: _TracePlan):
+    # The run starts when the coroutine is awaited, and is the current run of
+    # the awaiting task (and of the tasks it spawns) until the coroutine returns.
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        app_id = plan.resolve_app_id(args)
+        run = plan.start(args, kwargs, app_id)
+        try:
+            try:
+                output = await fn(*args, **kwargs)
+            except (Exception, asyncio.CancelledError) as e:
+                plan.error(run, e, app_id)
+                raise
+
+            plan.end(run, output, app_id)
+            return output
+        finally:
+            run_manager.end_run(run.id)
+
+    return wrapper
+
+
+def _generator_end_metadata(buffer: OutputBuffer, timer: StreamTimer, cancelled: bool = False):
+    metrics = timer.get_metrics()
+    metrics["items"] = buffer.count
+    metadata = {"metrics": metrics}
+    if buffer.truncated:
+        metadata["outputTruncated"] = True
+    if cancelled:
+        metadata["cancelled"] = True
+    return metadata
+
+
+def _trace_generator_function(fn, plan: _TracePlan):
+    # The run starts on the first `next()` and stays open until the generator is
+    # exhausted or closed. It is only the current run while the generator is running,
+    # so runs started by the caller between two items aren't attached to it.
+    # Closing the generator early is reported as a cancelled run, with the output so far.
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        app_id = plan.resolve_app_id(args)
+        run = plan.start(args, kwargs, app_id)
+        timer = StreamTimer()
+        buffer = OutputBuffer(plan.output_mode, plan.output_limit)
+        try:
+            generator = fn(*args, **kwargs)
+            value, error = None, None
+            while True:
+                try:
+                    item = generator.throw(error) if error is not None else generator.send(value)
+                except StopIteration as e:
+                    plan.end(run, buffer.get_output(), app_id, _generator_end_metadata(buffer, timer))
+                    return e.value
+                except Exception as e:
+                    plan.error(run, e, app_id)
+                    raise
+
+                timer.tick()
+                buffer.add(item)
+                run_manager.suspend_run(run)
+                value, error = None, None
+                try:
+                    value = yield item
+                except GeneratorExit:
+                    generator.close()
+                    plan.end(run, buffer.get_output(), app_id, _generator_end_metadata(buffer, timer, cancelled=True))
+                    raise
+                except BaseException as e:
+                    error = e
+                run_manager.resume_run(run)
+        finally:
+            run_manager.end_run(run.id)
+
+    return wrapper
+
+
+def _trace_async_generator_function(fn, plan: _TracePlan):
+    # Same as `_trace_generator_function`. The task consuming the generator being
+    # cancelled while it runs is also reported as a cancelled run.
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        app_id = plan.resolve_app_id(args)
+        run = plan.start(args, kwargs, app_id)
+        timer = StreamTimer()
+        buffer = OutputBuffer(plan.output_mode, plan.output_limit)
+        try:
+            generator = fn(*args, **kwargs)
+            value, error = None, None
+            while True:
+                try:
+                    item = await (generator.athrow(error) if error is not None else generator.asend(value))
+                except StopAsyncIteration:
+                    plan.end(run, buffer.get_output(), app_id, _generator_end_metadata(buffer, timer))
+                    return
+                except asyncio.CancelledError:
+                    plan.end(run, buffer.get_output(), app_id, _generator_end_metadata(buffer, timer, cancelled=True))
+                    raise
+                except Exception as e:
+                    plan.error(run, e, app_id)
+                    raise
+
+                timer.tick()
+                buffer.add(item)
+                run_manager.suspend_run(run)
+                value, error = None, None
+                try:
+                    value = yield item
+                except GeneratorExit:
+                    await generator.aclose()
+                    plan.end(run, buffer.get_output(), app_id, _generator_end_metadata(buffer, timer, cancelled=True))
+                    raise
+                except BaseException as e:
+                    error = e
+                run_manager.resume_run(run)
+        finally:
+            run_manager.end_run(run.id)
+
+    return wrapper
+
+
+def _trace(fn, plan: _TracePlan):
+    """Builds the single wrapper used for every call of a decorated function, matching its kind."""
+    if isasyncgenfunction(fn):
+        return _trace_async_generator_function(fn, plan)
+    if iscoroutinefunction(fn):
+        return _trace_coroutine_function(fn, plan)
+    if isgeneratorfunction(fn):
+        return _trace_generator_function(fn, plan)
+    return _trace_function(fn, plan)
+
+
+def agent(
+    name=None,
+    user_id=None,
+    user_props=None,
+    tags=None,
+    app_id=None,
+    output_mode: OutputMode = "join",
+    output_limit: int | None = None,
+):
+    """
+    Traces the decorated function as an agent run. Sync and async functions and
+    generators are supported.
+
+    For generators, the run stays open until the generator is exhausted or closed,
+    and the yielded items are reported according to `output_mode`: "join"
+    concatenates the yielded strings (up to `output_limit` characters), "first"
+    and "last" keep the first or last `output_limit` items.
+    """
+    def decorator(fn):
+        plan = _TracePlan(
+            "agent",
+            name or fn.__name__,
+            user_id,
+            user_props,
+            tags,
+            app_id,
+            _default_input_getter,
+            output_mode=output_mode,
+            output_limit=output_limit,
+        )
+        return _trace(fn, plan)
+
+    return decorator
+
+def chain(
+    name: Optional[str] = None,
+    user_id: Optional[str] = None,
+    user_props: Optional[dict] = None,
+    tags: Optional[list] = None,
+    app_id: Optional[str] = None,
+    input_arg: Optional[str] = None,
+    output_mode: OutputMode = "join",
+    output_limit: Optional[int] = None,
+):
+    """Traces the decorated function as a chain run. See `agent` for generators."""
+    def decorator(fn):
+        plan = _TracePlan(
+            "chain",
+            name or fn.__name__,
+            user_id,
+            user_props,
+            tags,
+            app_id,
+            _chain_input_getter(fn, input_arg),
+            output_mode=output_mode,
+            output_limit=output_limit,
+        )
+        return _trace(fn, plan)
+
+    return decorator
+
+def class_chain(
+    name: Optional[str] = None,
+    user_id: Optional[str] = None,
+    user_props: Optional[dict] = None,
+    tags: Optional[list] = None,
+    app_id: Optional[str | Callable] = None,
+    input_arg: Optional[str] = None,
+    output_mode: OutputMode = "join",
+    output_limit: Optional[int] = None,
+):
+    """Traces the decorated method as a chain run. See `agent` for generators."""
+    def decorator(fn):
+        plan = _TracePlan(
+            "chain",
+            name or fn.__name__,
+            user_id,
+            user_props,
+            tags,
+            app_id,
+            _chain_input_getter(fn, input_arg, is_method=True),
+            is_method=True,
+            output_mode=output_mode,
+            output_limit=output_limit,
+        )
+        return _trace(fn, plan)
+
+    return decorator
+
+def tool(
+    name=None,
+    user_id=None,
+    user_props=None,
+    tags=None,
+    app_id=None,
+    output_mode: OutputMode = "join",
+    output_limit: int | None = None,
+):
+    """Traces the decorated function as a tool run. See `agent` for generators."""
+    def decorator(fn):
+        plan = _TracePlan(
+            "tool",
+            name or fn.__name__,
+            user_id,
+            user_props,
+            tags,
+            app_id,
+            _default_input_getter,
+            output_mode=output_mode,
+            output_limit=output_limit,
+        )
+        return _trace(fn, plan)
+
+    return decorator
+
+
+try:
+    import httpx
+    from uuid import uuid4
+    from .httpx_utils import (
+        CapturedExchange,
+        capture_response,
+        classify_request,
+        HostAllowlist,
+        HTTPX_MODULES,
+        REQUEST_NOT_READ_ERRORS,
+    )
+
+    # Extra hosts traced by `instrument_httpx()`, besides the providers' own
+    _instrumented_hosts: HostAllowlist | None = None
+
+    def _start_http_exchange(request: httpx.Request, hosts: HostAllowlist | None) -> CapturedExchange | None:
+        try:
+            endpoint = classify_request(request, hosts)
+            if endpoint is None:
+                return None
+
+            try:
+                exchange = CapturedExchange(endpoint, str(uuid4()), request, _end_http_exchange)
+            except REQUEST_NOT_READ_ERRORS:
+                # Streamed request body, can't be captured without consuming it
+                return None
+
+            # Input, name, params and template are filled by the consumer, from the raw request
+            track_event(
+                exchange.run_type,
+                "start",
+                exchange.run_id,
+                parent_run_id=run_manager.current_run_id,
+                callback_queue=exchange.events,
+            )
+            return exchange
+        except Exception:
+            logger.exception("Error tracing LLM call")
+            return None
+
+    def _end_http_exchange(exchange: CapturedExchange) -> None:
+        track_event(exchange.run_type, "end", exchange.run_id, callback_queue=exchange.events)
+        if len(exchange.events) == 2:
+            queue.append(exchange)
+
+    def _handle_traced_request(handle_request, request: httpx.Request, hosts: HostAllowlist | None) -> httpx.Response:
+        exchange = _start_http_exchange(request, hosts)
+        if exchange is None:
+            return handle_request(request)
+
+        try:
+            response = handle_request(request)
+        except Exception as e:
+            exchange.finish(e)
+            raise
+
+        capture_response(response, exchange)
+        return response
+
+    async def _handle_traced_async_request(
+        handle_async_request, request: httpx.Request, hosts: HostAllowlist | None
+    ) -> httpx.Response:
+        exchange = _start_http_exchange(request, hosts)
+        if exchange is None:
+            return await handle_async_request(request)
+
+        try:
+            response = await handle_async_request(request)
+        except Exception as e:
+            exchange.finish(e)
+            raise
+
+        capture_response(response, exchange, is_async=True)
+        return response
+
+    class LunaryTransport(httpx.BaseTransport):
+        """
+        Wraps an httpx transport to trace the LLM API calls (OpenAI, Azure OpenAI
+        and Anthropic endpoints) made through it. Other requests, and response
+        bodies, pass through untouched.
+
+        Calls to other OpenAI-compatible servers are only traced if their host is
+        in `hosts` (e.g. `["localhost:8000", "*.internal.example"]`).
+
+        Example:
+            client = OpenAI(http_client=httpx.Client(transport=lunary.LunaryTransport()))
+        """
+
+        def __init__(self, transport: httpx.BaseTransport | None = None, hosts: Iterable[str] | None = None):
+            self._transport = transport or httpx.HTTPTransport()
+            self._hosts = HostAllowlist(hosts) if hosts else None
+
+        def handle_request(self, request: httpx.Request) -> httpx.Response:
+            return _handle_traced_request(self._transport.handle_request, request, self._hosts)
+
+        def close(self) -> None:
+            self._transport.close()
+
+    class AsyncLunaryTransport(httpx.AsyncBaseTransport):
+        """Async version of `LunaryTransport`."""
+
+        def __init__(self, transport: httpx.AsyncBaseTransport | None = None, hosts: Iterable[str] | None = None):
+            self._transport = transport or httpx.AsyncHTTPTransport()
+            self._hosts = HostAllowlist(hosts) if hosts else None
 
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            return await _handle_traced_async_request(self._transport.handle_async_request, request, self._hosts)
 
-def agent(name=None, user_id=None, user_props=None, tags=None, app_id=None):
-    def decorator(fn):
-        return wrap(
-            fn,
-            "agent",
-            name=name or fn.__name__,
-            user_id=user_id,
-            user_props=user_props,
-            tags=tags,
-            input_parser=default_input_parser,
-            app_id=app_id
-        )
+        async def aclose(self) -> None:
+            await self._transport.aclose()
 
-    return decorator
+    def instrument_httpx(hosts: Iterable[str] | None = None) -> None:
+        """
+        Traces the LLM API calls made by every httpx (and httpx2) client using the
+        default transports, including clients created inside third-party libraries.
 
-def chain(
-    name: Optional[str] = None,
-    user_id: Optional[str] = None,
-    user_props: Optional[dict] = None,
-    tags: Optional[list] = None,
-    app_id: Optional[str] = None,
-    input_arg: Optional[str] = None
-):
-    def decorator(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwargs):
-            if input_arg is not None:
-                from inspect import signature
-                sig = signature(fn)
-                param_names = list(sig.parameters.keys())
-                
-                input_value = None
-                
-                if input_arg in param_names:
-                    arg_index = param_names.index(input_arg)
-                    if arg_index < len(args):
-                        input_value = args[arg_index]
-                
-                if input_arg in kwargs:
-                    input_value = kwargs[input_arg]
-                
-                if input_value is None:
-                    raise ValueError(f"Specified input argument '{input_arg}' not found in function call")
-                
-                parsed_input = {"input": input_value}
-            else:
-                raw_input = default_input_parser(*args, **kwargs)
-                parsed_input = {"input": raw_input}
-            
-            return wrap(
-                fn,
-                "chain",
-                name=name or fn.__name__,
-                user_id=user_id,
-                user_props=user_props,
-                tags=tags,
-                input_parser=lambda *a, **kw: parsed_input,
-                app_id=app_id
-            )(*args, **kwargs)
-        
-        return wrapper
-    return decorator
+        Only calls to the OpenAI, Azure OpenAI and Anthropic APIs are traced, plus
+        the ones sent to `hosts` (e.g. `["localhost:8000", "*.internal.example"]`),
+        for self-hosted or proxied OpenAI-compatible servers.
 
-def class_chain(
-    name: Optional[str] = None,
-    user_id: Optional[str] = None,
-    user_props: Optional[dict] = None,
-    tags: Optional[list] = None,
-    app_id: Optional[str | Callable] = None,
-    input_arg: Optional[str] = None
-):
-    def decorator(fn):
-        @wraps(fn)
-        def wrapper(self, *args, **kwargs):
-            actual_app_id = app_id(self) if callable(app_id) else app_id
+        Don't combine it with `monitor()` on the same client, or its calls will be reported twice.
+        """
+        global _instrumented_hosts
+        _instrumented_hosts = HostAllowlist(hosts) if hosts else None
 
-            if input_arg is not None:
-                sig = signature(fn)
-                param_names = list(sig.parameters.keys())[1:]  # Skip 'self'
-                
-                input_value = None
-                
-                if input_arg in param_names:
-                    arg_index = param_names.index(input_arg)
-                    if arg_index < len(args):
-                        input_value = args[arg_index]
-                
-                if input_arg in kwargs:
-                    input_value = kwargs[input_arg]
-                
-                if input_value is None:
-                    raise ValueError(f"Specified input argument '{input_arg}' not found in method call")
-                
-                parsed_input = {"input": input_value}
-                custom_parser = lambda self, *a, **kw: parsed_input
-            else:
-                custom_parser = lambda self, *a, **kw: {"input": method_input_parser(self, *a, **kw)}
-
-            return wrap(
-                fn,
-                "chain",
-                name=name or fn.__name__,
-                user_id=user_id,
-                user_props=user_props,
-                tags=tags,
-                input_parser=custom_parser,
-                app_id=actual_app_id
-            )(self, *args, **kwargs)
-        return wrapper
-    return decorator
+        for module in HTTPX_MODULES:
+            if getattr(module.HTTPTransport.handle_request, "__lunary_original__", None) is not None:
+                continue
 
-def tool(name=None, user_id=None, user_props=None, tags=None, app_id=None):
-    def decorator(fn):
-        return wrap(
-            fn,
-            "tool",
-            name=name or fn.__name__,
-            user_id=user_id,
-            user_props=user_props,
-            tags=tags,
-            input_parser=default_input_parser,
-            app_id=app_id
-        )
+            def patch(handle_request, handle_async_request):
+                @wraps(handle_request)
+                def traced_handle_request(self, request):
+                    return _handle_traced_request(
+                        lambda request: handle_request(self, request), request, _instrumented_hosts
+                    )
 
-    return decorator
+                @wraps(handle_async_request)
+                async def traced_handle_async_request(self, request):
+                    return await _handle_traced_async_request(
+                        lambda request: handle_async_request(self, request), request, _instrumented_hosts
+                    )
+
+                traced_handle_request.__lunary_original__ = handle_request
+                traced_handle_async_request.__lunary_original__ = handle_async_request
+                return traced_handle_request, traced_handle_async_request
+
+            module.HTTPTransport.handle_request, module.AsyncHTTPTransport.handle_async_request = patch(
+                module.HTTPTransport.handle_request, module.AsyncHTTPTransport.handle_async_request
+            )
+
+    def uninstrument_httpx() -> None:
+        """Reverts `instrument_httpx()`."""
+        global _instrumented_hosts
+        _instrumented_hosts = None
+
+        for module in HTTPX_MODULES:
+            original = getattr(module.HTTPTransport.handle_request, "__lunary_original__", None)
+            if original is not None:
+                module.HTTPTransport.handle_request = original
+                module.AsyncHTTPTransport.handle_async_request = (
+                    module.AsyncHTTPTransport.handle_async_request.__lunary_original__
+                )
 
+except ImportError:
+    # httpx is only needed to trace LLM calls at the HTTP level
+    pass
 
 try:
     import importlib.metadata
+    import fnmatch
     import logging
     import os
+    import re
     import traceback
     import warnings
     from contextvars import ContextVar
-    from typing import Any, Dict, List, Union, cast, Sequence, Optional, TypedDict
+    from typing import Any, Dict, List, Literal, Union, cast, Sequence, Optional, TypedDict
     from uuid import UUID
 
     import requests
@@ -980,6 +1780,65 @@ try:
         name: List[str]
         ignore_children: bool
 
+    def _normalize_run_type(run_type: Union[str, None]) -> Union[str, None]:
+        # Agents are treated as chains in Lunary
+        return "chain" if run_type == "agent" else run_type
+
+    class _IgnoreMatcher:
+        """
+        Ignore rules compiled once into a single regex per run type.
+        Each rule is a named group of the regex, so the first matching rule
+        (in declaration order) can be found with one `match` call.
+        """
+
+        def __init__(self, rules: List[IgnoreRule]) -> None:
+            rules = [
+                rule
+                for rule in rules
+                if isinstance(rule.get("name"), list) and rule["name"]
+            ]
+            untyped_rules = [rule for rule in rules if not rule.get("type")]
+            run_types = {_normalize_run_type(rule.get("type")) for rule in rules} - {None}
+
+            self._untyped = self._compile(untyped_rules)
+            self._by_type = {
+                run_type: self._compile(
+                    [
+                        rule
+                        for rule in rules
+                        if not rule.get("type")
+                        or _normalize_run_type(rule["type"]) == run_type
+                    ]
+                )
+                for run_type in run_types
+            }
+
+        @staticmethod
+        def _compile(rules: List[IgnoreRule]):
+            if not rules:
+                return None
+
+            alternatives = [
+                f"(?P<r{index}>"
+                + "|".join(fnmatch.translate(str(pattern)) for pattern in rule["name"])
+                + ")"
+                for index, rule in enumerate(rules)
+            ]
+            return re.compile("|".join(alternatives)), rules
+
+        def match(self, run_type: Union[str, None], name: Union[str, None]) -> Union[IgnoreRule, None]:
+            """Returns the first rule matching the run type and name, or None."""
+            if not name:
+                return None
+
+            compiled = self._by_type.get(_normalize_run_type(run_type), self._untyped)
+            if compiled is None:
+                return None
+
+            regex, rules = compiled
+            match = regex.match(str(name))
+            return rules[int(match.lastgroup[1:])] if match else None
+
     class LunaryCallbackHandler(BaseCallbackHandler):
         """Callback Handler for Lunary`.
 
@@ -995,6 +1854,10 @@ try:
                 - `ignore_children`: Whether to ignore children of matching runs (default: True)
                 Events matching these rules will not be sent to Lunary. By default, children
                 of ignored runs are also ignored unless `ignore_children` is set to False.
+            - `ignore_mode`: What to send for ignored runs. With `"placeholder"` (default),
+            their events are still sent, with `__NOT_INGESTED__` as input and output.
+            With `"drop"`, nothing is sent at all, and tracked descendants of an
+            ignored run are attached to its nearest tracked ancestor.
 
         #### Raises:
             - `ValueError`: if `app_id` is not provided either as an
@@ -1021,14 +1884,18 @@ try:
 
         __app_id: str
         __api_url: str
-        __ignore_rules: List[IgnoreRule]
+        __ignore_matcher: _IgnoreMatcher
+        __drop_ignored_runs: bool
 
         def __init__(
             self,
             app_id: Union[str, None] = None,
             api_url: Union[str, None] = None,
             ignore: Union[List[IgnoreRule], None] = None,
+            ignore_mode: Literal["placeholder", "drop"] = "placeholder",
         ) -> None:
+            if ignore_mode not in ("placeholder", "drop"):
+                raise ValueError(f"Invalid ignore_mode '{ignore_mode}', expected one of ['placeholder', 'drop']")
             super().__init__()
             config = get_config()
             try:
@@ -1066,65 +1933,76 @@ try:
                 self.__has_valid_config = False
 
             self.__api_url = api_url or config.api_url or None
-            self.__ignore_rules = ignore or []
+            self.__ignore_matcher = _IgnoreMatcher(ignore or [])
+            self.__drop_ignored_runs = ignore_mode == "drop"
 
             self.queue = queue
 
             if self.__has_valid_config is False:
                 return None
 
-        def _get_matching_ignore_rule(self, run_type: str = None, name: str = None) -> Union[IgnoreRule, None]:
+        def _resolve_ignore(self, run: Run, run_type: str, name: Union[str, None] = None) -> bool:
             """
-            Find the first matching ignore rule for the given run type and name.
-            Returns the matching rule or None if no match.
+            Decides once, when the run starts, whether it should be ignored.
+            A run is ignored if it matches an ignore rule, or if its parent is
+            ignored and the parent's rule also ignores children.
             """
-            if not self.__ignore_rules:
-                return None
-                
-            for rule in self.__ignore_rules:
-                rule_type = rule.get("type")
-                if rule_type == "agent":
-                    rule_type = "chain"  # Agents are treated as chains in Lunary
-                if rule_type and run_type and rule_type != run_type:
-                    continue
-                
-                if "name" in rule and isinstance(rule["name"], list):
-                    if name and self._matches_any_pattern(name, rule["name"]):
-                        return rule
-            
-            return None
+            matching_rule = self.__ignore_matcher.match(run_type, name)
+            if matching_rule is not None:
+                run.ignored = True
+                run.ignore_children = matching_rule.get("ignore_children", True)
+                return True
+
+            parent = run_manager.runs.get(run.parent_run_id) if run.parent_run_id else None
+            if parent is not None and parent.ignored and parent.ignore_children:
+                run.ignored = True
+                run.ignore_children = True
+                return True
+
+            return False
 
-        def _should_ignore_run(self, run_id: str, run_type: str = None, name: str = None) -> bool:
+        def _get_parent_run_id(self, run: Run) -> Union[str, None]:
             """
-            Check if a run should be ignored based on filtering rules or parent hierarchy.
-            Returns True if the run or any of its ancestors should be ignored.
+            Parent reported for a tracked run. When ignored runs are dropped,
+            the run is attached to its nearest ancestor that is actually sent.
             """
-            # Check if this run matches any ignore rule
-            matching_rule = self._get_matching_ignore_rule(run_type, name)
-            if matching_rule:
-                return True
-            
-            # Check parent hierarchy for inherited ignoring
+            if not self.__drop_ignored_runs:
+                return run.parent_run_id
+
+            parent = run_manager.runs.get(run.parent_run_id) if run.parent_run_id else None
+            while parent is not None and parent.ignored:
+                parent = run_manager.runs.get(parent.parent_run_id) if parent.parent_run_id else None
+            return parent.id if parent else None
+
+        def _track_ignored_event(
+            self,
+            run_type: str,
+            event_name: str,
+            run_id: str,
+            parent_run_id: Union[str, None] = None,
+            name: Union[str, None] = None,
+        ) -> None:
+            if self.__drop_ignored_runs:
+                return
+
+            self.__track_event(
+                run_type,
+                event_name,
+                run_id=run_id,
+                parent_run_id=parent_run_id,
+                name=name,
+                input="__NOT_INGESTED__",
+                output="__NOT_INGESTED__",
+                app_id=self.__app_id,
+                api_url=self.__api_url,
+                callback_queue=self.queue,
+                runtime="langchain-py",
+            )
+
+        def _is_ignored_run(self, run_id: Union[UUID, str]) -> bool:
+            """Whether an already started run was ignored. Must be called before the run is ended."""
             run = run_manager.runs.get(str(run_id))
-            while run and run.parent_run_id:
-                parent = run_manager.runs.get(run.parent_run_id)
-                if parent and hasattr(parent, '_ignored') and parent._ignored:
-                    # Check if parent has ignore_children=False
-                    if hasattr(parent, '_ignore_children') and not parent._ignore_children:
-                        # Parent is ignored but doesn't ignore children, so this run is not ignored
-                        return False
-                    return True
-                run = parent
-            
-            return False
-        
-        def _matches_any_pattern(self, name: str, patterns: List[str]) -> bool:
-            """Check if name matches any of the patterns (supports * wildcard)."""
-            import fnmatch
-            for pattern in patterns:
-                if fnmatch.fnmatch(name, pattern):
-                    return True
-            return False
+            return run is not None and run.ignored
 
         def on_llm_start(
             self,
@@ -1160,20 +2038,8 @@ try:
                     or params.get("azure_deployment")
                 )
                 
-                if self._should_ignore_run(run.id, run_type="llm"):
-                    self.__track_event(
-                        "llm",
-                        "start",
-                        run_id=run.id,
-                        parent_run_id=run.parent_run_id,
-                        name=name,
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._resolve_ignore(run, "llm", name):
+                    self._track_ignored_event("llm", "start", run.id, parent_run_id=run.parent_run_id, name=name)
                     return
 
                 if not name and "anthropic" in params.get("_type"):
@@ -1187,7 +2053,7 @@ try:
                     "start",
                     user_id=user_id,
                     run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    parent_run_id=self._get_parent_run_id(run),
                     name=name,
                     input=input,
                     tags=tags,
@@ -1236,20 +2102,8 @@ try:
                     or params.get("azure_deployment")
                 )
                 
-                if self._should_ignore_run(run.id, run_type="llm"):
-                    self.__track_event(
-                        "llm",
-                        "start",
-                        run_id=run.id,
-                        parent_run_id=run.parent_run_id,
-                        name=name,
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._resolve_ignore(run, "llm", name):
+                    self._track_ignored_event("llm", "start", run.id, parent_run_id=run.parent_run_id, name=name)
                     return
 
                 if not name and "anthropic" in params.get("_type"):
@@ -1263,7 +2117,7 @@ try:
                     "start",
                     user_id=user_id,
                     run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    parent_run_id=self._get_parent_run_id(run),
                     name=name,
                     input=input,
                     tags=tags,
@@ -1287,18 +2141,8 @@ try:
             **kwargs: Any,
         ) -> None:
             try:
-                if self._should_ignore_run(str(run_id), run_type="llm"):
-                    self.__track_event(
-                        "llm",
-                        "end",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("llm", "end", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1357,20 +2201,8 @@ try:
                 user_props = _get_user_props(metadata)
                 name = serialized.get("name")
                 
-                if self._should_ignore_run(run.id, run_type="tool", name=name):
-                    self.__track_event(
-                        "tool",
-                        "start",
-                        run_id=run.id,
-                        parent_run_id=run.parent_run_id,
-                        name=name,
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._resolve_ignore(run, "tool", name):
+                    self._track_ignored_event("tool", "start", run.id, parent_run_id=run.parent_run_id, name=name)
                     return
 
                 self.__track_event(
@@ -1378,7 +2210,7 @@ try:
                     "start",
                     user_id=user_id,
                     run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    parent_run_id=self._get_parent_run_id(run),
                     name=name,
                     input=input_str,
                     tags=tags,
@@ -1402,18 +2234,8 @@ try:
             **kwargs: Any,
         ) -> None:
             try:
-                if self._should_ignore_run(str(run_id), run_type="tool"):
-                    self.__track_event(
-                        "tool",
-                        "end",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("tool", "end", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1469,26 +2291,8 @@ try:
                     type = "chain"
                     name = kwargs.get("name", name)
 
-                if self._should_ignore_run(run.id, run_type=type, name=name):
-                    run._ignored = True
-                    matching_rule = self._get_matching_ignore_rule(run_type=type, name=name)
-                    if matching_rule:
-                        run._ignore_children = matching_rule.get("ignore_children", True)
-                    else:
-                        run._ignore_children = True  # Default behavior
-                    self.__track_event(
-                        type,
-                        "start",
-                        run_id=run.id,
-                        parent_run_id=run.parent_run_id,
-                        name=name,
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._resolve_ignore(run, type, name):
+                    self._track_ignored_event(type, "start", run.id, parent_run_id=run.parent_run_id, name=name)
                     return
 
                 user_id = _get_user_id(metadata)
@@ -1500,7 +2304,7 @@ try:
                     "start",
                     user_id=user_id,
                     run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    parent_run_id=self._get_parent_run_id(run),
                     name=name,
                     input=input,
                     tags=tags,
@@ -1523,18 +2327,8 @@ try:
             **kwargs: Any,
         ) -> Any:
             try:
-                if self._should_ignore_run(str(run_id), run_type="chain"):
-                    self.__track_event(
-                        "chain",
-                        "end",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("chain", "end", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1564,18 +2358,8 @@ try:
             **kwargs: Any,
         ) -> Any:
             try:
-                if self._should_ignore_run(str(run_id), run_type="agent"):
-                    self.__track_event(
-                        "agent",
-                        "end",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("agent", "end", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1605,18 +2389,8 @@ try:
             **kwargs: Any,
         ) -> Any:
             try:
-                if self._should_ignore_run(str(run_id), run_type="chain"):
-                    self.__track_event(
-                        "chain",
-                        "error",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("chain", "error", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1644,18 +2418,8 @@ try:
             **kwargs: Any,
         ) -> Any:
             try:
-                if self._should_ignore_run(str(run_id), run_type="tool"):
-                    self.__track_event(
-                        "tool",
-                        "error",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("tool", "error", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1683,18 +2447,8 @@ try:
             **kwargs: Any,
         ) -> Any:
             try:
-                if self._should_ignore_run(str(run_id), run_type="llm"):
-                    self.__track_event(
-                        "llm",
-                        "error",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("llm", "error", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1735,20 +2489,8 @@ try:
                 if name is None and serialized:
                     name = serialized.get("name")
                 
-                if self._should_ignore_run(run.id, run_type="retriever", name=name):
-                    self.__track_event(
-                        "retriever",
-                        "start",
-                        run_id=run.id,
-                        parent_run_id=run.parent_run_id,
-                        name=name,
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._resolve_ignore(run, "retriever", name):
+                    self._track_ignored_event("retriever", "start", run.id, parent_run_id=run.parent_run_id, name=name)
                     return
 
                 self.__track_event(
@@ -1757,7 +2499,7 @@ try:
                     user_id=user_id,
                     user_props=user_props,
                     run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    parent_run_id=self._get_parent_run_id(run),
                     name=name,
                     input=query,
                     app_id=self.__app_id,
@@ -1778,21 +2520,12 @@ try:
             **kwargs: Any,
         ) -> None:
             try:
-                if self._should_ignore_run(str(run_id), run_type="retriever"):
-                    self.__track_event(
-                        "retriever",
-                        "end",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("retriever", "end", str(run_id))
+                    run_manager.end_run(run_id)
                     return
                     
-                run = run_manager.start_run(run_id, parent_run_id)
+                run_id = run_manager.end_run(run_id)
 
                 # only report the metadata
                 doc_metadata = [
@@ -1807,8 +2540,7 @@ try:
                 self.__track_event(
                     "retriever",
                     "end",
-                    run_id=run.id,
-                    parent_run_id=run.parent_run_id,
+                    run_id=run_id,
                     output=doc_metadata,
                     app_id=self.__app_id,
                     api_url=self.__api_url,
@@ -1826,18 +2558,8 @@ try:
             **kwargs: Any,
         ) -> None:
             try:
-                if self._should_ignore_run(str(run_id), run_type="retriever"):
-                    self.__track_event(
-                        "retriever",
-                        "error",
-                        run_id=str(run_id),
-                        input="__NOT_INGESTED__",
-                        output="__NOT_INGESTED__",
-                        app_id=self.__app_id,
-                        api_url=self.__api_url,
-                        callback_queue=self.queue,
-                        runtime="langchain-py",
-                    )
+                if self._is_ignored_run(run_id):
+                    self._track_ignored_event("retriever", "error", str(run_id))
                     run_manager.end_run(run_id)
                     return
                     
@@ -1913,13 +2635,44 @@ def track_feedback(run_id: str, feedback: Dict[str, Any] | Any):
         raise FeedbackError(f"Error tracking feedback: {str(e)}")
 
 
-templateCache = {}
+def _fetch_template_version(base_url: str, token: str, slug: str, etag: str | None):
+    """Fetch function of the template cache (see `TemplateCache.get`) for a template."""
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    if etag:
+        headers["If-None-Match"] = etag
+    response = requests.get(
+        f"{base_url}/v1/template_versions/latest?slug={slug}",
+        headers=headers,
+        verify=get_config().ssl_verify,
+    )
+
+    if response.status_code == 304:
+        return NOT_MODIFIED, etag
+
+    if response.status_code == 401:
+        raise TemplateError("Invalid or unauthorized API credentials")
+
+    if not response.ok:
+        raise TemplateError(f"Error fetching template: {response.status_code} - {response.text}")
+
+    return response.json(), response.headers.get("ETag")
+
 def get_raw_template(slug: str, app_id: str | None = None, api_url: str | None = None):
     """
     Fetches the latest version of a template based on a given slug.
-    If a cached version is available and recent (less than 60 seconds old), 
-    it will return the cached data. Otherwise, it makes an HTTP GET request
-    to fetch the template from the specified or default API.
+    If a cached version is available and recent (less than `template_cache_ttl`
+    seconds old, 60 by default), it will return the cached data. Otherwise, it
+    makes an HTTP GET request to fetch the template from the specified or default API.
+    Concurrent calls for the same template share a single request.
+
+    Expired versions are returned right away while they are refreshed in the
+    background, and keep being returned if the API can't be reached, until they
+    are `template_max_stale` seconds past their expiry (one day by default).
+    Refreshes send the version's ETag, so unchanged templates aren't downloaded again.
+
+    When `template_cache_dir` (or the `LUNARY_TEMPLATE_CACHE_DIR` environment variable)
+    is set, fetched versions are also saved there, and new processes serve them
+    right away while revalidating them.
 
     Parameters:
         slug (str): Unique identifier for the template.
@@ -1940,30 +2693,10 @@ def get_raw_template(slug: str, app_id: str | None = None, api_url: str | None =
         if not token:
             raise TemplateError("No authentication token provided")
 
-        global templateCache
-        now = time.time() * 1000
-        cache_entry = templateCache.get(slug)
-
-        if cache_entry and now - cache_entry["timestamp"] < 60000:
-            return cache_entry["data"]
-
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        response = requests.get(
-            f"{base_url}/v1/template_versions/latest?slug={slug}",
-            headers=headers,
-            verify=config.ssl_verify,
+        return template_cache.get(
+            (base_url, token, slug), lambda etag: _fetch_template_version(base_url, token, slug, etag)
         )
         
-        if response.status_code == 401:
-            raise TemplateError("Invalid or unauthorized API credentials")
-        
-        if not response.ok:
-            raise TemplateError(f"Error fetching template: {response.status_code} - {response.text}")
-
-        data = response.json()
-        templateCache[slug] = {"timestamp": now, "data": data}
-        return data
-        
     except requests.exceptions.RequestException as e:
         raise TemplateError(f"Network error while fetching template: {str(e)}")
     except Exception as e:
@@ -1990,30 +2723,27 @@ async def get_raw_template_async(slug: str, app_id: str | None = None, api_url:
         token = app_id or config.app_id
         api_url = api_url or config.api_url
 
+        async def fetch(etag):
+            headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+            if etag:
+                headers["If-None-Match"] = etag
+
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{api_url}/v1/template_versions/latest?slug={slug}",
+                    headers=headers
+                ) as response:
+                    if response.status == 304:
+                        return NOT_MODIFIED, etag
+
+                    if not response.ok:
+                        raise TemplateError(
+                            f"Error fetching template: {response.status} - {await response.text()}"
+                        )
 
+                    return await response.json(), response.headers.get("ETag")
 
-        global templateCache
-        now = time.time() * 1000
-        cache_entry = templateCache.get(slug)
-
-        if cache_entry and now - cache_entry["timestamp"] < 60000:
-            return cache_entry["data"]
-
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{api_url}/v1/template_versions/latest?slug={slug}",
-                headers=headers
-            ) as response:
-                if not response.ok:
-                    raise TemplateError(
-                        f"Error fetching template: {response.status} - {await response.text()}"
-                    )
-
-                data = await response.json()
-                templateCache[slug] = {"timestamp": now, "data": data}
-                return data
+        return await template_cache.get_async((api_url, token, slug), fetch)
 
     except TemplateError:
         raise
@@ -2023,7 +2753,11 @@ async def get_raw_template_async(slug: str, app_id: str | None = None, api_url:
 def render_template(slug: str, data={}, app_id: str | None = None, api_url: str | None = None):
     """
     Renders a template by populating it with the provided data.
-    Retrieves the raw template, then uses `chevron.render` to substitute variables.
+    Retrieves the raw template, then substitutes the variables with its compiled
+    version (see `template_utils.compile_template`), with the same semantics as `chevron.render`.
+
+    When the render cache is enabled with `lunary.config(render_cache_size=...)`,
+    results are memoized per template version and data, and returned read-only.
 
     Parameters:
         slug (str): Template identifier.
@@ -2043,21 +2777,7 @@ def render_template(slug: str, data={}, app_id: str | None = None, api_url: str
         if raw_template.get("message") == "Template not found, is the project ID correct?":
             raise TemplateError("Template not found, are the project ID and slug correct?")
 
-        template_id = copy.deepcopy(raw_template["id"])
-        content = copy.deepcopy(raw_template["content"])
-        extra = copy.deepcopy(raw_template["extra"])
-        text_mode = isinstance(content, str)
-        extra_headers = {"Template-Id": str(template_id)}
-
-        if text_mode:
-            rendered = chevron.render(content, data)
-            return {"text": rendered, "extra_headers": extra_headers, **extra}
-        else:
-            messages = []
-            for message in content:
-                message["content"] = chevron.render(message["content"], data)
-                messages.append(message)
-            return {"messages": messages, "extra_headers": extra_headers, **extra}
+        return render_cache.render(raw_template, data)
 
     except Exception as e:
         raise TemplateError(f"Error rendering template: {str(e)}")
@@ -2085,28 +2805,77 @@ async def render_template_async(slug: str, data={}, app_id: str | None = None, a
         if raw_template.get("message") == "Template not found, is the project ID correct?":
             raise TemplateError("Template not found, are the project ID and slug correct?")
 
-        template_id = copy.deepcopy(raw_template["id"])
-        content = copy.deepcopy(raw_template["content"])
-        extra = copy.deepcopy(raw_template["extra"])
-        text_mode = isinstance(content, str)
-        extra_headers = {"Template-Id": str(template_id)}
+        return render_cache.render(raw_template, data)
 
-        if text_mode:
-            rendered = chevron.render(content, data)
-            return {"text": rendered, "extra_headers": extra_headers, **extra}
-        else:
-            messages = []
-            for message in content:
-                message["content"] = chevron.render(message["content"], data)
-                messages.append(message)
-            return {"messages": messages, "extra_headers": extra_headers, **extra}
+    except Exception as e:
+        raise TemplateError(f"Error rendering template: {str(e)}")
+
+def render_templates(slug: str, rows, app_id: str | None = None, api_url: str | None = None, processes: int | None = None):
+    """
+    Renders a template with each item of `rows`, e.g. the rows of a dataset.
+    The template is fetched and compiled once, then every row is rendered with it.
+
+    Parameters:
+        slug (str): Template identifier.
+        rows (iterable): Data for each rendering. Can be a generator.
+        app_id (str, optional): Application ID for authentication.
+        api_url (str, optional): API base URL.
+        processes (int, optional): Renders the rows in a pool of this many processes,
+            for very large jobs. Rows and their data must be picklable.
+
+    Returns:
+        generator: Rendered templates, in the order of `rows`, as returned by `render_template`.
+
+    Raises:
+        TemplateError: If fetching the template or rendering a row fails.
+    """
+    try:
+        raw_template = get_raw_template(slug, app_id, api_url)
+
+        if raw_template.get("message") == "Template not found, is the project ID correct?":
+            raise TemplateError("Template not found, are the project ID and slug correct?")
+
+        # Raises mustache syntax errors now rather than on the first row
+        compile_template(raw_template)
+    except Exception as e:
+        raise TemplateError(f"Error rendering template: {str(e)}")
+
+    return render_rows(raw_template, rows, processes)
+
+async def render_templates_async(slug: str, rows, app_id: str | None = None, api_url: str | None = None, processes: int | None = None):
+    """
+    Asynchronous version of `render_templates`, to be iterated with `async for`.
+    Gives control back to the event loop regularly while rendering.
 
+    Parameters:
+        slug (str): Template identifier.
+        rows (iterable): Data for each rendering. Can be a generator.
+        app_id (str, optional): Application ID for authentication.
+        api_url (str, optional): API base URL.
+        processes (int, optional): Renders the rows in a pool of this many processes.
+
+    Yields:
+        dict: Rendered templates, in the order of `rows`.
+
+    Raises:
+        TemplateError: If fetching the template or rendering a row fails.
+    """
+    try:
+        raw_template = await get_raw_template_async(slug, app_id, api_url)
+
+        if raw_template.get("message") == "Template not found, is the project ID correct?":
+            raise TemplateError("Template not found, are the project ID and slug correct?")
     except Exception as e:
         raise TemplateError(f"Error rendering template: {str(e)}")
 
+    async for result in render_rows_async(raw_template, rows, processes):
+        yield result
+
 def get_langchain_template(slug: str, app_id: str | None = None, api_url: str | None = None):
     """
-    Creates a LangChain prompt template from a raw template, converting any double braces.
+    Creates a LangChain prompt template from a raw template, converting its mustache
+    variables to f-string ones and escaping its literal braces. The prompt is built once
+    per template version, and each call returns a copy of it.
 
     Parameters:
         slug (str): Template identifier.
@@ -2120,32 +2889,12 @@ def get_langchain_template(slug: str, app_id: str | None = None, api_url: str |
         TemplateError: If creating the LangChain template fails.
     """
     try:
-        from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-        
         raw_template = get_raw_template(slug, app_id, api_url)
 
         if raw_template.get("message") == "Template not found, is the project ID correct?":
             raise TemplateError("Template not found, are the project ID and slug correct?")
 
-        content = copy.deepcopy(raw_template["content"])
-        text_mode = isinstance(content, str)
-
-        def replace_double_braces(text):
-            return text.replace("{{", "{").replace("}}", "}")
-
-        if text_mode:
-            rendered = replace_double_braces(content)
-            return PromptTemplate.from_template(rendered)
-        else:
-            messages = []
-            for message in content:
-                messages.append(
-                    (
-                        message["role"].replace("assistant", "ai").replace("user", "human"),
-                        replace_double_braces(message["content"]),
-                    )
-                )
-            return ChatPromptTemplate.from_messages(messages)
+        return get_langchain_prompt(raw_template)
 
     except ImportError:
         raise TemplateError("LangChain is required. Install it with: pip install langchain-core")
@@ -2169,32 +2918,12 @@ async def get_langchain_template_async(slug: str, app_id: str | None = None, api
         TemplateError: If creating the LangChain template fails.
     """
     try:
-        from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
-        
         raw_template = await get_raw_template_async(slug, app_id, api_url)
 
         if raw_template.get("message") == "Template not found, is the project ID correct?":
             raise TemplateError("Template not found, are the project ID and slug correct?")
 
-        content = copy.deepcopy(raw_template["content"])
-        text_mode = isinstance(content, str)
-
-        def replace_double_braces(text):
-            return text.replace("{{", "{").replace("}}", "}")
-
-        if text_mode:
-            rendered = replace_double_braces(content)
-            return PromptTemplate.from_template(rendered)
-        else:
-            messages = []
-            for message in content:
-                messages.append(
-                    (
-                        message["role"].replace("assistant", "ai").replace("user", "human"),
-                        replace_double_braces(message["content"]),
-                    )
-                )
-            return ChatPromptTemplate.from_messages(messages)
+        return get_langchain_prompt(raw_template)
 
     except ImportError:
         raise TemplateError("LangChain is required. Install it with: pip install langchain-core")
@@ -2230,13 +2959,121 @@ def get_live_templates(app_id: str | None = None, api_url: str | None = None):
             headers=headers,
             verify=config.ssl_verify,
         )
-        
+
+        if response.status_code == 401:
+            raise TemplateError(f"Invalid or unauthorized API credentials: {response.text}")
+
         if not response.ok:
             raise TemplateError(f"Error fetching templates: {response.status_code} - {response.text}")
 
         return response.json()
     except Exception as e:
         raise TemplateError(f"Error fetching templates: {str(e)}")
+
+def warm_templates(app_id: str | None = None, api_url: str | None = None, refresh_interval: float | None = None) -> int:
+    """
+    Loads every live template of the project into the template cache in a single
+    request, so the first `render_template` calls after a deploy don't have to fetch them.
+
+    Parameters:
+        app_id (str, optional): Application ID for authentication.
+        api_url (str, optional): API base URL.
+        refresh_interval (float, optional): If set, the live templates are reloaded every
+            `refresh_interval` seconds by a background thread, which replaces the previous
+            one of the project. Keep it below `template_cache_ttl` so templates never expire.
+
+    Returns:
+        int: Number of templates loaded.
+
+    Raises:
+        TemplateError: If fetching the templates fails. The background refresh is started anyway.
+    """
+    config = get_config()
+    token = app_id or config.app_id
+    base_url = api_url or config.api_url
+    project = (base_url, token)
+
+    if not token:
+        raise TemplateError("No authentication token provided")
+
+    def load():
+        templates = get_live_templates(token, base_url)
+        for template in templates:
+            if isinstance(template.get("content"), list):
+                # Same shape as the versions returned by `get_raw_template`
+                template["content"] = [humps.decamelize(message) for message in template["content"]]
+            template_cache.put((base_url, token, template["slug"]), template)
+        template_cache.mark_ready(project)
+        return len(templates)
+
+    if refresh_interval is not None:
+        template_cache.set_poller(project, TemplatePoller(load, refresh_interval))
+    return load()
+
+def templates_ready(app_id: str | None = None, api_url: str | None = None) -> bool:
+    """Whether the live templates of the project have been loaded by `warm_templates`."""
+    config = get_config()
+    return template_cache.is_ready((api_url or config.api_url, app_id or config.app_id))
+
+def stop_template_refresh(app_id: str | None = None, api_url: str | None = None) -> None:
+    """Stops the background refresh started by `warm_templates(refresh_interval=...)`."""
+    config = get_config()
+    template_cache.set_poller((api_url or config.api_url, app_id or config.app_id), None)
+
+def subscribe_templates(app_id: str | None = None, api_url: str | None = None) -> bool:
+    """
+    Refreshes the cached templates of the project as soon as a new version is published,
+    instead of when they expire. A background thread keeps a long-polling request open
+    to the API, and fetches the changed templates again if they are cached.
+    A single subscription per project runs in a process: further calls do nothing.
+
+    Parameters:
+        app_id (str, optional): Application ID for authentication.
+        api_url (str, optional): API base URL.
+
+    Returns:
+        bool: Whether a new subscription was started.
+
+    Raises:
+        TemplateError: If no authentication token is available.
+    """
+    config = get_config()
+    token = app_id or config.app_id
+    base_url = api_url or config.api_url
+
+    if not token:
+        raise TemplateError("No authentication token provided")
+
+    def poll(cursor):
+        params = {"timeout": SUBSCRIPTION_POLL_TIMEOUT}
+        if cursor:
+            params["since"] = cursor
+        response = requests.get(
+            f"{base_url}/v1/template-versions/changes",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"},
+            verify=get_config().ssl_verify,
+            timeout=SUBSCRIPTION_POLL_TIMEOUT + 10,
+        )
+
+        if not response.ok:
+            raise TemplateError(f"Error waiting for template changes: {response.status_code} - {response.text}")
+
+        changes = response.json()
+        return changes["cursor"], [template["slug"] for template in changes["templates"]]
+
+    def on_change(slugs):
+        for slug in slugs:
+            template_cache.refresh(
+                (base_url, token, slug), lambda etag: _fetch_template_version(base_url, token, slug, etag)
+            )
+
+    return template_cache.subscribe((base_url, token), TemplateSubscriber(poll, on_change))
+
+def unsubscribe_templates(app_id: str | None = None, api_url: str | None = None) -> None:
+    """Stops the subscription started by `subscribe_templates`."""
+    config = get_config()
+    template_cache.unsubscribe((api_url or config.api_url, app_id or config.app_id))
     
 class DatasetItem:
     def __init__(self, d=None):
@@ -2,68 +2,100 @@ import json, logging
 
 logger = logging.getLogger(__name__)
 
-# TODO: make sure it's the correct list
 KWARGS_TO_CAPTURE = [
-    "frequency_penalty",
-    "functions",
-    "logit_bias",
     "max_tokens",
-    "max_completion_tokens",
-    "n",
-    "presence_penalty",
-    "response_format",
-    "seed",
-    "stop",
+    "service_tier",
+    "stop_sequences",
     "stream",
-    "audio",
-    "modalities",
     "temperature",
+    "thinking",
     "tool_choice",
     "tools",
-    "tool_calls",
-    "top_p",
     "top_k",
-    "top_logprobs",
-    "logprobs",
-    "prediction",
-    "service_tier",
-    "parallel_tool_calls"
+    "top_p",
 ]
 
+def _get(object, property, default=None):
+    if isinstance(object, dict):
+        return object.get(property, default)
+    return getattr(object, property, default)
+
+def _parse_tool_use(block):
+    input = _get(block, "input")
+    return {
+        "id": _get(block, "id"),
+        "type": "function",
+        "function": {
+            "name": _get(block, "name"),
+            "arguments": input if isinstance(input, str) else json.dumps(input),
+        },
+    }
+
 class AnthropicUtils:
     @staticmethod
     def parse_message(message):
-        tool_calls = getattr(message, "tool_calls")
-
-        if tool_calls is not None:
-            tool_calls = [
-                json.loads(tool_calls.model_dump_json(index=2, exclude_unset=True))
-                for tool_calls in tool_calls 
-            ]
-        # TODO: audio?
-        # audio = getattr(message, "audio") 
-        # if audio is not None:
-        #     audio = json.loads(audio.model_dump_json(indent=2, exclude_unset=True))        
-
-        parsed_message = {
-            "role": getattr(message, "role"),
-            "content": getattr(message, "content"),
-            "refusal": getattr(message, "refusal"),
-            # TODO: "audio": audio?
-            # TODO: function_calls?
-            "tool_calls": getattr(message, "tool_calls")
-        }
-        return parsed_message
+        """Converts an Anthropic message (dict or SDK object) to Lunary messages."""
+        role = _get(message, "role")
+        content = _get(message, "content")
+
+        if content is None or isinstance(content, str):
+            return [{"role": role, "content": content}]
+
+        text = []
+        tool_calls = []
+        tool_results = []
+        for block in content:
+            block_type = _get(block, "type")
+            if block_type == "text":
+                text.append(_get(block, "text"))
+            elif block_type == "tool_use":
+                tool_calls.append(_parse_tool_use(block))
+            elif block_type == "tool_result":
+                result = _get(block, "content")
+                if not isinstance(result, str) and result is not None:
+                    result = "".join(_get(part, "text", "") for part in result)
+                tool_results.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": _get(block, "tool_use_id"),
+                        "content": result,
+                    }
+                )
 
+        messages = tool_results
+        if text or tool_calls or not tool_results:
+            parsed_message = {"role": role, "content": "".join(text)}
+            if tool_calls:
+                parsed_message["tool_calls"] = tool_calls
+            messages = messages + [parsed_message]
+        return messages
+
+    @staticmethod
+    def parse_usage(usage):
+        cache_read = _get(usage, "cache_read_input_tokens") or 0
+        cache_creation = _get(usage, "cache_creation_input_tokens") or 0
+        return {
+            # Anthropic doesn't count cached tokens in `input_tokens`
+            "prompt": (_get(usage, "input_tokens") or 0) + cache_read + cache_creation,
+            "completion": _get(usage, "output_tokens"),
+            "promptCached": cache_read,
+        }
 
     @staticmethod
     def parse_input(*args, **kwargs):
         try:
-            messages = [AnthropicUtils.parse_message(message) for message in kwargs["messages"]]
+            messages = []
+            system = kwargs.get("system")
+            if system:
+                if not isinstance(system, str):
+                    system = "".join(_get(block, "text", "") for block in system)
+                messages.append({"role": "system", "content": system})
+
+            for message in kwargs["messages"]:
+                messages.extend(AnthropicUtils.parse_message(message))
+
             name = kwargs.get("model")
             extra = {key: kwargs[key] for key in KWARGS_TO_CAPTURE if key in kwargs}
-
-            extra = {k: v for k, v in kwargs.items() if k in KWARGS_TO_CAPTURE}
             return {"name": name, "input": messages, "extra": extra}
         except Exception:
             logger.exception("Error parsing input")
@@ -71,12 +103,159 @@ class AnthropicUtils:
     @staticmethod
     def parse_output(message, stream=False):
         try:
-            parsed_output = {
-                "output": AnthropicUtils.parse_message(message),
-                "tokenUsage": {
-                    "prompt": getattr(message.usage, "input_tokens"),
-                    "completion": getattr(message.usage, "output_tokens") 
-                }
-            } 
+            return {
+                "output": AnthropicUtils.parse_message(message)[-1],
+                "tokensUsage": AnthropicUtils.parse_usage(message.usage),
+            }
         except Exception:
-            logger.exception("Error parsing output")
\ No newline at end of file
+            logger.exception("Error parsing output")
+
+
+class AnthropicStreamAccumulator:
+    """
+    Rebuilds the final message of a streamed Anthropic call from its events.
+
+    Text and tool input fragments are buffered in lists and joined once at the
+    end. Usage is taken from `message_start` and updated by `message_delta`,
+    which carries the cumulative counts.
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.role = "assistant"
+        self.usage = {}
+        # content block index -> {"type", "id", "name", "parts"}
+        self._blocks = {}
+
+    def _update_usage(self, usage):
+        if usage is None:
+            return
+        for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            value = _get(usage, key)
+            if value is not None:
+                self.usage[key] = value
+
+    def add(self, event):
+        self.events += 1
+        event_type = event.type
+
+        if event_type == "content_block_delta":
+            block = self._blocks.get(event.index)
+            if block is None:
+                return
+            delta = event.delta
+            if delta.type == "text_delta":
+                block["parts"].append(delta.text)
+            elif delta.type == "input_json_delta":
+                block["parts"].append(delta.partial_json)
+        elif event_type == "content_block_start":
+            content_block = event.content_block
+            block_type = content_block.type
+            self._blocks[event.index] = {
+                "type": block_type,
+                "id": _get(content_block, "id"),
+                "name": _get(content_block, "name"),
+                "parts": [content_block.text] if block_type == "text" and content_block.text else [],
+            }
+        elif event_type == "message_delta":
+            self._update_usage(event.usage)
+        elif event_type == "message_start":
+            self.role = event.message.role
+            self._update_usage(event.message.usage)
+
+    def get_output(self):
+        text = []
+        tool_calls = []
+        for _, block in sorted(self._blocks.items()):
+            if block["type"] == "text":
+                text.extend(block["parts"])
+            elif block["type"] == "tool_use":
+                tool_calls.append(
+                    {
+                        "id": block["id"],
+                        "type": "function",
+                        "function": {"name": block["name"], "arguments": "".join(block["parts"])},
+                    }
+                )
+
+        output = {"role": self.role, "content": "".join(text)}
+        if tool_calls:
+            output["tool_calls"] = tool_calls
+        return output
+
+    def get_token_usage(self):
+        return AnthropicUtils.parse_usage(self.usage)
+
+
+def is_token_event(event) -> bool:
+    """Whether a stream event carries generated tokens: a text or tool input delta."""
+    return event.type == "content_block_delta" and event.delta.type in ("text_delta", "input_json_delta")
+
+
+def _observe(iterator, on_event):
+    for event in iterator:
+        on_event(event)
+        yield event
+
+
+async def _observe_async(iterator, on_event):
+    async for event in iterator:
+        on_event(event)
+        yield event
+
+
+class MessageStreamManagerProxy:
+    """
+    Wraps the manager returned by `messages.stream()` to report the final message when the stream is closed.
+    `on_event` is called with each event read from the stream, however it's read.
+    """
+
+    def __init__(self, manager, on_end, on_event=None):
+        self._manager = manager
+        self._on_end = on_end
+        self._on_event = on_event
+        self._stream = None
+
+    def __getattr__(self, name):
+        return getattr(self._manager, name)
+
+    def _observe_stream(self, observe) -> None:
+        # Iterating the stream, its `text_stream` and `until_done()` all read `_iterator`
+        if self._on_event is not None and hasattr(self._stream, "_iterator"):
+            self._stream._iterator = observe(self._stream._iterator, self._on_event)
+
+    def __enter__(self):
+        self._stream = self._manager.__enter__()
+        self._observe_stream(_observe)
+        return self._stream
+
+    def __exit__(self, exc_type, exc, exc_tb):
+        try:
+            return self._manager.__exit__(exc_type, exc, exc_tb)
+        finally:
+            self._on_end(self._stream, exc)
+
+
+class AsyncMessageStreamManagerProxy(MessageStreamManagerProxy):
+    async def __aenter__(self):
+        self._stream = await self._manager.__aenter__()
+        self._observe_stream(_observe_async)
+        return self._stream
+
+    async def __aexit__(self, exc_type, exc, exc_tb):
+        try:
+            return await self._manager.__aexit__(exc_type, exc, exc_tb)
+        finally:
+            self._on_end(self._stream, exc)
+
+
+def get_stream_snapshot(stream):
+    """The message accumulated so far by a MessageStream, or None if nothing was received."""
+    if stream is None:
+        return None
+    if hasattr(stream, "_current_snapshot_or_none"):
+        return stream._current_snapshot_or_none()
+    try:
+        return stream.current_message_snapshot
+    except AssertionError:
+        return None
@@ -9,6 +9,22 @@ from .config import get_config
 
 logger = logging.getLogger(__name__)
 
+def expand_deferred_events(batch):
+    """
+    Some queue items (e.g. LLM calls captured at the HTTP level) are only turned
+    into events here, in the consumer thread, to keep parsing off the caller's path.
+    """
+    events = []
+    for item in batch:
+        if isinstance(item, dict):
+            events.append(item)
+            continue
+        try:
+            events.extend(item.to_events())
+        except Exception:
+            logger.exception("Error building deferred events")
+    return events
+
 class Consumer(Thread):
     def __init__(self, event_queue, app_id=None):
         self.running = True
@@ -27,7 +43,7 @@ class Consumer(Thread):
 
     def send_batch(self):
         config = get_config()
-        batch = self.event_queue.get_batch()
+        batch = expand_deferred_events(self.event_queue.get_batch())
 
         verbose = config.verbose
         api_url = config.api_url
@@ -0,0 +1,153 @@
+"""
+Executors that keep the Lunary context (user, tags, parent message, project and
+current run) of the code submitting work, so the runs started by the workers are
+attached to the right parent instead of showing up as orphan roots.
+"""
+import contextvars
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, NamedTuple
+
+import lunary
+from .config import get_config, set_config
+from .consumer import expand_deferred_events
+from .parent import parent_ctx
+from .project import project_ctx
+from .tags import tags_ctx
+
+logger = logging.getLogger(__name__)
+
+
+class TracedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A `ThreadPoolExecutor` running each task in a copy of the context it was
+    submitted from. `map()` goes through `submit()`, so it's covered too.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+class _ContextSnapshot(NamedTuple):
+    user_id: Any
+    user_props: Any
+    tags: Any
+    parent: Any
+    project: Any
+    run_id: str | None
+
+    # The user context variables are looked up on the package, since the LangChain
+    # integration replaces them with its own when it is installed.
+    @classmethod
+    def capture(cls) -> "_ContextSnapshot":
+        return cls(
+            lunary.user_ctx.get(),
+            lunary.user_props_ctx.get(),
+            tags_ctx.get(),
+            parent_ctx.get(),
+            project_ctx.get(),
+            lunary.run_manager.current_run_id,
+        )
+
+    def restore(self) -> None:
+        lunary.user_ctx.set(self.user_id)
+        lunary.user_props_ctx.set(self.user_props)
+        tags_ctx.set(self.tags)
+        parent_ctx.set(self.parent)
+        project_ctx.set(self.project)
+
+
+class _PipeEventQueue:
+    """Replaces the event queue of worker processes, sending their events to the parent process."""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def append(self, event) -> None:
+        events = event if isinstance(event, list) else [event]
+        # Deferred events (HTTP level captures) are parsed here, in the worker
+        self._pipe.put(expand_deferred_events(events))
+
+
+def _init_worker(pipe, app_id, api_url, initializer, initargs):
+    # Run ids are derived from the app id, so workers must use the parent's
+    set_config(app_id=app_id, api_url=api_url, ssl_verify=get_config().ssl_verify)
+    lunary.queue = _PipeEventQueue(pipe)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_with_snapshot(snapshot: _ContextSnapshot, fn, args, kwargs):
+    snapshot.restore()
+    # Seeds the run that was current when the task was submitted, so it becomes
+    # the parent of the runs started by the task.
+    run = lunary.run_manager.start_run(snapshot.run_id) if snapshot.run_id else None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if run is not None:
+            lunary.run_manager.end_run(run.id)
+
+
+class TracedProcessPoolExecutor(ProcessPoolExecutor):
+    """
+    A `ProcessPoolExecutor` restoring, in the worker, a snapshot of the Lunary
+    context taken when each task is submitted.
+
+    Events tracked in the workers are sent back through a multiprocessing queue
+    and added to the parent process queue by a forwarding thread, so they are
+    sent with the parent's configuration. Context values, tasks and their
+    arguments must be picklable.
+    """
+
+    def __init__(self, max_workers=None, mp_context=None, initializer=None, initargs=(), **kwargs):
+        mp_context = mp_context or multiprocessing.get_context()
+        self._events = mp_context.Queue()
+        config = get_config()
+        super().__init__(
+            max_workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(self._events, config.app_id, config.api_url, initializer, initargs),
+            **kwargs,
+        )
+        self._forwarder = threading.Thread(target=self._forward_events, daemon=True)
+        self._forwarder.start()
+        self._stopper = None
+
+    def _forward_events(self) -> None:
+        while True:
+            events = self._events.get()
+            if events is None:
+                return
+            try:
+                lunary.queue.append(events)
+            except Exception:
+                logger.exception("Error forwarding events from worker process")
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_with_snapshot, _ContextSnapshot.capture(), fn, args, kwargs)
+
+    def _stop_forwarding(self, manager) -> None:
+        # The manager thread exits once every worker has exited, after flushing
+        # its events into the queue, so none of them comes after the sentinel.
+        if manager is not None:
+            manager.join()
+        self._events.put(None)
+        self._forwarder.join()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        manager = getattr(self, "_executor_manager_thread", None)
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+        if self._stopper is None:
+            # Not a daemon, so the events of the tasks still running when the
+            # interpreter exits are forwarded before the consumer's last flush.
+            self._stopper = threading.Thread(
+                target=self._stop_forwarding, args=(manager,), name="lunary-process-pool-shutdown"
+            )
+            self._stopper.start()
+        if wait:
+            self._stopper.join()
@@ -0,0 +1,401 @@
+import json, logging
+from time import perf_counter
+
+import httpx
+
+try:
+    # Fork of httpx used by recent versions of the OpenAI and Anthropic SDKs
+    import httpx2
+except ImportError:
+    httpx2 = None
+
+from .openai_utils import OpenAIUtils, OpenAIStreamAccumulator, ResponsesStreamAccumulator
+from .anthropic_utils import AnthropicUtils, AnthropicStreamAccumulator
+from .parsers import filter_params
+from .stream_metrics import StreamTimer
+
+logger = logging.getLogger(__name__)
+
+# Bigger response bodies (e.g. large embedding batches) are reported without their output
+MAX_CAPTURED_BYTES = 8 * 1024 * 1024
+
+# Path suffix -> endpoint. Also matches OpenAI-compatible servers and Azure
+# deployments (`/openai/deployments/{name}/chat/completions`).
+LLM_ENDPOINTS = (
+    ("/chat/completions", "openai_chat"),
+    ("/responses", "openai_responses"),
+    ("/embeddings", "openai_embeddings"),
+    ("/v1/messages", "anthropic_messages"),
+)
+
+
+class HostAllowlist:
+    """
+    Hosts whose LLM API calls are traced. `*.example.com` matches any subdomain
+    of example.com, and `example.com:8000` only that port of the host.
+    """
+
+    __slots__ = ("names", "suffixes")
+
+    def __init__(self, hosts=()):
+        self.names = set()
+        suffixes = []
+        for host in hosts:
+            host = host.strip().lower()
+            if host.startswith("*."):
+                suffixes.append(host[1:])
+            elif host:
+                self.names.add(host)
+        self.suffixes = tuple(suffixes)
+
+    def __contains__(self, url: httpx.URL) -> bool:
+        host = url.host
+        if host in self.names or (self.suffixes and host.endswith(self.suffixes)):
+            return True
+        return url.port is not None and f"{host}:{url.port}" in self.names
+
+
+# Other hosts (self-hosted or proxied OpenAI-compatible servers) must be passed
+# to `instrument_httpx()` or `LunaryTransport`.
+PROVIDER_HOSTS = HostAllowlist(
+    (
+        "api.openai.com",
+        "*.openai.azure.com",
+        "*.cognitiveservices.azure.com",
+        "api.anthropic.com",
+    )
+)
+
+
+# Modules whose transports are patched by `instrument_httpx()`
+HTTPX_MODULES = [module for module in (httpx, httpx2) if module is not None]
+# Bodies that are already in memory, that httpx never iterates nor closes
+IN_MEMORY_STREAMS = tuple(module.ByteStream for module in HTTPX_MODULES)
+REQUEST_NOT_READ_ERRORS = tuple(module.RequestNotRead for module in HTTPX_MODULES)
+
+
+def classify_request(request: httpx.Request, hosts: HostAllowlist | None = None) -> str | None:
+    """
+    The LLM endpoint called by `request`, or None if it isn't a known one or
+    isn't sent to a provider host, nor to one of `hosts`.
+    """
+    if request.method != "POST":
+        return None
+    url = request.url
+    path = url.path
+    for suffix, endpoint in LLM_ENDPOINTS:
+        if path.endswith(suffix):
+            if url in PROVIDER_HOSTS or (hosts is not None and url in hosts):
+                return endpoint
+            return None
+    return None
+
+
+def get_run_type(endpoint: str) -> str:
+    return "embed" if endpoint == "openai_embeddings" else "llm"
+
+
+class _AttrDict(dict):
+    """Parsed JSON object whose keys can also be read as attributes, like the SDK models the parsers expect."""
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get(name)
+
+
+def _loads(data):
+    return json.loads(data, object_hook=_AttrDict)
+
+
+def _iter_sse_data(text: str):
+    for line in text.splitlines():
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield _loads(data)
+
+
+def _get_deployment(url: httpx.URL) -> str | None:
+    parts = url.path.split("/")
+    if "deployments" in parts:
+        index = parts.index("deployments") + 1
+        if index < len(parts):
+            return parts[index]
+    return None
+
+
+def _has_request_shape(endpoint: str, body) -> bool:
+    """Whether `body` looks like a request to `endpoint`, rather than to an unrelated API sharing its path."""
+    if not isinstance(body, dict):
+        return False
+    if endpoint in ("openai_chat", "anthropic_messages"):
+        return isinstance(body.get("messages"), list)
+    if endpoint == "openai_responses":
+        return "input" in body or "prompt" in body
+    return "input" in body
+
+
+def _parse_request(endpoint: str, body):
+    if endpoint == "openai_chat":
+        return OpenAIUtils.parse_input(**body)
+    if endpoint == "openai_responses":
+        return OpenAIUtils.parse_responses_input(**body)
+    if endpoint == "openai_embeddings":
+        return OpenAIUtils.embedding_input_parser()(**body)
+    return AnthropicUtils.parse_input(**body)
+
+
+def _parse_response(endpoint: str, body):
+    if endpoint == "openai_chat":
+        return OpenAIUtils.parse_output(body)
+    if endpoint == "openai_responses":
+        return OpenAIUtils.parse_responses_output(body)
+    if endpoint == "openai_embeddings":
+        return OpenAIUtils.parse_embedding_output(body)
+    return AnthropicUtils.parse_output(body)
+
+
+def _parse_stream(endpoint: str, events):
+    if endpoint == "openai_chat":
+        accumulator = OpenAIStreamAccumulator()
+    elif endpoint == "openai_responses":
+        accumulator = ResponsesStreamAccumulator()
+    else:
+        accumulator = AnthropicStreamAccumulator()
+
+    for event in events:
+        accumulator.add(event)
+    return {"output": accumulator.get_output(), "tokensUsage": accumulator.get_token_usage()}
+
+
+def _get_error_message(body) -> str | None:
+    error = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error, dict):
+        return error.get("message")
+    return error
+
+
+class CapturedExchange:
+    """
+    An LLM API call seen at the HTTP level.
+
+    While the call runs, only the raw request and response bytes are kept,
+    along with the skeletons of the run's `start` and `end` events (built by
+    `track_event` so they capture the user, tags and parent of the caller).
+    The bodies are parsed into the events by the consumer thread, through `to_events()`.
+    """
+
+    __slots__ = (
+        "endpoint",
+        "run_type",
+        "run_id",
+        "url",
+        "request_headers",
+        "request_body",
+        "events",
+        "status_code",
+        "headers",
+        "chunks",
+        "size",
+        "timer",
+        "ended_at",
+        "error",
+        "finished",
+        "on_finish",
+    )
+
+    def __init__(self, endpoint: str, run_id: str, request: httpx.Request, on_finish):
+        self.endpoint = endpoint
+        self.run_type = get_run_type(endpoint)
+        self.run_id = run_id
+        self.url = request.url
+        self.request_headers = request.headers
+        self.request_body = request.content
+        self.events = []
+        self.status_code = None
+        self.headers = None
+        self.chunks = []
+        self.size = 0
+        self.timer = StreamTimer()
+        self.ended_at = None
+        self.error = None
+        self.finished = False
+        self.on_finish = on_finish
+
+    def set_response(self, response: httpx.Response) -> None:
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def add_chunk(self, chunk: bytes) -> None:
+        self.timer.tick()
+        if self.chunks is None:
+            return
+        self.size += len(chunk)
+        if self.size > MAX_CAPTURED_BYTES:
+            self.chunks = None
+        else:
+            self.chunks.append(chunk)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        self.error = error
+        self.ended_at = perf_counter()
+        try:
+            self.on_finish(self)
+        except Exception:
+            logger.exception("Error finishing LLM call")
+
+    def _is_stream(self) -> bool:
+        return (self.headers.get("content-type") or "").startswith("text/event-stream")
+
+    def _read_body(self) -> httpx.Response | None:
+        if self.chunks is None:
+            return None
+        # Decodes gzip/brotli encoded bodies
+        response = httpx.Response(self.status_code, headers=self.headers, content=b"".join(self.chunks))
+        response.read()
+        return response
+
+    def to_events(self):
+        """The run's events, or no events if the request isn't an LLM call after all."""
+        start, end = self.events
+        try:
+            request = _loads(self.request_body) if self.request_body else None
+        except ValueError:
+            request = None
+        if not _has_request_shape(self.endpoint, request):
+            logger.debug(f"Not tracing {self.url}, its body isn't a {self.endpoint} request")
+            return []
+
+        try:
+            name = request.get("model") or _get_deployment(self.url)
+            parsed_input = _parse_request(self.endpoint, request)
+            start["name"] = name
+            start["input"] = parsed_input["input"] if parsed_input else None
+            start["params"] = filter_params(request)
+            start["templateId"] = self.request_headers.get("Template-Id")
+        except Exception:
+            logger.exception("Error parsing LLM request")
+            return []
+
+        end["name"] = name
+        if self.error is not None:
+            end["event"] = "error"
+            end["error"] = {"message": str(self.error) or type(self.error).__name__}
+            return self.events
+
+        try:
+            response = self._read_body()
+            if response is None:
+                return self.events
+
+            if self.status_code >= 400:
+                try:
+                    message = _get_error_message(response.json())
+                except ValueError:
+                    message = None
+                end["event"] = "error"
+                end["error"] = {"message": message or f"HTTP {self.status_code}: {response.text[:1000]}"}
+                return self.events
+
+            if self._is_stream():
+                parsed_output = _parse_stream(self.endpoint, _iter_sse_data(response.text))
+                completion_tokens = parsed_output["tokensUsage"]["completion"]
+                end["metadata"] = {"metrics": self.timer.get_metrics(completion_tokens, self.ended_at)}
+            else:
+                body = _loads(response.content)
+                end["name"] = name or body.get("model")
+                parsed_output = _parse_response(self.endpoint, body)
+
+            if parsed_output:
+                end["output"] = parsed_output["output"]
+                end["tokensUsage"] = parsed_output["tokensUsage"]
+        except Exception:
+            logger.exception("Error parsing LLM response")
+
+        return self.events
+
+
+class _TeeSyncByteStream:
+    """Passes a response body through untouched, keeping a copy of its bytes for the exchange."""
+
+    def __init__(self, stream, exchange: CapturedExchange):
+        self._stream = stream
+        self._exchange = exchange
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._exchange.add_chunk(chunk)
+                yield chunk
+        except Exception as e:
+            self._exchange.finish(e)
+            raise
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._exchange.finish()
+
+
+class _TeeAsyncByteStream:
+    def __init__(self, stream, exchange: CapturedExchange):
+        self._stream = stream
+        self._exchange = exchange
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._exchange.add_chunk(chunk)
+                yield chunk
+        except Exception as e:
+            self._exchange.finish(e)
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._exchange.finish()
+
+
+# Clients check that response streams derive from their own module's base classes
+_TEE_STREAMS = [
+    (
+        module.SyncByteStream,
+        module.AsyncByteStream,
+        type("TeeSyncByteStream", (_TeeSyncByteStream, module.SyncByteStream), {}),
+        type("TeeAsyncByteStream", (_TeeAsyncByteStream, module.AsyncByteStream), {}),
+    )
+    for module in HTTPX_MODULES
+]
+
+
+def capture_response(response, exchange: CapturedExchange, is_async: bool = False) -> None:
+    """Records the body of `response` while the caller reads it, without changing what the caller gets."""
+    exchange.set_response(response)
+    stream = response.stream
+
+    if isinstance(stream, IN_MEMORY_STREAMS):
+        for chunk in stream:
+            exchange.add_chunk(chunk)
+        exchange.finish()
+        return
+
+    for sync_base, async_base, tee_sync, tee_async in _TEE_STREAMS:
+        if is_async and isinstance(stream, async_base):
+            response.stream = tee_async(stream, exchange)
+            return
+        if not is_async and isinstance(stream, sync_base):
+            response.stream = tee_sync(stream, exchange)
+            return
+
+    # Unknown stream implementation, report the call without its output
+    exchange.chunks = None
+    exchange.finish()
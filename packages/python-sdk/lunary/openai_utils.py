@@ -1,4 +1,4 @@
-import json, logging
+import json, logging, hashlib
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +29,29 @@ MONITORED_KEYS = [
     "parallel_tool_calls"
 ]
 
+RESPONSES_MONITORED_KEYS = [
+    "max_output_tokens",
+    "parallel_tool_calls",
+    "previous_response_id",
+    "reasoning",
+    "service_tier",
+    "store",
+    "stream",
+    "temperature",
+    "text",
+    "tool_choice",
+    "tools",
+    "top_p",
+    "truncation",
+]
+
+# Batch endpoint -> run type
+BATCH_RUN_TYPES = {
+    "/v1/chat/completions": "llm",
+    "/v1/responses": "llm",
+    "/v1/embeddings": "embed",
+}
+
 class OpenAIUtils:
     @staticmethod
     def parse_role(role):
@@ -75,16 +98,421 @@ class OpenAIUtils:
         
         return {"name": name, "input": messages, "extra": extra}
 
+    @staticmethod
+    def parse_usage(usage):
+        return {
+            "completion": OpenAIUtils.get_property(usage, "completion_tokens"),
+            "prompt": OpenAIUtils.get_property(usage, "prompt_tokens"),
+            "promptCached": OpenAIUtils.get_property(OpenAIUtils.get_property(usage, "prompt_tokens_details"), "cached_tokens")
+        }
+
     @staticmethod
     def parse_output(output, stream=False):
         try:
             return {
                 "output": OpenAIUtils.parse_message(output.choices[0].message),
+                "tokensUsage": OpenAIUtils.parse_usage(output.usage),
+            }
+        except Exception:
+            logger.exception("Error parsing openai output")
+
+    @staticmethod
+    def _parse_response_content(content):
+        if content is None or isinstance(content, str):
+            return content
+        texts = []
+        for part in content:
+            if OpenAIUtils.get_property(part, "type") not in ("input_text", "output_text"):
+                # Images, files... keep the parts as they are
+                return content
+            texts.append(OpenAIUtils.get_property(part, "text") or "")
+        return "".join(texts)
+
+    @staticmethod
+    def _parse_response_function_call(item):
+        return {
+            "id": OpenAIUtils.get_property(item, "call_id"),
+            "type": "function",
+            "function": {
+                "name": OpenAIUtils.get_property(item, "name"),
+                "arguments": OpenAIUtils.get_property(item, "arguments") or "",
+            },
+        }
+
+    @staticmethod
+    def parse_responses_input(*args, **kwargs):
+        """Converts the `instructions` and `input` of `responses.create` to Lunary messages."""
+        try:
+            messages = []
+            instructions = kwargs.get("instructions")
+            if instructions:
+                messages.append({"role": "system", "content": instructions})
+
+            input = kwargs.get("input")
+            if isinstance(input, str):
+                messages.append({"role": "user", "content": input})
+            else:
+                for item in input or []:
+                    item_type = OpenAIUtils.get_property(item, "type") or "message"
+                    if item_type == "message":
+                        messages.append(
+                            {
+                                "role": OpenAIUtils.get_property(item, "role"),
+                                "content": OpenAIUtils._parse_response_content(
+                                    OpenAIUtils.get_property(item, "content")
+                                ),
+                            }
+                        )
+                    elif item_type == "function_call":
+                        tool_call = OpenAIUtils._parse_response_function_call(item)
+                        previous = messages[-1] if messages else None
+                        # Parallel calls are sent as consecutive items, group them in one message
+                        if previous and previous["role"] == "assistant" and previous.get("tool_calls"):
+                            previous["tool_calls"].append(tool_call)
+                        else:
+                            messages.append({"role": "assistant", "content": None, "tool_calls": [tool_call]})
+                    elif item_type == "function_call_output":
+                        messages.append(
+                            {
+                                "role": "tool",
+                                "tool_call_id": OpenAIUtils.get_property(item, "call_id"),
+                                "content": OpenAIUtils.get_property(item, "output"),
+                            }
+                        )
+
+            extra = {key: kwargs[key] for key in RESPONSES_MONITORED_KEYS if key in kwargs}
+            return {"name": kwargs.get("model"), "input": messages, "extra": extra}
+        except Exception:
+            logger.exception("Error parsing openai responses input")
+
+    @staticmethod
+    def parse_responses_output_items(items):
+        """Merges the output items of a response into a single assistant message."""
+        text = []
+        refusal = []
+        tool_calls = []
+        for item in items or []:
+            item_type = OpenAIUtils.get_property(item, "type")
+            if item_type == "message":
+                for part in OpenAIUtils.get_property(item, "content") or []:
+                    part_type = OpenAIUtils.get_property(part, "type")
+                    if part_type == "output_text":
+                        text.append(OpenAIUtils.get_property(part, "text") or "")
+                    elif part_type == "refusal":
+                        refusal.append(OpenAIUtils.get_property(part, "refusal") or "")
+            elif item_type == "function_call":
+                tool_calls.append(OpenAIUtils._parse_response_function_call(item))
+
+        message = {"role": "assistant", "content": "".join(text)}
+        if refusal:
+            message["refusal"] = "".join(refusal)
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return message
+
+    @staticmethod
+    def parse_responses_usage(usage):
+        if usage is None:
+            return None
+        return {
+            "completion": OpenAIUtils.get_property(usage, "output_tokens"),
+            "prompt": OpenAIUtils.get_property(usage, "input_tokens"),
+            "promptCached": OpenAIUtils.get_property(
+                OpenAIUtils.get_property(usage, "input_tokens_details"), "cached_tokens"
+            ),
+        }
+
+    @staticmethod
+    def parse_responses_output(output, stream=False):
+        try:
+            return {
+                "output": OpenAIUtils.parse_responses_output_items(OpenAIUtils.get_property(output, "output")),
+                "tokensUsage": OpenAIUtils.parse_responses_usage(OpenAIUtils.get_property(output, "usage")),
+            }
+        except Exception:
+            logger.exception("Error parsing openai responses output")
+
+    @staticmethod
+    def _embedding_inputs(input):
+        if isinstance(input, str):
+            return [input]
+        if isinstance(input, list) and input and isinstance(input[0], int):
+            # A single pre-tokenized input
+            return [input]
+        return list(input or [])
+
+    @staticmethod
+    def _hash_embedding_input(input):
+        data = input if isinstance(input, str) else json.dumps(input)
+        return hashlib.blake2b(data.encode("utf-8"), digest_size=8).hexdigest()
+
+    @staticmethod
+    def embedding_input_parser(hash_inputs=False):
+        """
+        Builds the input parser for `embeddings.create`. Input texts are never sent,
+        only their count and, with `hash_inputs`, a short hash of each of them.
+        """
+        def parse_input(*args, **kwargs):
+            inputs = OpenAIUtils._embedding_inputs(kwargs.get("input"))
+            parsed_input = {"count": len(inputs)}
+            if hash_inputs:
+                parsed_input["hashes"] = [OpenAIUtils._hash_embedding_input(input) for input in inputs]
+
+            extra = {key: kwargs[key] for key in ("dimensions", "encoding_format") if key in kwargs}
+            return {"name": kwargs.get("model"), "input": parsed_input, "extra": extra}
+
+        return parse_input
+
+    @staticmethod
+    def _base64_embedding_dimensions(embedding):
+        """Dimensions of a base64 encoded float32 vector (`encoding_format="base64"`), without decoding it."""
+        padding = 2 if embedding.endswith("==") else 1 if embedding.endswith("=") else 0
+        return (len(embedding) * 3 // 4 - padding) // 4
+
+    @staticmethod
+    def parse_embedding_output(output, stream=False):
+        """Reports the shape of the embeddings, never the vectors themselves."""
+        try:
+            data = OpenAIUtils.get_property(output, "data") or []
+            dimensions = None
+            if data:
+                embedding = OpenAIUtils.get_property(data[0], "embedding")
+                dimensions = (
+                    OpenAIUtils._base64_embedding_dimensions(embedding)
+                    if isinstance(embedding, str)
+                    else len(embedding)
+                )
+
+            usage = OpenAIUtils.get_property(output, "usage")
+            return {
+                "output": {"count": len(data), "dimensions": dimensions},
                 "tokensUsage": {
-                    "completion": output.usage.completion_tokens,
-                    "prompt": output.usage.prompt_tokens,
-                    "promptCached": OpenAIUtils.get_property(OpenAIUtils.get_property(output.usage, "prompt_tokens_details"), "cached_tokens")
+                    "prompt": OpenAIUtils.get_property(usage, "prompt_tokens"),
+                    "completion": 0,
                 },
             }
         except Exception:
-            logger.exception("Error parsing openai output")
+            logger.exception("Error parsing openai embeddings output")
+
+    @staticmethod
+    def parse_batch_request(endpoint, body, hash_embedding_inputs=False):
+        """Parses the body of one request of a batch input file, like the input of the matching client method."""
+        if endpoint == "/v1/chat/completions":
+            return OpenAIUtils.parse_input(**body)
+        if endpoint == "/v1/responses":
+            return OpenAIUtils.parse_responses_input(**body)
+        if endpoint == "/v1/embeddings":
+            return OpenAIUtils.embedding_input_parser(hash_embedding_inputs)(**body)
+        return None
+
+    @staticmethod
+    def parse_batch_response(endpoint, body):
+        """Parses the body of one successful response of a batch output file."""
+        if endpoint == "/v1/chat/completions":
+            return {
+                "output": OpenAIUtils.parse_message(body["choices"][0]["message"]),
+                "tokensUsage": OpenAIUtils.parse_usage(body.get("usage")),
+            }
+        if endpoint == "/v1/responses":
+            return OpenAIUtils.parse_responses_output(body)
+        if endpoint == "/v1/embeddings":
+            return OpenAIUtils.parse_embedding_output(body)
+        return None
+
+
+class _ChoiceAccumulator:
+    __slots__ = ("role", "content", "function_name", "function_arguments", "tool_calls")
+
+    def __init__(self):
+        self.role = None
+        self.content = []
+        self.function_name = None
+        self.function_arguments = None
+        # tool call index -> {"id", "type", "name", "arguments" (list of fragments)}
+        self.tool_calls = {}
+
+    def to_message(self):
+        function_call = {}
+        if self.function_name is not None:
+            function_call["name"] = self.function_name
+        if self.function_arguments is not None:
+            function_call["arguments"] = "".join(self.function_arguments)
+
+        tool_calls = [
+            {
+                "id": tool_call["id"],
+                "type": tool_call["type"] or "function",
+                "function": {
+                    "name": tool_call["name"],
+                    "arguments": "".join(tool_call["arguments"]),
+                },
+            }
+            for _, tool_call in sorted(self.tool_calls.items())
+        ]
+
+        return {
+            "role": self.role,
+            "content": "".join(self.content),
+            "function_call": function_call,
+            "tool_calls": tool_calls,
+        }
+
+
+class OpenAIStreamAccumulator:
+    """
+    Rebuilds the messages of a streamed chat completion from its chunks.
+
+    Text fragments are buffered in lists and joined once at the end, and tool
+    calls are keyed by their index, so the total work is linear in the number of
+    chunks. Chunks are only read, never mutated.
+    """
+
+    def __init__(self):
+        self.chunks = 0
+        self.usage = None
+        self._choices = {}
+
+    def add(self, chunk):
+        self.chunks += 1
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+
+        choices = chunk.choices
+        if not choices:
+            # Azure content filter results, usage chunks...
+            return
+
+        for choice in choices:
+            accumulator = self._choices.get(choice.index)
+            if accumulator is None:
+                accumulator = self._choices[choice.index] = _ChoiceAccumulator()
+
+            delta = choice.delta
+            if delta is None:
+                continue
+
+            if delta.role:
+                accumulator.role = delta.role
+            if delta.content:
+                accumulator.content.append(delta.content)
+
+            function_call = getattr(delta, "function_call", None)
+            if function_call is not None:
+                if function_call.name:
+                    accumulator.function_name = function_call.name
+                if function_call.arguments:
+                    if accumulator.function_arguments is None:
+                        accumulator.function_arguments = []
+                    accumulator.function_arguments.append(function_call.arguments)
+
+            if delta.tool_calls:
+                for tool_call_delta in delta.tool_calls:
+                    tool_call = accumulator.tool_calls.get(tool_call_delta.index)
+                    if tool_call is None:
+                        tool_call = accumulator.tool_calls[tool_call_delta.index] = {
+                            "id": None,
+                            "type": None,
+                            "name": None,
+                            "arguments": [],
+                        }
+
+                    if tool_call_delta.id:
+                        tool_call["id"] = tool_call_delta.id
+                    if tool_call_delta.type:
+                        tool_call["type"] = tool_call_delta.type
+
+                    function = tool_call_delta.function
+                    if function is not None:
+                        if function.name:
+                            tool_call["name"] = function.name
+                        if function.arguments:
+                            tool_call["arguments"].append(function.arguments)
+
+    def get_output(self):
+        """The parsed message, or the list of messages when several choices were streamed."""
+        messages = [
+            OpenAIUtils.parse_message(accumulator.to_message())
+            for _, accumulator in sorted(self._choices.items())
+        ]
+        if not messages:
+            return None
+        return messages[0] if len(messages) == 1 else messages
+
+    def get_token_usage(self):
+        """Usage reported by the server, or the number of chunks when it didn't send any."""
+        if self.usage is not None:
+            return OpenAIUtils.parse_usage(self.usage)
+        return {"completion": self.chunks, "prompt": None}
+
+
+class ResponsesStreamAccumulator:
+    """
+    Rebuilds the output of a streamed `responses.create` call from its events.
+
+    The final response carried by `response.completed` (or `response.incomplete`,
+    `response.failed`) is used when it was received. Otherwise the output is
+    rebuilt from the text and function call argument deltas, buffered per output
+    item and joined once at the end.
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.deltas = 0
+        self.response = None
+        # output index -> {"type", "call_id", "name", "parts"}
+        self._items = {}
+
+    def _get_item(self, output_index, item_type):
+        item = self._items.get(output_index)
+        if item is None:
+            item = self._items[output_index] = {"type": item_type, "call_id": None, "name": None, "parts": []}
+        return item
+
+    def add(self, event):
+        self.events += 1
+        event_type = event.type
+
+        if event_type == "response.output_text.delta":
+            self.deltas += 1
+            self._get_item(event.output_index, "message")["parts"].append(event.delta)
+        elif event_type == "response.function_call_arguments.delta":
+            self.deltas += 1
+            self._get_item(event.output_index, "function_call")["parts"].append(event.delta)
+        elif event_type == "response.output_item.added":
+            item = self._get_item(event.output_index, event.item.type)
+            item["call_id"] = getattr(event.item, "call_id", None)
+            item["name"] = getattr(event.item, "name", None)
+        elif event_type in ("response.completed", "response.incomplete", "response.failed"):
+            self.response = event.response
+
+    @property
+    def error(self):
+        """The error reported by `response.failed`, if any."""
+        return getattr(self.response, "error", None) if self.response is not None else None
+
+    def get_output(self):
+        if self.response is not None and self.response.output:
+            return OpenAIUtils.parse_responses_output_items(self.response.output)
+
+        items = []
+        for _, item in sorted(self._items.items()):
+            if item["type"] == "message":
+                items.append({"type": "message", "content": [{"type": "output_text", "text": "".join(item["parts"])}]})
+            elif item["type"] == "function_call":
+                items.append(
+                    {
+                        "type": "function_call",
+                        "call_id": item["call_id"],
+                        "name": item["name"],
+                        "arguments": "".join(item["parts"]),
+                    }
+                )
+        return OpenAIUtils.parse_responses_output_items(items)
+
+    def get_token_usage(self):
+        """Usage reported in the final response, or the number of deltas when it wasn't received."""
+        usage = getattr(self.response, "usage", None) if self.response is not None else None
+        if usage is not None:
+            return OpenAIUtils.parse_responses_usage(usage)
+        return {"completion": self.deltas, "prompt": None}
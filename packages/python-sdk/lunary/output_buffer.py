@@ -0,0 +1,67 @@
+from collections import deque
+from typing import Any, Literal
+
+OutputMode = Literal["join", "first", "last"]
+
+# Characters for "join", items for "first" and "last"
+DEFAULT_OUTPUT_LIMITS = {"join": 100_000, "first": 100, "last": 100}
+
+
+class OutputBuffer:
+    """
+    Bounded summary of the items yielded by a traced generator.
+
+    - "join": yielded strings are concatenated, keeping at most `limit` characters.
+      If the generator yields anything else than strings, the buffer falls back to "first".
+    - "first": keeps the first `limit` items.
+    - "last": keeps the last `limit` items.
+    """
+
+    __slots__ = ("mode", "limit", "count", "truncated", "_items", "_chars")
+
+    def __init__(self, mode: OutputMode = "join", limit: int | None = None):
+        if mode not in DEFAULT_OUTPUT_LIMITS:
+            raise ValueError(f"Invalid output mode '{mode}', expected one of {list(DEFAULT_OUTPUT_LIMITS)}")
+        self.mode = mode
+        self.limit = limit if limit is not None else DEFAULT_OUTPUT_LIMITS[mode]
+        self.count = 0
+        self.truncated = False
+        self._chars = 0
+        self._items = deque(maxlen=self.limit) if mode == "last" else []
+
+    def _fall_back_to_first(self) -> None:
+        self.mode = "first"
+        self.limit = DEFAULT_OUTPUT_LIMITS["first"]
+        if len(self._items) > self.limit:
+            del self._items[self.limit :]
+            self.truncated = True
+
+    def add(self, item: Any) -> None:
+        self.count += 1
+
+        if self.mode == "join":
+            if isinstance(item, str):
+                if self._chars < self.limit:
+                    part = item[: self.limit - self._chars]
+                    self._items.append(part)
+                    self._chars += len(part)
+                    if len(part) < len(item):
+                        self.truncated = True
+                elif item:
+                    self.truncated = True
+                return
+            self._fall_back_to_first()
+
+        if self.mode == "last":
+            if len(self._items) == self.limit:
+                self.truncated = True
+            self._items.append(item)
+        elif len(self._items) < self.limit:
+            self._items.append(item)
+        else:
+            self.truncated = True
+
+    def get_output(self) -> Any:
+        if self.mode == "join":
+            return "".join(self._items)
+        return list(self._items)
@@ -1,36 +1,88 @@
 import logging
-from typing import Optional, Dict, List
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional, Dict, NamedTuple
 from uuid import uuid4, UUID
 
+from .stats import stats
+
 logger = logging.getLogger(__name__)
 
 RunID = str | UUID
 
+DEFAULT_RUN_TTL = 60 * 60  # seconds
+DEFAULT_MAX_RUNS = 50_000
+
 class Run:
     def __init__(self, run_id: str | None = None, parent_run_id: str | None = None):
         self.id: str = run_id or str(uuid4())
         self.parent_run_id: str | None = parent_run_id
-        self.children: List[Run] = []
+        self.children: Dict[str, Run] = {}
+        self.started_at: float = time.monotonic()
+        # Set by the LangChain callback handler when the run matches an ignore rule
+        self.ignored: bool = False
+        self.ignore_children: bool = True
+
+class _RunFrame(NamedTuple):
+    run: Run
+    previous: Optional["_RunFrame"]
 
 class RunManager:
-    def __init__(self):
+    """
+    Keeps track of the runs that are currently open.
+
+    The `runs` index is shared by every thread and task and is guarded by a lock.
+    The stack of active runs (used to find the parent of a new run) lives in a
+    `ContextVar`, so each thread and asyncio task only ever sees the runs it
+    started itself, plus the ones inherited from the context it was spawned from.
+
+    Runs whose end is never reported (cancelled streams, callbacks that never fire)
+    are reaped once they are older than `run_ttl` seconds, and at most `max_runs`
+    runs are tracked at once, the oldest being evicted first.
+    """
+
+    def __init__(self, run_ttl: float = DEFAULT_RUN_TTL, max_runs: int = DEFAULT_MAX_RUNS):
+        # Insertion ordered, so the oldest runs are always first.
         self.runs: Dict[str, Run] = {}
-        self._current_run: Run | None = None
-        self._run_stack: List[Run] = []  
+        self.run_ttl = run_ttl
+        self.max_runs = max_runs
+        self._lock = threading.RLock()
+        self._last_reap = time.monotonic()
+        # Linked list of immutable frames: pushing and popping are O(1) and a
+        # context copied into a child task never shares mutable state with its parent.
+        self._run_stack: ContextVar[_RunFrame | None] = ContextVar(
+            "lunary_run_stack", default=None
+        )
+
+    def _is_active(self, run: Run) -> bool:
+        return self.runs.get(run.id) is run
+
+    def _active_frame(self) -> _RunFrame | None:
+        top = frame = self._run_stack.get()
+        # Runs can be ended out of order, from another context (e.g. a LangChain callback
+        # fired in a worker thread) or reaped, so skip entries that are no longer tracked.
+        while frame is not None and not self._is_active(frame.run):
+            frame = frame.previous
+        if frame is not top:
+            self._run_stack.set(frame)
+        return frame
 
     @property
     def current_run(self) -> Run | None:
         """Get the currently active run."""
-        return self._current_run
+        frame = self._active_frame()
+        return frame.run if frame else None
 
     @property
     def current_run_id(self) -> str | None:
         """Safely get the ID of the current run, or None if there is no current run."""
-        return self._current_run.id if self._current_run else None
+        run = self.current_run
+        return run.id if run else None
 
     def start_run(self, run_id: RunID | None = None, parent_run_id: RunID | None = None) -> Run | None:
-        # if parent_run_id is None and self._current_run is not None:
-        #     parent_run_id = self._current_run.id
+        # if parent_run_id is None and self.current_run is not None:
+        #     parent_run_id = self.current_run.id
 
         if run_id is not None and run_id == parent_run_id:
             logger.warning("A run cannot be its own parent.")
@@ -41,22 +93,32 @@ class RunManager:
         if isinstance(parent_run_id, UUID):
             parent_run_id = str(parent_run_id)
 
-        if not self._run_exists(parent_run_id):
-            # in Langchain CallbackHandler, sometimes it pass a parent_run_id for run that do not exist. 
-            # Those runs should be ignored by Lunary
-            parent_run_id = None
-
         run = Run(run_id, parent_run_id)
-        self.runs[run.id] = run
 
-        if parent_run_id:
-            parent_run = self.runs.get(parent_run_id)
-            if parent_run:
-                parent_run.children.append(run)
+        with self._lock:
+            if run.started_at - self._last_reap >= min(self.run_ttl, 60):
+                self._reap_expired_runs(run.started_at)
 
-        if self._current_run:
-            self._run_stack.append(self._current_run)
-        self._current_run = run
+            while len(self.runs) >= self.max_runs:
+                oldest = next(iter(self.runs.values()))
+                logger.debug(f"Too many runs tracked, evicting run {oldest.id}")
+                stats.increment("runs_evicted", self._delete_run(oldest))
+
+            if not self._run_exists(parent_run_id):
+                # in Langchain CallbackHandler, sometimes it pass a parent_run_id for run that do not exist.
+                # Those runs should be ignored by Lunary
+                run.parent_run_id = None
+
+            # A run can be started twice with the same id, re-insert it so `runs` stays ordered by start time
+            existing = self.runs.pop(run.id, None)
+            if existing is not None:
+                run.children = existing.children
+            self.runs[run.id] = run
+
+            if run.parent_run_id:
+                self.runs[run.parent_run_id].children[run.id] = run
+
+        self._run_stack.set(_RunFrame(run, self._active_frame()))
 
         return run
 
@@ -64,27 +126,67 @@ class RunManager:
         if isinstance(run_id, UUID):
             run_id = str(run_id)
 
-        run = self.runs.get(run_id)
-        if run:
-            if self._current_run and self._current_run.id == run_id:
-                self._current_run = self._run_stack.pop() if self._run_stack else None
-            self._delete_run(run)
+        # Runs ended out of order stay in the stack until `current_run` skips past them
+        frame = self._run_stack.get()
+        if frame is not None and frame.run.id == run_id:
+            self._run_stack.set(frame.previous)
+
+        with self._lock:
+            run = self.runs.get(run_id)
+            if run:
+                self._delete_run(run)
 
         return run_id
 
+    def suspend_run(self, run: Run) -> None:
+        """
+        Stops `run` from being the current run of this context, without ending it.
+        Used by generators, whose caller must not see their run between two items.
+        """
+        frame = self._run_stack.get()
+        if frame is not None and frame.run is run:
+            self._run_stack.set(frame.previous)
+
+    def resume_run(self, run: Run) -> None:
+        """Makes a suspended run the current run of the context it is resumed from."""
+        if self._is_active(run):
+            self._run_stack.set(_RunFrame(run, self._active_frame()))
+
+    def reap_expired_runs(self) -> int:
+        """Forgets the runs older than `run_ttl`. Returns the number of runs reaped."""
+        with self._lock:
+            return self._reap_expired_runs(time.monotonic())
+
+    def _reap_expired_runs(self, now: float) -> int:
+        self._last_reap = now
+        deadline = now - self.run_ttl
+        reaped = 0
+        while self.runs:
+            oldest = next(iter(self.runs.values()))
+            if oldest.started_at > deadline:
+                break
+            logger.debug(f"Run {oldest.id} never ended, reaping it")
+            reaped += self._delete_run(oldest)
+
+        if reaped:
+            stats.increment("runs_reaped", reaped)
+        return reaped
+
     def _run_exists(self, run_id: str | None) -> bool:
         if run_id is None:
             return False
         return run_id in self.runs
 
-    def _delete_run(self, run: Run) -> None:
-         for child in list(run.children): # iterate over a copy
-             self._delete_run(child)
+    def _delete_run(self, run: Run) -> int:
+        """Removes a run and all its descendants. Returns the number of runs removed."""
+        deleted = 1
+        for child in list(run.children.values()):  # iterate over a copy
+            deleted += self._delete_run(child)
 
-         if run.parent_run_id:
-             parent_run = self.runs.get(run.parent_run_id)
-             if parent_run and run in parent_run.children:  # membership guard
-                 parent_run.children.remove(run)
+        if run.parent_run_id:
+            parent_run = self.runs.get(run.parent_run_id)
+            if parent_run:
+                parent_run.children.pop(run.id, None)
 
-         self._run_stack = [r for r in self._run_stack if r.id != run.id]
-         self.runs.pop(run.id, None)              # safe pop 
\ No newline at end of file
+        self.runs.pop(run.id, None)
+        return deleted
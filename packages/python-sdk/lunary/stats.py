@@ -0,0 +1,31 @@
+import threading
+from collections import Counter
+from typing import Dict
+
+
+class SDKStats:
+    """Process-wide counters describing what the SDK did internally (runs reaped, cache hits...)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+stats = SDKStats()
+
+
+def get_stats() -> Dict[str, int]:
+    """Returns a copy of the SDK internal counters."""
+    return stats.snapshot()
@@ -0,0 +1,88 @@
+import math
+import random
+from array import array
+from time import perf_counter
+from typing import Any, Dict
+
+
+# Inter-chunk gaps kept to compute the latency percentiles of a stream
+MAX_SAMPLED_GAPS = 1024
+
+
+def _percentile(sorted_values, percent: float) -> float:
+    # Nearest-rank percentile
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+class StreamTimer:
+    """
+    Measures the latency profile of a streamed LLM call.
+
+    Uses a monotonic clock. Inter-chunk gaps are stored in a C double array,
+    so recording a chunk doesn't create any Python object that outlives the
+    call to `tick()`. Past `MAX_SAMPLED_GAPS` gaps, the array is a uniform
+    reservoir sample of them, so memory stays bounded however long the
+    stream is. The maximum gap is always exact.
+    """
+
+    __slots__ = ("started_at", "first_chunk_at", "last_chunk_at", "_gaps", "_gap_count", "_max_gap")
+
+    def __init__(self):
+        self.started_at = perf_counter()
+        self.first_chunk_at = None
+        self.last_chunk_at = None
+        self._gaps = array("d")
+        self._gap_count = 0
+        self._max_gap = 0.0
+
+    def tick(self) -> None:
+        now = perf_counter()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        else:
+            gap = now - self.last_chunk_at
+            self._gap_count += 1
+            if gap > self._max_gap:
+                self._max_gap = gap
+            if self._gap_count <= MAX_SAMPLED_GAPS:
+                self._gaps.append(gap)
+            else:
+                # Reservoir sampling: each gap is kept with a probability of MAX_SAMPLED_GAPS / count
+                index = int(random.random() * self._gap_count)
+                if index < MAX_SAMPLED_GAPS:
+                    self._gaps[index] = gap
+        self.last_chunk_at = now
+
+    def get_metrics(self, completion_tokens: int | None = None, ended_at: float | None = None) -> Dict[str, Any]:
+        """
+        Returns the metrics, in milliseconds, to attach to the `end` event.
+        `ended_at` (a `perf_counter()` value) defaults to now.
+        """
+        if ended_at is None:
+            ended_at = perf_counter()
+        metrics: Dict[str, Any] = {"streamDuration": _ms(ended_at - self.started_at)}
+
+        if self.first_chunk_at is None:
+            return metrics
+
+        metrics["timeToFirstToken"] = _ms(self.first_chunk_at - self.started_at)
+
+        if self._gaps:
+            gaps = sorted(self._gaps)
+            metrics["interTokenLatency"] = {
+                "p50": _ms(_percentile(gaps, 50)),
+                "p90": _ms(_percentile(gaps, 90)),
+                "p99": _ms(_percentile(gaps, 99)),
+                "max": _ms(self._max_gap),
+            }
+
+        generation_time = self.last_chunk_at - self.first_chunk_at
+        if completion_tokens and generation_time > 0:
+            metrics["tokensPerSecond"] = round(completion_tokens / generation_time, 2)
+
+        return metrics
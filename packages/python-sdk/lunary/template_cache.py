@@ -0,0 +1,531 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATE_CACHE_TTL = 60  # seconds
+DEFAULT_TEMPLATE_CACHE_SIZE = 1000
+# How long after its expiry an entry can still be served while it can't be refreshed
+DEFAULT_TEMPLATE_MAX_STALE = 24 * 60 * 60  # seconds
+# Delay between two refreshes of an expired entry, when they fail
+REFRESH_RETRY_INTERVAL = 5  # seconds
+# How long a request for template changes waits for them on the API side
+SUBSCRIPTION_POLL_TIMEOUT = 25  # seconds
+# Delays between two attempts when waiting for template changes fails, doubled after each failure
+SUBSCRIPTION_RETRY_MIN = 1  # seconds
+SUBSCRIPTION_RETRY_MAX = 60  # seconds
+
+_MISSING = object()
+# Returned by fetch functions when the API answered that the cached version is still the latest
+NOT_MODIFIED = object()
+
+# (api_url, app_id, slug)
+TemplateKey = Tuple[str, str, str]
+# (api_url, app_id)
+ProjectKey = Tuple[str, str]
+# Fetch functions are called with the ETag of the cached version, if any, and return
+# `(data, etag)`, `data` being NOT_MODIFIED when the cached version is still the latest.
+FetchResult = Tuple[Any, str | None]
+
+
+class _Entry:
+    __slots__ = ("data", "etag", "fetched_at", "retry_at")
+
+    def __init__(self, data: Any, etag: str | None, fetched_at: float):
+        self.data = data
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.retry_at = fetched_at
+
+
+class _Flight:
+    """A fetch in progress, whose result is shared with every caller asking for the same key meanwhile."""
+
+    __slots__ = ("thread_id", "previous", "done", "data", "error", "waiters")
+
+    def __init__(self, thread_id: int | None = None, previous: _Entry | None = None):
+        # Thread making the fetch, None for the background refresh threads
+        self.thread_id = thread_id
+        # Cached version being revalidated
+        self.previous = previous
+        self.done = threading.Event()
+        self.data = None
+        self.error: BaseException | None = None
+        # (loop, future) of the async callers waiting for the result
+        self.waiters = []
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+def _set_future_result(future: asyncio.Future, data: Any, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(data)
+
+
+class TemplateCache:
+    """
+    LRU cache of the template versions fetched from the API, shared by every thread.
+
+    Entries are kept `ttl` seconds and at most `max_size` of them are kept, the
+    least recently used being evicted first. When an entry is missing (or too stale),
+    a single fetch per key is made at a time: the sync and async callers asking
+    for the same key meanwhile wait for its result instead of fetching it again.
+    Failed fetches are not cached.
+
+    Expired entries are served stale while they are refreshed in the background
+    (stale-while-revalidate). If the refresh fails, e.g. because the API is down,
+    the stale version keeps being served, up to `max_stale` seconds after its
+    expiry, and the refresh is retried every `REFRESH_RETRY_INTERVAL` seconds.
+
+    Fetches revalidate the cached version with its ETag: when the API answers it's
+    still the latest, it's kept and served for another `ttl` seconds.
+
+    With a `disk` store, fetched versions are also saved on disk, and a key missing
+    from memory is first looked up there. Versions loaded from disk are served as
+    expired ones: right away, while they are revalidated in the background.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TEMPLATE_CACHE_TTL,
+        max_size: int = DEFAULT_TEMPLATE_CACHE_SIZE,
+        max_stale: float = DEFAULT_TEMPLATE_MAX_STALE,
+        disk: "TemplateDiskStore | None" = None,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_stale = max_stale
+        self.disk = disk
+        # Keys already looked up on disk
+        self._disk_loaded = set()
+        self._entries: "OrderedDict[TemplateKey, _Entry]" = OrderedDict()
+        self._flights: Dict[TemplateKey, _Flight] = {}
+        self._lock = threading.Lock()
+        # Keeps the background refresh tasks alive until they are done
+        self._tasks = set()
+        # Projects whose live templates have all been loaded
+        self._ready = set()
+        self._pollers: Dict[ProjectKey, "TemplatePoller"] = {}
+        self._subscribers: Dict[ProjectKey, "TemplateSubscriber"] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: TemplateKey, is_async: bool = False):
+        """
+        Returns `(data, refresh, False)` when the entry can be served, `refresh` being the
+        flight the caller must start in the background to refresh a stale entry, if any.
+        Otherwise returns `(_MISSING, flight, is_leader)`, the leader making the fetch.
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            flight = self._flights.get(key)
+
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    stats.increment("template_cache_hits")
+                    return entry.data, None, False
+
+                if age < self.ttl + self.max_stale:
+                    self._entries.move_to_end(key)
+                    stats.increment("template_cache_stale_hits")
+                    refresh = None
+                    if flight is None and now >= entry.retry_at:
+                        thread_id = threading.get_ident() if is_async else None
+                        refresh = self._flights[key] = _Flight(thread_id, entry)
+                    return entry.data, refresh, False
+
+            stats.increment("template_cache_misses")
+            # A sync caller can't wait for a fetch made by its own thread (an async
+            # one, running in the event loop it would block), so it makes its own.
+            if flight is not None and (is_async or flight.thread_id != threading.get_ident()):
+                stats.increment("template_fetches_deduplicated")
+                return _MISSING, flight, False
+
+            flight = _Flight(threading.get_ident(), entry)
+            self._flights.setdefault(key, flight)
+            return _MISSING, flight, True
+
+    def _load_from_disk(self, key: TemplateKey) -> None:
+        with self._lock:
+            if key in self._entries or key in self._disk_loaded:
+                return
+            self._disk_loaded.add(key)
+
+        stored = self.disk.load(key)
+        if stored is None:
+            return
+        data, etag, age = stored
+
+        with self._lock:
+            if key not in self._entries:
+                self._store(key, data, etag, time.monotonic() - max(age, self.ttl))
+                stats.increment("template_disk_loads")
+
+    def _resolve(
+        self, key: TemplateKey, flight: _Flight, result: FetchResult | None = None, error: BaseException | None = None
+    ) -> Any:
+        data = etag = None
+        not_modified = False
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if error is None:
+                data, etag = result
+                if data is NOT_MODIFIED:
+                    stats.increment("template_not_modified")
+                    not_modified = True
+                    data = flight.previous.data
+                self._store(key, data, etag)
+            elif key in self._entries:
+                self._entries[key].retry_at = time.monotonic() + REFRESH_RETRY_INTERVAL
+            flight.data = data
+            flight.error = error
+            flight.done.set()
+            waiters, flight.waiters = flight.waiters, []
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_set_future_result, future, data, error)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+
+        if self.disk is not None and error is None:
+            if not_modified:
+                self.disk.touch(key)
+            else:
+                self.disk.save(key, data, etag)
+
+        return data
+
+    def _store(self, key: TemplateKey, data: Any, etag: str | None = None, fetched_at: float | None = None) -> None:
+        fetched_at = time.monotonic() if fetched_at is None else fetched_at
+        self._entries[key] = _Entry(data, etag, fetched_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            stats.increment("template_cache_evictions")
+
+    def _refresh(self, key: TemplateKey, flight: _Flight, fetch: Callable[[str | None], FetchResult]) -> None:
+        try:
+            result = fetch(flight.previous.etag)
+        except Exception as e:
+            self._refresh_failed(key, flight, e)
+            return
+        except BaseException:
+            self._resolve(key, flight, error=RuntimeError("Template fetch was interrupted"))
+            raise
+        self._resolve(key, flight, result)
+
+    async def _refresh_async(
+        self, key: TemplateKey, flight: _Flight, fetch: Callable[[str | None], Awaitable[FetchResult]]
+    ) -> None:
+        try:
+            result = await fetch(flight.previous.etag)
+        except Exception as e:
+            self._refresh_failed(key, flight, e)
+            return
+        except BaseException:
+            self._resolve(key, flight, error=RuntimeError("Template fetch was cancelled"))
+            raise
+        self._resolve(key, flight, result)
+
+    def _refresh_failed(self, key: TemplateKey, flight: _Flight, error: Exception) -> None:
+        stats.increment("template_refresh_errors")
+        logger.warning(f"Error refreshing template '{key[2]}', serving the cached version: {error}")
+        self._resolve(key, flight, error=error)
+
+    def get(self, key: TemplateKey, fetch: Callable[[str | None], FetchResult]) -> Any:
+        if self.disk is not None and key not in self._entries:
+            self._load_from_disk(key)
+        data, flight, is_leader = self._lookup(key)
+        if data is not _MISSING:
+            if flight is not None:
+                threading.Thread(target=self._refresh, args=(key, flight, fetch), daemon=True).start()
+            return data
+        if not is_leader:
+            return flight.wait()
+
+        try:
+            result = fetch(flight.previous.etag if flight.previous else None)
+        except Exception as e:
+            self._resolve(key, flight, error=e)
+            raise
+        except BaseException:
+            self._resolve(key, flight, error=RuntimeError("Template fetch was interrupted"))
+            raise
+        return self._resolve(key, flight, result)
+
+    async def get_async(self, key: TemplateKey, fetch: Callable[[str | None], Awaitable[FetchResult]]) -> Any:
+        if self.disk is not None and key not in self._entries:
+            # Template files are small and read once, not worth a thread
+            self._load_from_disk(key)
+        data, flight, is_leader = self._lookup(key, is_async=True)
+        if data is not _MISSING:
+            if flight is not None:
+                task = asyncio.get_running_loop().create_task(self._refresh_async(key, flight, fetch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return data
+
+        if not is_leader:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                is_done = flight.done.is_set()
+                if not is_done:
+                    flight.waiters.append((loop, future))
+            if is_done:
+                return flight.wait()
+            return await future
+
+        try:
+            result = await fetch(flight.previous.etag if flight.previous else None)
+        except Exception as e:
+            self._resolve(key, flight, error=e)
+            raise
+        except BaseException:
+            # The fetch was cancelled, the waiting callers get an error they can handle
+            self._resolve(key, flight, error=RuntimeError("Template fetch was cancelled"))
+            raise
+        return self._resolve(key, flight, result)
+
+    def put(self, key: TemplateKey, data: Any) -> None:
+        with self._lock:
+            self._store(key, data)
+        if self.disk is not None:
+            self.disk.save(key, data, None)
+
+    def mark_ready(self, project: ProjectKey) -> None:
+        self._ready.add(project)
+
+    def is_ready(self, project: ProjectKey) -> bool:
+        return project in self._ready
+
+    def set_poller(self, project: ProjectKey, poller: "TemplatePoller | None") -> None:
+        """Replaces the poller refreshing the templates of `project`, stopping the previous one."""
+        with self._lock:
+            previous = self._pollers.pop(project, None)
+            if poller is not None:
+                self._pollers[project] = poller
+        if previous is not None:
+            previous.stop()
+        if poller is not None:
+            poller.start()
+
+    def subscribe(self, project: ProjectKey, subscriber: "TemplateSubscriber") -> bool:
+        """Starts `subscriber` unless one is already running for `project`. Returns whether it was started."""
+        with self._lock:
+            if project in self._subscribers:
+                return False
+            self._subscribers[project] = subscriber
+        subscriber.start()
+        return True
+
+    def unsubscribe(self, project: ProjectKey) -> None:
+        with self._lock:
+            subscriber = self._subscribers.pop(project, None)
+        if subscriber is not None:
+            subscriber.stop()
+
+    def refresh(self, key: TemplateKey, fetch: Callable[[str | None], FetchResult]) -> None:
+        """
+        Fetches a cached template again right away, e.g. because it changed. Keys not
+        cached are ignored. The cached version is served as an expired one meanwhile,
+        so if the fetch fails, it's refreshed again by the next calls.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    return
+                flight = self._flights.get(key)
+                if flight is None:
+                    entry.fetched_at = min(entry.fetched_at, time.monotonic() - self.ttl)
+                    flight = self._flights[key] = _Flight(None, entry)
+                    break
+            # A fetch started before the change may return the previous version
+            flight.done.wait()
+        self._refresh(key, flight, fetch)
+
+    def invalidate(self, key: TemplateKey | None = None, disk: bool = True) -> None:
+        """
+        Forgets the cached version of a template, or of every template if no key is given,
+        in memory and, unless `disk` is False, on disk.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if disk and self.disk is not None:
+            if key is None:
+                self.disk.clear()
+            else:
+                self.disk.delete(key)
+
+
+class TemplatePoller:
+    """Calls `load` every `interval` seconds from a daemon thread, until stopped."""
+
+    def __init__(self, load: Callable[[], Any], interval: float):
+        self.load = load
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lunary-template-poller", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.load()
+            except Exception as e:
+                stats.increment("template_poll_errors")
+                logger.warning(f"Error refreshing live templates: {e}")
+
+
+class TemplateSubscriber:
+    """
+    Waits for template changes from a daemon thread, until stopped.
+
+    `poll(cursor)` waits for the templates changed after `cursor` (None at first) and
+    returns `(cursor, slugs)`. `on_change(slugs)` is then called with the changed ones.
+    Failures are retried with an exponential backoff, from the last cursor, so the
+    changes made meanwhile aren't missed.
+    """
+
+    def __init__(self, poll: Callable[[str | None], Tuple[str, list]], on_change: Callable[[list], Any]):
+        self.poll = poll
+        self.on_change = on_change
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lunary-template-subscriber", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # A request in progress isn't interrupted, its result is ignored
+        self._stopped.set()
+
+    def _run(self) -> None:
+        cursor = None
+        retry_delay = SUBSCRIPTION_RETRY_MIN
+        while not self._stopped.is_set():
+            try:
+                cursor, slugs = self.poll(cursor)
+            except Exception as e:
+                stats.increment("template_subscription_errors")
+                logger.warning(f"Error waiting for template changes, retrying in {retry_delay}s: {e}")
+                self._stopped.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, SUBSCRIPTION_RETRY_MAX)
+                continue
+
+            retry_delay = SUBSCRIPTION_RETRY_MIN
+            if slugs and not self._stopped.is_set():
+                stats.increment("template_changes_received", len(slugs))
+                try:
+                    self.on_change(slugs)
+                except Exception as e:
+                    logger.warning(f"Error refreshing changed templates: {e}")
+
+
+# Names of the files written by `TemplateDiskStore`: the sha256 of their key
+STORED_FILE_NAME = re.compile(r"[0-9a-f]{64}\.json")
+
+
+class TemplateDiskStore:
+    """
+    Template versions saved on disk, one JSON file per key, so new processes can
+    serve them without waiting for the API, or while it can't be reached.
+
+    Files are named after a hash of their key and replaced atomically, so a reader
+    never sees a partially written file. Their modification time is when the version
+    was last known to be the latest, and is updated when it's revalidated.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: TemplateKey) -> str:
+        digest = hashlib.sha256("\n".join(str(part) for part in key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def load(self, key: TemplateKey) -> Tuple[Any, str | None, float] | None:
+        """Returns the stored `(data, etag, age)` of a key, or None if it isn't stored."""
+        try:
+            with open(self._path(key), "rb") as file:
+                age = time.time() - os.fstat(file.fileno()).st_mtime
+                stored = json.load(file)
+            return stored["data"], stored.get("etag"), max(age, 0)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Error reading cached template '{key[2]}' from disk: {e}")
+            return None
+
+    def save(self, key: TemplateKey, data: Any, etag: str | None) -> None:
+        temp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=".json")
+            with os.fdopen(fd, "w") as file:
+                json.dump({"etag": etag, "data": data}, file)
+            os.replace(temp_path, self._path(key))
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Error saving template '{key[2]}' to disk: {e}")
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+
+    def touch(self, key: TemplateKey) -> None:
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def delete(self, key: TemplateKey) -> None:
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        """Deletes the stored templates, leaving any other file of the directory alone."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if STORED_FILE_NAME.fullmatch(name):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,442 @@
+import asyncio
+import copy
+import hashlib
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import chevron
+from chevron.tokenizer import tokenize
+from pydantic import BaseModel
+
+from .exceptions import TemplateError
+from .stats import stats
+
+# Compiled versions kept in memory, the least recently used being dropped first
+MAX_COMPILED_TEMPLATES = 1000
+# Rows rendered at once by a worker process, or between two yields to the event loop
+RENDER_CHUNK_SIZE = 256
+
+# `{{name}}`, `{{{name}}}` and `{{& name}}`
+_MUSTACHE_VARIABLE = re.compile(r"\{\{\{\s*([^{}]*?)\s*\}\}\}|\{\{&?\s*([^{}]*?)\s*\}\}")
+
+# Tags that don't need chevron's scope stack to be rendered
+_FLAT_TAGS = {"literal", "variable", "no escape", "set delimiter"}
+
+
+def _html_escape(text: str) -> str:
+    """Same escaping as chevron: & first, then " < >."""
+    return text.replace("&", "&amp;").replace('"', "&quot;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _get_value(path: Tuple[str, ...], data: Any) -> Any:
+    """Looks a dotted key up in `data` like chevron does when `data` is the only scope."""
+    scope = data
+    try:
+        for child in path:
+            try:
+                scope = scope[child]
+            except (TypeError, AttributeError):
+                try:
+                    scope = getattr(scope, child)
+                except (TypeError, AttributeError):
+                    scope = scope[int(child)]
+
+        # Falsy values render as an empty string, except 0 and False
+        if scope in (0, False):
+            return scope
+        try:
+            if scope._CHEVRON_return_scope_when_falsy:
+                return scope
+        except AttributeError:
+            return scope or ""
+    except (AttributeError, KeyError, IndexError, ValueError):
+        pass
+    return ""
+
+
+class CompiledText:
+    """
+    A mustache template tokenized once.
+
+    Templates made only of text and variables are rendered from a flat list of
+    literals and variable slots. The others (sections, partials...) are rendered
+    by chevron, from the tokens so they aren't parsed again.
+    """
+
+    __slots__ = ("segments", "tokens")
+
+    def __init__(self, text: str):
+        tokens = list(tokenize(text))
+        # `{{.}}` renders the whole data, which chevron handles specially
+        if all(tag in _FLAT_TAGS and (tag == "literal" or key != ".") for tag, key in tokens):
+            self.tokens = None
+            self.segments = [
+                key if tag == "literal" else (tuple(key.split(".")), tag == "variable")
+                for tag, key in tokens
+                if tag != "set delimiter"
+            ]
+        else:
+            self.tokens = tokens
+            self.segments = None
+
+    def render(self, data: Any) -> str:
+        if self.tokens is not None:
+            return chevron.render(self.tokens, data)
+
+        parts = []
+        for segment in self.segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+                continue
+            path, escape = segment
+            value = _get_value(path, data)
+            if not isinstance(value, str):
+                value = str(value)
+            parts.append(_html_escape(value) if escape else value)
+        return "".join(parts)
+
+
+def _nested_keys(obj: Dict[str, Any]) -> List[str]:
+    """Keys whose values are containers, which must be copied for each render."""
+    return [key for key, value in obj.items() if isinstance(value, (dict, list, set))]
+
+
+def _copy_json(value: Any) -> Any:
+    """Deep copy of parsed JSON, several times faster than `copy.deepcopy`."""
+    value_type = type(value)
+    if value_type is dict:
+        return {key: _copy_json(item) for key, item in value.items()}
+    if value_type is list:
+        return [_copy_json(item) for item in value]
+    if value_type in (str, int, float, bool) or value is None:
+        return value
+    return copy.deepcopy(value)
+
+
+def _copy_nested(obj: Dict[str, Any], nested_keys: List[str]) -> Dict[str, Any]:
+    result = dict(obj)
+    for key in nested_keys:
+        result[key] = _copy_json(result[key])
+    return result
+
+
+class CompiledTemplate:
+    """
+    A template version compiled once, then rendered without parsing its content again.
+    Rendered results share nothing mutable with the compiled version.
+    """
+
+    __slots__ = ("extra_headers", "extra", "extra_nested", "text", "messages")
+
+    def __init__(self, raw_template: Dict[str, Any]):
+        content = raw_template["content"]
+        self.extra_headers = {"Template-Id": str(raw_template["id"])}
+        self.extra = dict(raw_template["extra"])
+        self.extra_nested = _nested_keys(self.extra)
+        self.text = None
+        self.messages = None
+
+        if isinstance(content, str):
+            self.text = CompiledText(content)
+        else:
+            self.messages = []
+            for message in content:
+                fields = dict(message)
+                text = fields.get("content")
+                # Non-text content (e.g. None for tool calls) is rendered like before, by chevron
+                compiled = CompiledText(text) if isinstance(text, str) else None
+                self.messages.append((fields, _nested_keys(fields), compiled))
+
+    def render(self, data: Any) -> Dict[str, Any]:
+        extra = _copy_nested(self.extra, self.extra_nested) if self.extra_nested else self.extra
+        extra_headers = dict(self.extra_headers)
+
+        if self.text is not None:
+            return {"text": self.text.render(data), "extra_headers": extra_headers, **extra}
+
+        messages = []
+        for fields, nested_keys, compiled in self.messages:
+            message = _copy_nested(fields, nested_keys)
+            if compiled is not None:
+                message["content"] = compiled.render(data)
+            else:
+                message["content"] = chevron.render(message["content"], data)
+            messages.append(message)
+        return {"messages": messages, "extra_headers": extra_headers, **extra}
+
+
+class _VersionCache:
+    """
+    Values built from a template version, e.g. its compiled version, keyed by version id.
+    A value is reused as long as the template cache returns the same template object,
+    and built again once it has been refetched.
+    """
+
+    def __init__(self, build: Callable[[Dict[str, Any]], Any], max_size: int = MAX_COMPILED_TEMPLATES):
+        self.build = build
+        self.max_size = max_size
+        self._values: "OrderedDict[str, Tuple[Dict[str, Any], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, raw_template: Dict[str, Any]) -> Any:
+        version_id = str(raw_template["id"])
+        with self._lock:
+            cached = self._values.get(version_id)
+            if cached is not None and cached[0] is raw_template:
+                self._values.move_to_end(version_id)
+                return cached[1]
+
+        value = self.build(raw_template)
+        with self._lock:
+            self._values[version_id] = (raw_template, value)
+            self._values.move_to_end(version_id)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+        return value
+
+
+_compiled_templates = _VersionCache(CompiledTemplate)
+
+
+def compile_template(raw_template: Dict[str, Any]) -> CompiledTemplate:
+    """Returns the compiled version of a template fetched from the API, compiling it on its first use."""
+    return _compiled_templates.get(raw_template)
+
+
+class FrozenDict(dict):
+    """A dict that can't be modified. `dict(frozen)` returns a modifiable copy."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Rendered templates from the render cache are read-only, copy them to modify them")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only version of a rendered template: dicts become `FrozenDict` and lists tuples."""
+    value_type = type(value)
+    if value_type is dict:
+        return FrozenDict({key: _freeze(item) for key, item in value.items()})
+    if value_type is list:
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _canonical(value: Any) -> Any:
+    """
+    Representation of template data that doesn't depend on the order of dict keys.
+    Lists, tuples, ints, floats and bools are kept apart, since they don't render the same.
+    Raises TypeError for other types, whose rendering may change without their value changing.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return ("d", tuple(sorted((repr(key), _canonical(item)) for key, item in value.items())))
+    if value_type is list or value_type is tuple:
+        return (value_type.__name__, tuple(_canonical(item) for item in value))
+    if value_type in (str, int, float, bool) or value is None:
+        return value
+    raise TypeError(f"{value_type.__name__} values aren't cached")
+
+
+def data_digest(data: Any) -> bytes:
+    """Stable hash of template data, equal for equal data whatever its key order."""
+    return hashlib.blake2b(repr(_canonical(data)).encode(), digest_size=16).digest()
+
+
+class RenderCache:
+    """
+    LRU of rendered templates, keyed by template version id and hash of the data.
+
+    Disabled while `max_size` is 0. When enabled, rendered templates are returned
+    read-only (see `FrozenDict`), since the same result is shared by every caller.
+    Entries are tied to the compiled version they were rendered from, so they are
+    dropped once the version is fetched again, and versions no longer used age out.
+    Data containing other values than dicts, lists, tuples, strings, numbers,
+    bools and None is rendered every time.
+    """
+
+    def __init__(self, max_size: int = 0):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, bytes], Tuple[CompiledTemplate, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, raw_template: Dict[str, Any], data: Any) -> Dict[str, Any]:
+        compiled = compile_template(raw_template)
+        if not self.max_size:
+            return compiled.render(data)
+
+        try:
+            key = (str(raw_template["id"]), data_digest(data))
+        except TypeError:
+            return _freeze(compiled.render(data))
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] is compiled:
+                self._entries.move_to_end(key)
+                stats.increment("render_cache_hits")
+                return cached[1]
+
+        stats.increment("render_cache_misses")
+        result = _freeze(compiled.render(data))
+        with self._lock:
+            self._entries[key] = (compiled, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                stats.increment("render_cache_evictions")
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Template compiled by each worker process of `render_rows`
+_worker_template: CompiledTemplate | None = None
+
+
+def _init_render_worker(raw_template: Dict[str, Any]) -> None:
+    global _worker_template
+    _worker_template = CompiledTemplate(raw_template)
+
+
+def _render_chunk(rows: List[Any]) -> List[Dict[str, Any]]:
+    render = _worker_template.render
+    return [render(row) for row in rows]
+
+
+def _chunks(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(rows)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def render_rows(
+    raw_template: Dict[str, Any], rows: Iterable[Any], processes: int | None = None, chunk_size: int = RENDER_CHUNK_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """
+    Renders a template with each item of `rows`, yielding the results in order.
+
+    With `processes`, rows are rendered by chunks in a pool of worker processes.
+    At most two chunks per process are pending at once, so memory stays flat
+    whatever the number of rows.
+    """
+    try:
+        if not processes:
+            render = compile_template(raw_template).render
+            for row in rows:
+                yield render(row)
+            return
+
+        pool = ProcessPoolExecutor(processes, initializer=_init_render_worker, initargs=(raw_template,))
+        try:
+            pending = deque()
+            for chunk in _chunks(rows, chunk_size):
+                pending.append(pool.submit(_render_chunk, chunk))
+                if len(pending) >= processes * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+    except Exception as e:
+        raise TemplateError(f"Error rendering template: {str(e)}") from e
+
+
+async def render_rows_async(
+    raw_template: Dict[str, Any], rows: Iterable[Any], processes: int | None = None, chunk_size: int = RENDER_CHUNK_SIZE
+) -> AsyncIterator[Dict[str, Any]]:
+    """Asynchronous version of `render_rows`, giving control back to the event loop between chunks."""
+    try:
+        if not processes:
+            render = compile_template(raw_template).render
+            for chunk in _chunks(rows, chunk_size):
+                for row in chunk:
+                    yield render(row)
+                await asyncio.sleep(0)
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = ProcessPoolExecutor(processes, initializer=_init_render_worker, initargs=(raw_template,))
+        try:
+            pending = deque()
+            for chunk in _chunks(rows, chunk_size):
+                pending.append(loop.run_in_executor(pool, _render_chunk, chunk))
+                if len(pending) >= processes * 2:
+                    for result in await pending.popleft():
+                        yield result
+            while pending:
+                for result in await pending.popleft():
+                    yield result
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+    except Exception as e:
+        raise TemplateError(f"Error rendering template: {str(e)}") from e
+
+
+def mustache_to_f_string(text: str) -> str:
+    """
+    Converts a mustache template to the f-string format of LangChain prompts:
+    variables become `{name}` and literal braces are escaped as `{{` and `}}`.
+    """
+    parts = []
+    position = 0
+    for match in _MUSTACHE_VARIABLE.finditer(text):
+        parts.append(text[position : match.start()].replace("{", "{{").replace("}", "}}"))
+        parts.append("{" + (match.group(1) if match.group(1) is not None else match.group(2)) + "}")
+        position = match.end()
+    parts.append(text[position:].replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+
+def _build_langchain_prompt(raw_template: Dict[str, Any]):
+    from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+    content = raw_template["content"]
+    if isinstance(content, str):
+        return PromptTemplate.from_template(mustache_to_f_string(content))
+
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                message["role"].replace("assistant", "ai").replace("user", "human"),
+                mustache_to_f_string(message["content"]),
+            )
+            for message in content
+        ]
+    )
+
+
+_langchain_prompts = _VersionCache(_build_langchain_prompt)
+
+
+def _copy_message(message):
+    copied = copy.copy(message)
+    if isinstance(getattr(message, "prompt", None), BaseModel):
+        copied.prompt = copy.copy(message.prompt)
+    return copied
+
+
+def get_langchain_prompt(raw_template: Dict[str, Any]):
+    """
+    Returns the LangChain prompt of a template fetched from the API, built on its first
+    use. Callers get a copy of the prompt, of its list of messages and of each message
+    template, which they can modify without altering the cached prompt. Their strings
+    and variable lists are shared, which makes it several times faster than a deep copy.
+    """
+    prompt = _langchain_prompts.get(raw_template)
+    copied = copy.copy(prompt)
+    if isinstance(getattr(prompt, "messages", None), list):
+        copied.messages = [_copy_message(message) for message in prompt.messages]
+    return copied
@@ -0,0 +1,23 @@
+import pytest
+
+import lunary
+
+
+class EventCollector(list):
+    """Replaces the event queue, keeping the tracked events instead of sending them."""
+
+    def append(self, event):
+        if isinstance(event, list):
+            self.extend(event)
+        else:
+            super().append(event)
+
+    def by_event(self, name):
+        return [event for event in self if event["event"] == name]
+
+
+@pytest.fixture
+def events(monkeypatch):
+    collector = EventCollector()
+    monkeypatch.setattr(lunary, "queue", collector)
+    return collector
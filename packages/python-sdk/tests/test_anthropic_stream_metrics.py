@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import lunary
+
+anthropic = pytest.importorskip("anthropic")
+
+# Delay between `message_start` and the first text delta
+FIRST_TOKEN_DELAY = 0.2
+
+
+def sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps({'type': event_type, **data})}\n\n".encode()
+
+
+def stream_body():
+    yield sse(
+        "message_start",
+        {
+            "message": {
+                "id": "msg_1",
+                "type": "message",
+                "role": "assistant",
+                "model": "claude-test",
+                "content": [],
+                "stop_reason": None,
+                "stop_sequence": None,
+                "usage": {"input_tokens": 10, "output_tokens": 1},
+            }
+        },
+    )
+    yield sse("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+    time.sleep(FIRST_TOKEN_DELAY)
+    for text in ("Hel", "lo", "!"):
+        yield sse("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text}})
+        time.sleep(0.01)
+    yield sse("content_block_stop", {"index": 0})
+    yield sse("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 3}})
+    yield sse("message_stop", {})
+
+
+@pytest.fixture
+def client():
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=stream_body())
+
+    client = anthropic.Anthropic(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+    lunary.monitor(client)
+    return client
+
+
+def end_metrics(events):
+    [end] = events.by_event("end")
+    return end["output"], end["metadata"]["metrics"]
+
+
+def test_time_to_first_token_measures_the_first_text_delta(client, events):
+    for _ in client.messages.create(model="claude-test", max_tokens=10, messages=[{"role": "user", "content": "Hi"}], stream=True):
+        pass
+
+    output, metrics = end_metrics(events)
+    assert output["content"] == "Hello!"
+    assert metrics["timeToFirstToken"] >= FIRST_TOKEN_DELAY * 1000
+    # 3 deltas, so 2 gaps between them
+    assert metrics["interTokenLatency"]["max"] < FIRST_TOKEN_DELAY * 1000
+    assert metrics["tokensPerSecond"] > 0
+
+
+@pytest.mark.parametrize("read", ["iterate", "text_stream", "until_done"])
+def test_message_stream_reports_token_metrics(client, events, read):
+    with client.messages.stream(model="claude-test", max_tokens=10, messages=[{"role": "user", "content": "Hi"}]) as stream:
+        if read == "iterate":
+            for _ in stream:
+                pass
+        elif read == "text_stream":
+            assert "".join(stream.text_stream) == "Hello!"
+        else:
+            stream.until_done()
+
+    output, metrics = end_metrics(events)
+    assert output["content"] == "Hello!"
+    assert metrics["timeToFirstToken"] >= FIRST_TOKEN_DELAY * 1000
+    assert metrics["tokensPerSecond"] > 0
+
+
+def test_async_message_stream_reports_token_metrics(events):
+    async def body():
+        for chunk in stream_body():
+            yield chunk
+
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+    async def main():
+        client = anthropic.AsyncAnthropic(api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        lunary.monitor(client)
+        async with client.messages.stream(model="claude-test", max_tokens=10, messages=[{"role": "user", "content": "Hi"}]) as stream:
+            return "".join([text async for text in stream.text_stream])
+
+    assert asyncio.run(main()) == "Hello!"
+    _, metrics = end_metrics(events)
+    assert metrics["timeToFirstToken"] >= FIRST_TOKEN_DELAY * 1000
+    assert metrics["tokensPerSecond"] > 0
@@ -0,0 +1,197 @@
+from uuid import uuid4
+
+import pytest
+from langchain_core.outputs import Generation, LLMResult
+
+import lunary
+from lunary import LunaryCallbackHandler
+
+
+@pytest.mark.parametrize("ignore_mode", ["placeholder", "drop"])
+def test_valid_ignore_modes(ignore_mode):
+    LunaryCallbackHandler(app_id="test", ignore_mode=ignore_mode)
+
+
+def test_invalid_ignore_mode_raises():
+    with pytest.raises(ValueError, match="skip"):
+        LunaryCallbackHandler(app_id="test", ignore_mode="skip")
+
+
+def start(handler, run_type, name, parent=None):
+    run_id = uuid4()
+    if run_type == "chain":
+        handler.on_chain_start({}, {"question": "Hi"}, run_id=run_id, parent_run_id=parent, name=name)
+    elif run_type == "tool":
+        handler.on_tool_start({"name": name}, "query", run_id=run_id, parent_run_id=parent)
+    else:
+        handler.on_llm_start(
+            {}, ["Hi"], run_id=run_id, parent_run_id=parent, metadata={"model_name": name}, invocation_params={}
+        )
+    return run_id
+
+
+def end(handler, run_type, run_id):
+    if run_type == "chain":
+        handler.on_chain_end({"answer": "Hello"}, run_id=run_id)
+    elif run_type == "tool":
+        handler.on_tool_end("result", run_id=run_id)
+    else:
+        handler.on_llm_end(LLMResult(generations=[[Generation(text="Hello")]]), run_id=run_id)
+
+
+def run_tree(handler, tree, parent=None):
+    """Runs `(run_type, name, children)` nodes depth first, like LangChain would."""
+    run_type, name, children = tree
+    run_id = start(handler, run_type, name, parent)
+    for child in children:
+        run_tree(handler, child, run_id)
+    end(handler, run_type, run_id)
+
+
+# Root chain > DebugChain > search tool > gpt-4o LLM call
+TREE = ("chain", "Root", [("chain", "DebugChain", [("tool", "search", [("llm", "gpt-4o", [])])])])
+
+
+def starts_by_name(events):
+    return {event["name"]: event for event in events.by_event("start")}
+
+
+def test_drop_mode_sends_nothing_for_ignored_runs_and_their_children(events):
+    handler = LunaryCallbackHandler(app_id="test", ignore=[{"type": "chain", "name": ["DebugChain"]}], ignore_mode="drop")
+
+    run_tree(handler, TREE)
+
+    assert [(event["event"], event["name"]) for event in events] == [("start", "Root"), ("end", None)]
+    assert "__NOT_INGESTED__" not in str(list(events))
+
+
+def test_drop_mode_attaches_tracked_children_to_the_nearest_tracked_ancestor(events):
+    handler = LunaryCallbackHandler(
+        app_id="test",
+        ignore=[{"type": "chain", "name": ["DebugChain"], "ignore_children": False}],
+        ignore_mode="drop",
+    )
+
+    run_tree(handler, TREE)
+
+    starts = starts_by_name(events)
+    assert set(starts) == {"Root", "search", "gpt-4o"}
+    assert starts["search"]["parentRunId"] == starts["Root"]["runId"]
+    assert starts["gpt-4o"]["parentRunId"] == starts["search"]["runId"]
+    assert len(events.by_event("end")) == 3
+
+
+def test_drop_mode_skips_several_ignored_ancestors(events):
+    handler = LunaryCallbackHandler(
+        app_id="test",
+        ignore=[{"name": ["DebugChain", "search"], "ignore_children": False}],
+        ignore_mode="drop",
+    )
+
+    run_tree(handler, TREE)
+
+    starts = starts_by_name(events)
+    assert set(starts) == {"Root", "gpt-4o"}
+    assert starts["gpt-4o"]["parentRunId"] == starts["Root"]["runId"]
+
+
+def test_drop_mode_children_of_an_ignored_root_become_roots(events):
+    handler = LunaryCallbackHandler(
+        app_id="test", ignore=[{"type": "chain", "name": ["Root"], "ignore_children": False}], ignore_mode="drop"
+    )
+
+    run_tree(handler, TREE)
+
+    starts = starts_by_name(events)
+    assert set(starts) == {"DebugChain", "search", "gpt-4o"}
+    assert starts["DebugChain"]["parentRunId"] is None
+
+
+def test_placeholder_mode_keeps_the_ignored_run_as_parent(events):
+    handler = LunaryCallbackHandler(
+        app_id="test", ignore=[{"type": "chain", "name": ["DebugChain"], "ignore_children": False}]
+    )
+
+    run_tree(handler, TREE)
+
+    starts = starts_by_name(events)
+    assert starts["DebugChain"]["input"] == "__NOT_INGESTED__"
+    assert starts["search"]["parentRunId"] == starts["DebugChain"]["runId"]
+    assert starts["search"]["input"] == "query"
+
+
+@pytest.mark.parametrize(
+    "run_type, name, expected",
+    [
+        ("tool", "search_web", 0),
+        ("tool", "web_search", None),
+        ("tool", "debug_1", 1),
+        ("tool", "debug_10", None),
+        ("chain", "search_web", None),  # Rules are scoped to their run type
+        ("agent", "ResearchAgent", 2),  # Agents are matched as chains
+        ("chain", "ResearchAgent", 2),
+        ("llm", "_internal_cache", 3),  # Rules without a type match every type
+        ("tool", "_internal_cache", 3),
+        ("llm", None, None),
+    ],
+)
+def test_ignore_rules_match_names_with_fnmatch_patterns(run_type, name, expected):
+    rules = [
+        {"type": "tool", "name": ["search_*"]},
+        {"type": "tool", "name": ["debug_?"]},
+        {"type": "agent", "name": ["ResearchAgent"]},
+        {"name": ["_internal_*"]},
+    ]
+    matcher = lunary._IgnoreMatcher(rules)
+
+    rule = matcher.match(run_type, name)
+
+    assert rule is (rules[expected] if expected is not None else None)
+
+
+def test_the_first_matching_rule_wins():
+    rules = [
+        {"type": "tool", "name": ["search"], "ignore_children": False},
+        {"name": ["search*"]},
+        {"name": []},  # Rules without names are skipped
+    ]
+    matcher = lunary._IgnoreMatcher(rules)
+
+    assert matcher.match("tool", "search") is rules[0]
+    assert matcher.match("chain", "search") is rules[1]
+
+
+def test_llm_rules_match_the_model_name(events):
+    handler = LunaryCallbackHandler(app_id="test", ignore=[{"type": "llm", "name": ["gpt-4o*"]}])
+
+    run_tree(handler, ("chain", "Root", [("llm", "gpt-4o-mini", []), ("llm", "claude-3-5-sonnet", [])]))
+
+    starts = starts_by_name(events)
+    assert starts["gpt-4o-mini"]["input"] == "__NOT_INGESTED__"
+    assert starts["claude-3-5-sonnet"]["input"] != "__NOT_INGESTED__"
+
+
+def test_children_inherit_the_ignore_of_their_parent(events):
+    handler = LunaryCallbackHandler(app_id="test", ignore=[{"type": "chain", "name": ["Debug*"]}])
+
+    run_tree(handler, TREE)
+
+    starts = starts_by_name(events)
+    assert starts["Root"]["input"] != "__NOT_INGESTED__"
+    for name in ("DebugChain", "search", "gpt-4o"):
+        assert starts[name]["input"] == "__NOT_INGESTED__"
+    # Placeholders keep the tree
+    assert starts["gpt-4o"]["parentRunId"] == starts["search"]["runId"]
+
+
+def test_ignored_runs_send_a_placeholder_end_event(events):
+    handler = LunaryCallbackHandler(app_id="test", ignore=[{"type": "chain", "name": ["DebugChain"]}])
+
+    run_tree(handler, TREE)
+
+    debug = starts_by_name(events)["DebugChain"]
+    [debug_end] = [event for event in events.by_event("end") if event["runId"] == debug["runId"]]
+    assert debug_end["type"] == "chain"
+    assert debug_end["output"] == "__NOT_INGESTED__"
+    assert len(events.by_event("end")) == 4
+    assert lunary.run_manager.runs == {}
@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+
+import lunary
+
+
+def run_kind(kind, fn, *args, **kwargs):
+    """Calls a decorated function of any kind and returns its result, consuming generators."""
+    if kind == "sync":
+        return fn(*args, **kwargs)
+    if kind == "async":
+        return asyncio.run(fn(*args, **kwargs))
+    if kind == "generator":
+        return "".join(fn(*args, **kwargs))
+
+    async def consume():
+        return "".join([item async for item in fn(*args, **kwargs)])
+
+    return asyncio.run(consume())
+
+
+def make_answer(kind, decorator, fail=False):
+    if kind == "sync":
+        def answer(question, style="short"):
+            if fail:
+                raise RuntimeError("boom")
+            return f"A: {question}"
+    elif kind == "async":
+        async def answer(question, style="short"):
+            if fail:
+                raise RuntimeError("boom")
+            return f"A: {question}"
+    elif kind == "generator":
+        def answer(question, style="short"):
+            yield "A: "
+            if fail:
+                raise RuntimeError("boom")
+            yield question
+    else:
+        async def answer(question, style="short"):
+            yield "A: "
+            if fail:
+                raise RuntimeError("boom")
+            yield question
+
+    return decorator(answer)
+
+
+KINDS = ["sync", "async", "generator", "async generator"]
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_chain_with_input_arg(kind, events):
+    answer = make_answer(kind, lunary.chain(name="qa", input_arg="question", tags=["t"]))
+
+    assert run_kind(kind, answer, "why?", style="long") == "A: why?"
+
+    [start] = events.by_event("start")
+    [end] = events.by_event("end")
+    assert (start["type"], start["name"], start["input"], start["tags"]) == ("chain", "qa", "why?", ["t"])
+    assert end["runId"] == start["runId"]
+    assert end["output"] == "A: why?"
+    assert lunary.run_manager.runs == {}
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_errors_are_tracked_and_raised(kind, events):
+    answer = make_answer(kind, lunary.agent(), fail=True)
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_kind(kind, answer, "why?")
+
+    [start] = events.by_event("start")
+    [error] = events.by_event("error")
+    assert start["type"] == "agent" and start["name"] == "answer"
+    assert error["runId"] == start["runId"]
+    assert error["error"]["message"] == "boom"
+    assert events.by_event("end") == []
+    assert lunary.run_manager.runs == {}
+
+
+def test_missing_input_arg_raises_before_any_run(events):
+    @lunary.chain(input_arg="question")
+    def answer(question=None):
+        return question
+
+    with pytest.raises(ValueError, match="'question' not found"):
+        answer()
+    assert events == []
+
+
+def test_class_chain_resolves_app_id_from_the_instance(events):
+    class Bot:
+        def __init__(self, app_id):
+            self.app_id = app_id
+
+        @lunary.class_chain(app_id=lambda bot: bot.app_id, input_arg="question")
+        def answer(self, question):
+            return question
+
+    Bot("app-1").answer("a")
+    Bot("app-2").answer(question="b")
+
+    starts = events.by_event("start")
+    assert [(event["appId"], event["input"]) for event in starts] == [("app-1", "a"), ("app-2", "b")]
+
+
+def test_generator_run_is_only_current_while_running(events):
+    @lunary.tool()
+    def lookup(query):
+        return query
+
+    @lunary.agent()
+    def stream(topic):
+        yield lookup("inside")
+        yield topic
+
+    items = []
+    for item in stream("x"):
+        items.append(item)
+        lookup("between")
+
+    starts = {event["input"]: event for event in events.by_event("start")}
+    assert items == ["inside", "x"]
+    assert starts["inside"]["parentRunId"] == starts["x"]["runId"]
+    assert starts["between"]["parentRunId"] is None
+
+
+def generate(count, item=lambda index: f"{index}"):
+    for index in range(count):
+        yield item(index)
+
+
+@pytest.mark.parametrize(
+    "output_mode, output_limit, items, expected, truncated",
+    [
+        ("join", 5, lambda index: "ab", "ababa", True),
+        ("join", None, lambda index: "ab", "ab" * 10, False),
+        ("first", 2, str, ["0", "1"], True),
+        ("last", 2, str, ["8", "9"], True),
+        ("last", 20, str, [str(index) for index in range(10)], False),
+        # Not strings: "join" falls back to "first"
+        ("join", None, lambda index: {"index": index}, [{"index": index} for index in range(10)], False),
+    ],
+)
+def test_generator_output_modes(events, output_mode, output_limit, items, expected, truncated):
+    traced = lunary.chain(output_mode=output_mode, output_limit=output_limit)(generate)
+
+    assert len(list(traced(10, items))) == 10
+
+    [end] = events.by_event("end")
+    assert end["output"] == expected
+    assert end["metadata"]["metrics"]["items"] == 10
+    assert end["metadata"].get("outputTruncated", False) is truncated
+
+
+def test_async_generator_output_limit(events):
+    @lunary.agent(output_mode="first", output_limit=3)
+    async def numbers():
+        for index in range(10):
+            yield index
+
+    async def consume():
+        return [item async for item in numbers()]
+
+    assert asyncio.run(consume()) == list(range(10))
+
+    [end] = events.by_event("end")
+    assert end["output"] == [0, 1, 2]
+    assert end["metadata"]["outputTruncated"] is True
+
+
+def test_closed_generator_is_reported_as_cancelled(events):
+    traced = lunary.chain()(generate)
+
+    generator = traced(10)
+    assert next(generator) == "0"
+    generator.close()
+
+    [end] = events.by_event("end")
+    assert end["output"] == "0"
+    assert end["metadata"]["cancelled"] is True
+    assert lunary.run_manager.runs == {}
+
+
+def test_invalid_output_mode_raises_at_decoration():
+    with pytest.raises(ValueError, match="Invalid output_mode 'all'"):
+        lunary.agent(output_mode="all")(generate)
@@ -0,0 +1,68 @@
+import time
+
+import lunary
+from lunary.executors import TracedProcessPoolExecutor, TracedThreadPoolExecutor
+
+
+@lunary.tool(name="lookup")
+def lookup(index, delay=0.0):
+    time.sleep(delay)
+    return index * 2
+
+
+@lunary.agent(name="dispatcher")
+def dispatch(executor, count):
+    return [future.result() for future in [executor.submit(lookup, index) for index in range(count)]]
+
+
+def _check_parents(events, count):
+    [agent] = [event for event in events.by_event("start") if event["name"] == "dispatcher"]
+    tools = [event for event in events.by_event("start") if event["name"] == "lookup"]
+    assert len(tools) == count
+    assert all(tool["parentRunId"] == agent["runId"] for tool in tools)
+    assert len([event for event in events.by_event("end")]) == count + 1
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_thread_pool_runs_are_children_of_the_submitting_run(events):
+    with TracedThreadPoolExecutor(max_workers=4) as executor:
+        assert dispatch(executor, 8) == [0, 2, 4, 6, 8, 10, 12, 14]
+
+    _check_parents(events, 8)
+
+
+def test_thread_pool_map_keeps_the_context(events):
+    @lunary.agent(name="dispatcher")
+    def dispatch_map(executor):
+        return list(executor.map(lookup, range(4)))
+
+    with TracedThreadPoolExecutor(max_workers=2) as executor:
+        assert dispatch_map(executor) == [0, 2, 4, 6]
+
+    _check_parents(events, 4)
+
+
+def test_process_pool_runs_are_children_of_the_submitting_run(events):
+    with TracedProcessPoolExecutor(max_workers=2) as executor:
+        assert dispatch(executor, 4) == [0, 2, 4, 6]
+
+    # Worker events are forwarded to the parent's queue before `shutdown()` returns
+    _check_parents(events, 4)
+
+
+def test_process_pool_shutdown_without_waiting_keeps_worker_events(events):
+    executor = TracedProcessPoolExecutor(max_workers=2)
+    futures = [executor.submit(lookup, index, 0.3) for index in range(2)]
+
+    executor.shutdown(wait=False)
+
+    assert [future.result() for future in futures] == [0, 2]
+    _wait_for(lambda: len(events.by_event("end")) == 2)
+    _wait_for(lambda: not executor._forwarder.is_alive())
+    assert len(events.by_event("start")) == 2
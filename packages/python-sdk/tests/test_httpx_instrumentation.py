@@ -0,0 +1,101 @@
+import logging
+
+import httpx
+import pytest
+
+import lunary
+from lunary.consumer import expand_deferred_events
+
+CHAT_RESPONSE = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "model": "gpt-4o-mini",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7},
+}
+
+CHAT_REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Hi"}]}
+
+
+def _client(**kwargs):
+    def handler(request):
+        return httpx.Response(200, json=CHAT_RESPONSE)
+
+    return httpx.Client(transport=lunary.LunaryTransport(httpx.MockTransport(handler), **kwargs))
+
+
+def test_provider_calls_are_traced(events):
+    with _client() as client:
+        client.post("https://api.openai.com/v1/chat/completions", json=CHAT_REQUEST)
+
+    start, end = expand_deferred_events(events)
+    assert start["event"] == "start" and start["name"] == "gpt-4o-mini"
+    assert end["output"]["content"] == "Hello!"
+
+
+def test_azure_deployments_are_traced(events):
+    with _client() as client:
+        client.post(
+            "https://my-resource.openai.azure.com/openai/deployments/chat-prod/chat/completions",
+            json={"messages": CHAT_REQUEST["messages"]},
+        )
+
+    start, _ = expand_deferred_events(events)
+    assert start["name"] == "chat-prod"
+
+
+def test_unknown_hosts_are_not_traced(events, caplog):
+    with _client() as client:
+        client.post("https://chat.internal.example/v1/messages", json={"text": "hi"})
+        client.post("https://chat.internal.example/v1/chat/completions", json=CHAT_REQUEST)
+
+    assert list(events) == []
+    assert not caplog.records
+
+
+@pytest.mark.parametrize("host", ["chat.internal.example", "*.internal.example"])
+def test_allowlisted_hosts_are_traced(events, host):
+    with _client(hosts=[host]) as client:
+        client.post("https://chat.internal.example/v1/chat/completions", json=CHAT_REQUEST)
+        client.post("https://other.example/v1/chat/completions", json=CHAT_REQUEST)
+
+    assert len(expand_deferred_events(events)) == 2
+
+
+def test_allowlisted_host_with_port():
+    transport = lunary.LunaryTransport(httpx.MockTransport(lambda request: None), hosts=["localhost:8000"])
+    assert lunary.httpx_utils.classify_request(
+        httpx.Request("POST", "http://localhost:8000/v1/chat/completions"), transport._hosts
+    ) == "openai_chat"
+    assert lunary.httpx_utils.classify_request(
+        httpx.Request("POST", "http://localhost:9000/v1/chat/completions"), transport._hosts
+    ) is None
+
+
+def test_exchanges_that_are_not_llm_calls_are_dropped(events, caplog):
+    caplog.set_level(logging.INFO, logger="lunary")
+    with _client(hosts=["chat.internal.example"]) as client:
+        client.post("https://chat.internal.example/v1/messages", json={"text": "hi"})
+        client.post("https://chat.internal.example/v1/embeddings", content=b"not json")
+
+    assert len(events) == 2
+    assert expand_deferred_events(events) == []
+    assert not [record for record in caplog.records if record.name.startswith("lunary")]
+
+
+def test_instrument_httpx_uses_the_allowlist(events, monkeypatch):
+    def handle_request(self, request):
+        return httpx.Response(200, json=CHAT_RESPONSE)
+
+    monkeypatch.setattr(httpx.HTTPTransport, "handle_request", handle_request)
+    lunary.instrument_httpx(hosts=["chat.internal.example"])
+    try:
+        with httpx.Client() as client:
+            client.post("https://chat.internal.example/v1/chat/completions", json=CHAT_REQUEST)
+            client.post("https://unrelated.example/v1/chat/completions", json=CHAT_REQUEST)
+    finally:
+        lunary.uninstrument_httpx()
+
+    assert httpx.HTTPTransport.handle_request is handle_request
+    start, _ = expand_deferred_events(events)
+    assert start["input"][0]["content"] == "Hi"
@@ -0,0 +1,50 @@
+from lunary.template_utils import get_langchain_prompt
+
+CHAT_TEMPLATE = {
+    "id": 1,
+    "content": [
+        {"role": "system", "content": "You are {{tone}}."},
+        {"role": "user", "content": "Hi {{name}}"},
+    ],
+}
+
+TEXT_TEMPLATE = {"id": 2, "content": "Hello {{name}}"}
+
+
+def test_chat_prompt_messages_are_not_shared_with_the_cache():
+    prompt = get_langchain_prompt(CHAT_TEMPLATE)
+    prompt.messages[0].prompt.template = "You are rude."
+    prompt.messages.append(prompt.messages[1])
+
+    prompt = get_langchain_prompt(CHAT_TEMPLATE)
+    assert len(prompt.messages) == 2
+    assert prompt.format_messages(tone="kind", name="Ada")[0].content == "You are kind."
+
+
+def test_text_prompt_is_not_shared_with_the_cache():
+    prompt = get_langchain_prompt(TEXT_TEMPLATE)
+    prompt.template = "Bye {name}"
+
+    assert get_langchain_prompt(TEXT_TEMPLATE).format(name="Ada") == "Hello Ada"
+
+
+def test_chat_prompt_message_templates_are_copied():
+    cached = get_langchain_prompt(CHAT_TEMPLATE)
+    prompt = get_langchain_prompt(CHAT_TEMPLATE)
+
+    assert prompt.messages is not cached.messages
+    for message, cached_message in zip(prompt.messages, cached.messages):
+        assert message is not cached_message
+        assert message.prompt is not cached_message.prompt
+        assert message == cached_message
+
+
+def test_copied_chat_prompts_can_be_combined():
+    prompt = get_langchain_prompt(CHAT_TEMPLATE) + [("ai", "Hello {name}")]
+
+    assert [message.content for message in prompt.format_messages(tone="kind", name="Ada")] == [
+        "You are kind.",
+        "Hi Ada",
+        "Hello Ada",
+    ]
+    assert len(get_langchain_prompt(CHAT_TEMPLATE).messages) == 2
@@ -0,0 +1,193 @@
+import json
+
+import httpx
+import pytest
+
+import lunary
+
+openai = pytest.importorskip("openai")
+
+BATCH = {
+    "id": "batch_1",
+    "object": "batch",
+    "endpoint": "/v1/chat/completions",
+    "completion_window": "24h",
+    "status": "completed",
+    "input_file_id": "file_input",
+    "output_file_id": "file_output",
+    "error_file_id": "file_errors",
+    "created_at": 1700000000,
+    "in_progress_at": 1700000010,
+    "completed_at": 1700000100,
+}
+
+
+def _request(custom_id, content="Hi"):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": "gpt-4o-mini", "temperature": 0.5, "messages": [{"role": "user", "content": content}]},
+    }
+
+
+def _result(custom_id, content="Hello"):
+    return {
+        "id": f"response_{custom_id}",
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "model": "gpt-4o-mini-2024-07-18",
+                "created": 1700000050,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 9, "completion_tokens": 3},
+            },
+        },
+        "error": None,
+    }
+
+
+class QueueRecorder(list):
+    """Event queue keeping the list of events of each `append` call."""
+
+    def append(self, events):
+        super().append(list(events))
+
+
+def _client(files, batch=BATCH):
+    def handler(request):
+        if request.url.path == f"/v1/batches/{batch['id']}":
+            return httpx.Response(200, json=batch)
+        file_id = request.url.path.split("/")[-2]
+        lines = [line if isinstance(line, str) else json.dumps(line) for line in files[file_id]]
+        return httpx.Response(200, content="\n".join(lines).encode())
+
+    return openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+
+
+def test_batch_results_are_tracked_with_their_input(events):
+    client = _client(
+        {
+            "file_input": [_request("first", "Hi"), _request("second", "Bye")],
+            "file_output": [_result("second", "Goodbye"), _result("first", "Hello")],
+            "file_errors": [],
+        }
+    )
+
+    assert lunary.track_openai_batch(client, "batch_1") == 2
+
+    starts = {event["metadata"]["custom_id"]: event for event in events.by_event("start")}
+    ends = {event["runId"]: event for event in events.by_event("end")}
+    assert set(starts) == {"first", "second"}
+    first = starts["first"]
+    assert first["type"] == "llm"
+    assert first["name"] == "gpt-4o-mini-2024-07-18"
+    assert first["input"][0]["content"] == "Hi"
+    assert first["params"] == {"temperature": 0.5}
+    assert first["metadata"] == {"batch_id": "batch_1", "custom_id": "first"}
+    assert first["timestamp"].startswith("2023-11-14T22:13:30")
+    assert ends[first["runId"]]["output"]["content"] == "Hello"
+    assert ends[first["runId"]]["tokensUsage"] == {"completion": 3, "prompt": 9, "promptCached": None}
+    assert ends[starts["second"]["runId"]]["output"]["content"] == "Goodbye"
+
+
+def test_run_ids_are_stable_across_calls(events):
+    files = {"file_input": [_request("first")], "file_output": [_result("first")], "file_errors": []}
+
+    lunary.track_openai_batch(_client(files), "batch_1")
+    lunary.track_openai_batch(_client(files), "batch_1")
+
+    first, second = events.by_event("start")
+    assert first["runId"] == second["runId"]
+
+
+def test_failed_requests_are_tracked_as_errors(events):
+    error_line = {
+        "id": "response_failed",
+        "custom_id": "failed",
+        "response": {"status_code": 400, "body": {"error": {"message": "Invalid model", "type": "invalid_request_error"}}},
+        "error": None,
+    }
+    expired_line = {
+        "id": "response_expired",
+        "custom_id": "expired",
+        "response": None,
+        "error": {"code": "batch_expired", "message": "This request could not be executed before the batch expired"},
+    }
+    client = _client(
+        {
+            "file_input": [_request("failed"), _request("expired"), _request("ok")],
+            "file_output": [_result("ok")],
+            "file_errors": [error_line, expired_line, "{truncated"],
+        }
+    )
+
+    assert lunary.track_openai_batch(client, "batch_1") == 3
+
+    starts = {event["metadata"]["custom_id"]: event["runId"] for event in events.by_event("start")}
+    errors = {event["runId"]: event["error"]["message"] for event in events.by_event("error")}
+    assert errors == {
+        starts["failed"]: "Invalid model",
+        starts["expired"]: "This request could not be executed before the batch expired",
+    }
+    assert [event["runId"] for event in events.by_event("end")] == [starts["ok"]]
+
+
+def test_batches_without_results_are_not_tracked(events, caplog):
+    client = _client({}, batch={**BATCH, "status": "in_progress", "output_file_id": None, "error_file_id": None})
+
+    assert lunary.track_openai_batch(client, "batch_1") == 0
+    assert list(events) == []
+    assert "has no results yet" in caplog.text
+
+
+def test_events_are_queued_in_chunks(monkeypatch):
+    recorder = QueueRecorder()
+    monkeypatch.setattr(lunary, "queue", recorder)
+    custom_ids = [f"request-{index}" for index in range(1200)]
+    client = _client(
+        {
+            "file_input": [_request(custom_id) for custom_id in custom_ids],
+            "file_output": [_result(custom_id) for custom_id in custom_ids],
+            "file_errors": [],
+        }
+    )
+
+    assert lunary.track_openai_batch(client, "batch_1") == 1200
+
+    # A start and an end event per request
+    assert [len(chunk) for chunk in recorder] == [1000, 1000, 400]
+    assert [event["metadata"]["custom_id"] for event in recorder[2] if event["event"] == "start"] == custom_ids[1000:]
+
+
+def test_embedding_batches_never_report_the_vectors(events):
+    batch = {**BATCH, "endpoint": "/v1/embeddings", "error_file_id": None}
+    request = {
+        "custom_id": "embedding",
+        "method": "POST",
+        "url": "/v1/embeddings",
+        "body": {"model": "text-embedding-3-small", "input": ["secret text"]},
+    }
+    result = {
+        "custom_id": "embedding",
+        "response": {
+            "status_code": 200,
+            "body": {
+                "model": "text-embedding-3-small",
+                "data": [{"embedding": [0.123456789, 0.987654321]}],
+                "usage": {"prompt_tokens": 2},
+            },
+        },
+    }
+    client = _client({"file_input": [request], "file_output": [result]}, batch=batch)
+
+    lunary.track_openai_batch(client, "batch_1", hash_embedding_inputs=True)
+
+    [start] = events.by_event("start")
+    [end] = events.by_event("end")
+    assert start["type"] == "embed"
+    assert start["input"]["count"] == 1
+    assert end["output"] == {"count": 1, "dimensions": 2}
+    assert "secret text" not in json.dumps(list(events))
+    assert "0.1234" not in json.dumps(list(events))
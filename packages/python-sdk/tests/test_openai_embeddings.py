@@ -0,0 +1,80 @@
+import base64
+import json
+import struct
+
+import httpx
+import pytest
+
+import lunary
+from lunary.openai_utils import OpenAIUtils
+
+openai = pytest.importorskip("openai")
+
+VECTORS = [[0.123456789, -0.987654321, 0.5], [0.314159265, 0.271828182, -0.25]]
+
+
+def _encode(vector):
+    return base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
+
+
+def _client(hash_embedding_inputs=False):
+    def handler(request):
+        body = json.loads(request.content)
+        encode = _encode if body.get("encoding_format") == "base64" else list
+        return httpx.Response(
+            200,
+            json={
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": encode(vector)}
+                    for index, vector in enumerate(VECTORS)
+                ],
+                "model": body["model"],
+                "usage": {"prompt_tokens": 8, "total_tokens": 8},
+            },
+        )
+
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    lunary.monitor(client, hash_embedding_inputs=hash_embedding_inputs)
+    return client
+
+
+@pytest.mark.parametrize("encoding_format", [None, "float", "base64"])
+def test_embedding_events_report_the_shape_without_the_vectors(events, encoding_format):
+    client = _client()
+    kwargs = {"encoding_format": encoding_format} if encoding_format else {}
+
+    client.embeddings.create(model="text-embedding-3-small", input=["secret text", "other text"], **kwargs)
+
+    [start] = events.by_event("start")
+    [end] = events.by_event("end")
+    assert start["type"] == "embed"
+    assert start["input"] == {"count": 2}
+    assert end["output"] == {"count": 2, "dimensions": 3}
+    assert end["tokensUsage"] == {"prompt": 8, "completion": 0}
+
+    sent = json.dumps(list(events))
+    assert "secret text" not in sent
+    for vector in VECTORS:
+        assert _encode(vector) not in sent
+        assert not any(str(value)[:8] in sent for value in vector)
+
+
+def test_embedding_inputs_can_be_hashed(events):
+    client = _client(hash_embedding_inputs=True)
+
+    client.embeddings.create(model="text-embedding-3-small", input="secret text")
+
+    [start] = events.by_event("start")
+    assert start["input"]["count"] == 1
+    assert len(start["input"]["hashes"]) == 1
+    assert "secret text" not in json.dumps(list(events))
+
+
+@pytest.mark.parametrize("dimensions", [1, 2, 3, 4, 255, 256, 1536, 3072])
+def test_base64_embedding_dimensions_are_read_from_the_string_length(dimensions):
+    embedding = _encode([0.5] * dimensions)
+
+    output = OpenAIUtils.parse_embedding_output({"data": [{"embedding": embedding}], "usage": {"prompt_tokens": 1}})
+
+    assert output["output"] == {"count": 1, "dimensions": dimensions}
@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import lunary
+
+openai = pytest.importorskip("openai")
+
+RESPONSE = {
+    "id": "resp_1",
+    "object": "response",
+    "created_at": 1700000000,
+    "status": "completed",
+    "model": "gpt-4o-2024-08-06",
+    "output": [
+        {
+            "type": "message",
+            "id": "msg_1",
+            "role": "assistant",
+            "status": "completed",
+            "content": [
+                {"type": "output_text", "text": "It's sunny ", "annotations": []},
+                {"type": "output_text", "text": "in Paris.", "annotations": []},
+            ],
+        },
+        {
+            "type": "function_call",
+            "id": "fc_1",
+            "call_id": "call_1",
+            "name": "get_weather",
+            "arguments": '{"city": "Paris"}',
+            "status": "completed",
+        },
+    ],
+    "parallel_tool_calls": True,
+    "tool_choice": "auto",
+    "tools": [],
+    "usage": {
+        "input_tokens": 20,
+        "input_tokens_details": {"cached_tokens": 8},
+        "output_tokens": 6,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": 26,
+    },
+}
+
+INPUT = [
+    {"role": "user", "content": [{"type": "input_text", "text": "Weather in Paris?"}]},
+    {"type": "function_call", "call_id": "call_0", "name": "get_location", "arguments": "{}"},
+    {"type": "function_call_output", "call_id": "call_0", "output": "Paris"},
+]
+
+
+def _handler(request):
+    if request.url.path != "/v1/responses":
+        return httpx.Response(404)
+    return httpx.Response(200, json=RESPONSE)
+
+
+def _check_events(events):
+    [start] = events.by_event("start")
+    [end] = events.by_event("end")
+    assert start["type"] == "llm"
+    assert start["name"] == "gpt-4o"
+    assert start["input"] == [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": "Weather in Paris?"},
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {"id": "call_0", "type": "function", "function": {"name": "get_location", "arguments": "{}"}}
+            ],
+        },
+        {"role": "tool", "tool_call_id": "call_0", "content": "Paris"},
+    ]
+    assert start["params"]["temperature"] == 0
+    assert end["output"] == {
+        "role": "assistant",
+        "content": "It's sunny in Paris.",
+        "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'}}
+        ],
+    }
+    assert end["tokensUsage"] == {"completion": 6, "prompt": 20, "promptCached": 8}
+    assert end["runId"] == start["runId"]
+
+
+def test_responses_are_tracked(events):
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(_handler)), max_retries=0)
+    lunary.monitor(client)
+
+    response = client.responses.create(model="gpt-4o", instructions="Be brief.", input=INPUT, temperature=0)
+
+    assert response.output_text == "It's sunny in Paris."
+    _check_events(events)
+
+
+def test_async_responses_are_tracked(events):
+    async def main():
+        client = openai.AsyncOpenAI(
+            api_key="test", http_client=httpx.AsyncClient(transport=httpx.MockTransport(_handler)), max_retries=0
+        )
+        lunary.monitor(client)
+        return await client.responses.create(model="gpt-4o", instructions="Be brief.", input=INPUT, temperature=0)
+
+    assert asyncio.run(main()).output_text == "It's sunny in Paris."
+    _check_events(events)
+
+
+def test_text_inputs_and_refusals_are_tracked(events):
+    def handler(request):
+        body = json.loads(request.content)
+        assert body["input"] == "Say something rude"
+        output = [
+            {
+                "type": "message",
+                "id": "msg_1",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "refusal", "refusal": "I can't help with that."}],
+            }
+        ]
+        return httpx.Response(200, json={**RESPONSE, "output": output})
+
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    lunary.monitor(client)
+
+    client.responses.create(model="gpt-4o", input="Say something rude")
+
+    [start] = events.by_event("start")
+    [end] = events.by_event("end")
+    assert start["input"] == [{"role": "user", "content": "Say something rude"}]
+    assert end["output"] == {"role": "assistant", "content": "", "refusal": "I can't help with that."}
+
+
+def test_response_errors_are_tracked(events):
+    def handler(request):
+        return httpx.Response(400, json={"error": {"message": "Unsupported model", "type": "invalid_request_error"}})
+
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    lunary.monitor(client)
+
+    with pytest.raises(openai.BadRequestError):
+        client.responses.create(model="nope", input="Hi")
+
+    [error] = events.by_event("error")
+    assert "Unsupported model" in error["error"]["message"]
+    assert events.by_event("end") == []
@@ -0,0 +1,141 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from lunary.stats import stats
+from lunary.template_utils import FrozenDict, RenderCache, _freeze, data_digest
+
+
+def _raw_template(content="Hi {{name}} from {{team.name}}", version_id="version-1"):
+    return {"id": version_id, "content": content, "extra": {"stop": ["\n"]}}
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    stats.reset()
+
+
+def _counters():
+    snapshot = stats.snapshot()
+    return {name: snapshot.get(f"render_cache_{name}", 0) for name in ("hits", "misses", "evictions")}
+
+
+def test_equal_data_hits_the_cache_whatever_its_key_order():
+    cache = RenderCache(max_size=10)
+    raw_template = _raw_template()
+
+    first = cache.render(raw_template, {"name": "Ada", "team": {"name": "Lunary", "size": 3}})
+    second = cache.render(raw_template, {"team": {"size": 3, "name": "Lunary"}, "name": "Ada"})
+
+    assert second is first
+    assert first["text"] == "Hi Ada from Lunary"
+    assert _counters() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        {"name": "Bob", "team": {"name": "Lunary"}},
+        {"name": "Ada", "team": {"name": "Other"}},
+        {"name": "Ada", "team": {"name": "Lunary", "size": 3}},
+        {"name": ["Ada"], "team": {"name": "Lunary"}},
+        {"name": ("Ada",), "team": {"name": "Lunary"}},
+    ],
+)
+def test_changed_data_misses_the_cache(changed):
+    cache = RenderCache(max_size=10)
+    raw_template = _raw_template()
+    cache.render(raw_template, {"name": "Ada", "team": {"name": "Lunary"}})
+
+    cache.render(raw_template, changed)
+
+    assert _counters()["misses"] == 2
+
+
+@pytest.mark.parametrize("first, second", [(1, True), (1, 1.0), (0, False), ([1], (1,)), ("1", 1), (None, "None")])
+def test_values_rendered_differently_have_different_digests(first, second):
+    assert data_digest({"value": first}) != data_digest({"value": second})
+
+
+def test_refetched_versions_are_rendered_again():
+    cache = RenderCache(max_size=10)
+    data = {"name": "Ada", "team": {"name": "Lunary"}}
+    assert cache.render(_raw_template(), data)["text"] == "Hi Ada from Lunary"
+
+    # The template cache returns a new object once the version has been fetched again
+    refetched = _raw_template(content="Hello {{name}}")
+
+    assert cache.render(refetched, data)["text"] == "Hello Ada"
+    assert cache.render(refetched, data)["text"] == "Hello Ada"
+    assert _counters() == {"hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_least_recently_used_renders_are_evicted():
+    cache = RenderCache(max_size=2)
+    raw_template = _raw_template()
+
+    for name in ("Ada", "Bob", "Ada", "Eve", "Ada", "Bob"):
+        cache.render(raw_template, {"name": name, "team": {"name": "Lunary"}})
+
+    assert _counters() == {"hits": 2, "misses": 4, "evictions": 2}
+    assert len(cache._entries) == 2
+
+
+def test_disabled_cache_renders_modifiable_results():
+    cache = RenderCache()
+    raw_template = _raw_template()
+    data = {"name": "Ada", "team": {"name": "Lunary"}}
+
+    first = cache.render(raw_template, data)
+    first["stop"].append("END")
+
+    assert type(first) is dict
+    assert cache.render(raw_template, data)["stop"] == ["\n"]
+    assert _counters() == {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def test_cached_renders_are_read_only():
+    cache = RenderCache(max_size=10)
+    rendered = cache.render(_raw_template(), {"name": "Ada", "team": {"name": "Lunary"}})
+
+    with pytest.raises(TypeError, match="read-only"):
+        rendered["text"] = "Changed"
+    with pytest.raises(TypeError, match="read-only"):
+        rendered.update(text="Changed")
+    with pytest.raises(TypeError, match="read-only"):
+        rendered["extra_headers"].pop("Template-Id")
+    with pytest.raises(AttributeError):
+        rendered["stop"].append("END")
+
+    copied = dict(rendered)
+    copied["text"] = "Changed"
+    assert rendered["text"] == "Hi Ada from Lunary"
+
+
+def test_data_that_cannot_be_hashed_is_rendered_every_time():
+    cache = RenderCache(max_size=10)
+    raw_template = _raw_template(content="Hi {{name}} on {{date}}")
+    data = {"name": "Ada", "date": datetime(2024, 1, 1)}
+
+    first = cache.render(raw_template, data)
+    second = cache.render(raw_template, data)
+
+    assert first == second and first is not second
+    assert isinstance(first, FrozenDict)
+    assert len(cache._entries) == 0
+    assert _counters()["misses"] == 0
+    with pytest.raises(TypeError):
+        data_digest(data)
+
+
+def test_freeze_converts_nested_values():
+    frozen = _freeze({"messages": [{"role": "user", "content": "Hi", "tags": ["a", {"b": 1}]}], "count": 1})
+
+    assert frozen == {"messages": ({"role": "user", "content": "Hi", "tags": ("a", {"b": 1})},), "count": 1}
+    assert isinstance(frozen, FrozenDict)
+    assert isinstance(frozen["messages"][0], FrozenDict)
+    assert isinstance(frozen["messages"][0]["tags"][1], FrozenDict)
+    # Frozen dicts can still be pickled, e.g. to be sent to a worker process
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+    assert isinstance(pickle.loads(pickle.dumps(frozen)), FrozenDict)
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import lunary
+from lunary.template_utils import compile_template, render_rows, render_rows_async
+
+TEXT_TEMPLATE = {"id": "text-1", "content": "Row {{index}}: {{name}}", "extra": {"model": "gpt-4o"}}
+CHAT_TEMPLATE = {
+    "id": "chat-1",
+    "content": [
+        {"role": "system", "content": "{{#tags}}[{{.}}]{{/tags}}"},
+        {"role": "user", "content": "Row {{index}}: {{name}}"},
+    ],
+    "extra": {"stop": ["\n"]},
+}
+
+
+class ExplodingRow(dict):
+    """Row whose values can't be read, e.g. a lazy record whose source has gone away."""
+
+    def __getitem__(self, key):
+        raise RuntimeError("Row source is closed")
+
+
+def _rows(count):
+    # A generator, like the rows of a dataset read lazily
+    return ({"index": index, "name": f"<name {index}>", "tags": ["a", index]} for index in range(count))
+
+
+def _collect(async_iterator):
+    async def main():
+        return [result async for result in async_iterator]
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("raw_template", [TEXT_TEMPLATE, CHAT_TEMPLATE])
+def test_rows_are_rendered_in_order(raw_template):
+    results = list(render_rows(raw_template, _rows(100), chunk_size=7))
+
+    assert results == [compile_template(raw_template).render(row) for row in _rows(100)]
+    if raw_template is TEXT_TEMPLATE:
+        assert [result["text"] for result in results[:2]] == ["Row 0: &lt;name 0&gt;", "Row 1: &lt;name 1&gt;"]
+
+
+@pytest.mark.parametrize("raw_template", [TEXT_TEMPLATE, CHAT_TEMPLATE])
+def test_worker_processes_render_like_the_current_process(raw_template):
+    expected = list(render_rows(raw_template, _rows(500)))
+
+    assert list(render_rows(raw_template, _rows(500), processes=2, chunk_size=16)) == expected
+    assert _collect(render_rows_async(raw_template, _rows(500), processes=2, chunk_size=16)) == expected
+
+
+def test_async_rows_are_rendered_in_order():
+    expected = list(render_rows(CHAT_TEMPLATE, _rows(600)))
+
+    assert _collect(render_rows_async(CHAT_TEMPLATE, _rows(600), chunk_size=64)) == expected
+
+
+def test_rendering_yields_to_the_event_loop_between_chunks():
+    ticks = []
+
+    async def main():
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0)
+        results = [result async for result in render_rows_async(TEXT_TEMPLATE, _rows(100), chunk_size=10)]
+        ticker.cancel()
+        return results
+
+    assert len(asyncio.run(main())) == 100
+    assert len(ticks) >= 10
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_render_errors_raise_a_template_error(processes):
+    rows = [{"index": 0, "name": "Ada"}, ExplodingRow(), {"index": 2, "name": "Eve"}]
+
+    with pytest.raises(lunary.TemplateError, match="Row source is closed"):
+        list(render_rows(TEXT_TEMPLATE, rows, processes=processes, chunk_size=1))
+
+    with pytest.raises(lunary.TemplateError, match="Row source is closed"):
+        _collect(render_rows_async(TEXT_TEMPLATE, rows, processes=processes, chunk_size=1))
+
+
+def test_render_templates_fetches_the_template_once(monkeypatch):
+    slugs = []
+
+    def get_raw_template(slug, app_id=None, api_url=None):
+        slugs.append(slug)
+        return CHAT_TEMPLATE
+
+    monkeypatch.setattr(lunary, "get_raw_template", get_raw_template)
+
+    results = list(lunary.render_templates("greeting", _rows(10)))
+
+    assert slugs == ["greeting"]
+    assert [result["messages"][1]["content"] for result in results] == [
+        f"Row {index}: &lt;name {index}&gt;" for index in range(10)
+    ]
+
+
+def test_render_templates_raises_syntax_errors_before_the_first_row(monkeypatch):
+    monkeypatch.setattr(lunary, "get_raw_template", lambda *args: {"id": "broken", "content": "{{#open}}", "extra": {}})
+
+    with pytest.raises(lunary.TemplateError, match="Error rendering template"):
+        lunary.render_templates("greeting", _rows(10))
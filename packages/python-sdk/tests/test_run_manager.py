@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import lunary
+from lunary.run_manager import RunManager
+from lunary.stats import stats
+
+
+@lunary.tool(name="lookup")
+async def lookup(agent_index, tool_index):
+    await asyncio.sleep(0)
+    return await normalize(agent_index, tool_index)
+
+
+@lunary.tool(name="normalize")
+async def normalize(agent_index, tool_index):
+    await asyncio.sleep(0)
+    return f"{agent_index}-{tool_index}"
+
+
+@lunary.agent(name="researcher")
+async def researcher(agent_index):
+    return await asyncio.gather(*(lookup(agent_index, tool_index) for tool_index in range(3)))
+
+
+@lunary.tool(name="sync_lookup")
+def sync_lookup(agent_index, tool_index):
+    time.sleep(0)
+    return sync_normalize(agent_index, tool_index)
+
+
+@lunary.tool(name="sync_normalize")
+def sync_normalize(agent_index, tool_index):
+    return f"{agent_index}-{tool_index}"
+
+
+@lunary.agent(name="sync_researcher")
+def sync_researcher(agent_index):
+    return [sync_lookup(agent_index, tool_index) for tool_index in range(3)]
+
+
+def _starts_by_name_and_input(events):
+    starts = {}
+    for event in events.by_event("start"):
+        starts[(event["name"], str(event["input"]))] = event
+    return starts
+
+
+def _check_parents(events, agent_name, lookup_name, normalize_name, agents):
+    starts = _starts_by_name_and_input(events)
+    assert len(starts) == agents * 7
+    for agent_index in range(agents):
+        agent = starts[(agent_name, str(agent_index))]
+        assert agent["parentRunId"] is None
+        for tool_index in range(3):
+            tool_input = str([agent_index, tool_index])
+            tool = starts[(lookup_name, tool_input)]
+            nested = starts[(normalize_name, tool_input)]
+            assert tool["parentRunId"] == agent["runId"]
+            assert nested["parentRunId"] == tool["runId"]
+    assert len(events.by_event("end")) == agents * 7
+
+
+def test_concurrent_async_agents_link_tools_to_their_agent(events):
+    async def main():
+        return await asyncio.gather(*(researcher(agent_index) for agent_index in range(300)))
+
+    results = asyncio.run(main())
+
+    assert results[42] == ["42-0", "42-1", "42-2"]
+    _check_parents(events, "researcher", "lookup", "normalize", 300)
+    assert lunary.run_manager.runs == {}
+
+
+def test_concurrent_threads_link_tools_to_their_agent(events):
+    barrier = threading.Barrier(50)
+
+    def run(start):
+        barrier.wait()
+        for agent_index in range(start, start + 4):
+            sync_researcher(agent_index)
+
+    threads = [threading.Thread(target=run, args=(start,)) for start in range(0, 200, 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    _check_parents(events, "sync_researcher", "sync_lookup", "sync_normalize", 200)
+    assert lunary.run_manager.runs == {}
+
+
+def test_threads_and_tasks_mixed(events):
+    def run_loop(start):
+        async def main():
+            await asyncio.gather(*(researcher(agent_index) for agent_index in range(start, start + 10)))
+
+        asyncio.run(main())
+
+    threads = [threading.Thread(target=run_loop, args=(start,)) for start in range(0, 200, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    _check_parents(events, "researcher", "lookup", "normalize", 200)
+    assert lunary.run_manager.runs == {}
+
+
+def test_expired_runs_are_reaped_with_their_children():
+    stats.reset()
+    manager = RunManager(run_ttl=0.05)
+    parent = manager.start_run("parent")
+    manager.start_run("child", parent_run_id=parent.id)
+
+    time.sleep(0.1)
+    recent = manager.start_run("recent")
+
+    assert list(manager.runs) == [recent.id]
+    assert stats.snapshot()["runs_reaped"] == 2
+    # The reaped runs are skipped when looking for the current run
+    manager.end_run(recent.id)
+    assert manager.current_run is None
+
+
+def test_oldest_runs_are_evicted_beyond_max_runs():
+    stats.reset()
+    manager = RunManager(max_runs=3)
+    for index in range(5):
+        manager.start_run(f"run-{index}")
+
+    assert list(manager.runs) == ["run-2", "run-3", "run-4"]
+    assert stats.snapshot()["runs_evicted"] == 2
+    assert manager.current_run_id == "run-4"
+
+
+def test_runs_ended_from_another_context_are_skipped():
+    manager = RunManager()
+    parent = manager.start_run("parent")
+    child = manager.start_run("child", parent_run_id=parent.id)
+
+    # e.g. a callback ending the run from a worker thread
+    thread = threading.Thread(target=manager.end_run, args=(child.id,))
+    thread.start()
+    thread.join()
+
+    assert manager.current_run_id == parent.id
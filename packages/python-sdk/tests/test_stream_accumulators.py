@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import pytest
+
+from lunary.openai_utils import OpenAIStreamAccumulator, ResponsesStreamAccumulator
+
+openai_types = pytest.importorskip("openai.types.chat")
+
+
+def chunk(choices, usage=None):
+    return openai_types.ChatCompletionChunk.model_validate(
+        {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o", "choices": choices, "usage": usage}
+    )
+
+
+def tool_delta(index, arguments, id=None, name=None):
+    delta = {"index": index, "function": {"arguments": arguments}}
+    if id:
+        delta.update(id=id, type="function")
+        delta["function"]["name"] = name
+    return delta
+
+
+def test_parallel_tool_call_deltas_are_merged_by_index():
+    accumulator = OpenAIStreamAccumulator()
+    chunks = [
+        chunk([{"index": 0, "delta": {"role": "assistant", "content": None}}]),
+        chunk([{"index": 0, "delta": {"tool_calls": [tool_delta(0, '{"city"', "call_0", "weather"), tool_delta(1, "{", "call_1", "time")]}}]),
+        # Deltas of several tool calls in one chunk, out of order
+        chunk([{"index": 0, "delta": {"tool_calls": [tool_delta(1, "}"), tool_delta(0, ': "Paris"}')]}}]),
+    ]
+    for item in chunks:
+        accumulator.add(item)
+
+    output = accumulator.get_output()
+    assert output["role"] == "assistant"
+    assert output["tool_calls"] == [
+        {"id": "call_0", "type": "function", "function": {"name": "weather", "arguments": '{"city": "Paris"}'}},
+        {"id": "call_1", "type": "function", "function": {"name": "time", "arguments": "{}"}},
+    ]
+    # Chunks are only read
+    assert chunks[2].choices[0].delta.tool_calls[1].function.arguments == ': "Paris"}'
+
+
+def test_multiple_choices_give_a_list_of_messages():
+    accumulator = OpenAIStreamAccumulator()
+    accumulator.add(chunk([{"index": 0, "delta": {"role": "assistant", "content": "Hel"}}, {"index": 1, "delta": {"role": "assistant", "content": "Bon"}}]))
+    accumulator.add(chunk([{"index": 1, "delta": {"content": "jour"}}]))
+    accumulator.add(chunk([{"index": 0, "delta": {"content": "lo"}}]))
+
+    output = accumulator.get_output()
+    assert [message["content"] for message in output] == ["Hello", "Bonjour"]
+    assert accumulator.get_token_usage() == {"completion": 3, "prompt": None}
+
+
+def test_usage_chunk_without_choices():
+    accumulator = OpenAIStreamAccumulator()
+    accumulator.add(chunk([{"index": 0, "delta": {"role": "assistant", "content": "Hi"}}]))
+    accumulator.add(chunk([], usage={"prompt_tokens": 5, "completion_tokens": 7, "total_tokens": 12}))
+
+    assert accumulator.get_output()["content"] == "Hi"
+    assert accumulator.get_token_usage() == {"completion": 7, "prompt": 5, "promptCached": None}
+
+
+def test_empty_stream():
+    accumulator = OpenAIStreamAccumulator()
+    assert accumulator.get_output() is None
+    assert accumulator.get_token_usage() == {"completion": 0, "prompt": None}
+
+
+def event(type, **fields):
+    return SimpleNamespace(type=type, **fields)
+
+
+def test_responses_output_rebuilt_from_deltas():
+    accumulator = ResponsesStreamAccumulator()
+    for item in [
+        event("response.created"),
+        event("response.output_item.added", output_index=0, item=SimpleNamespace(type="message")),
+        event("response.output_text.delta", output_index=0, delta="Hel"),
+        event("response.output_item.added", output_index=1, item=SimpleNamespace(type="function_call", call_id="call_1", name="weather")),
+        event("response.function_call_arguments.delta", output_index=1, delta='{"city": '),
+        event("response.output_text.delta", output_index=0, delta="lo"),
+        event("response.function_call_arguments.delta", output_index=1, delta='"Paris"}'),
+    ]:
+        accumulator.add(item)
+
+    assert accumulator.get_output() == {
+        "role": "assistant",
+        "content": "Hello",
+        "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": "weather", "arguments": '{"city": "Paris"}'}}],
+    }
+    assert accumulator.get_token_usage() == {"completion": 4, "prompt": None}
+
+
+def test_responses_final_response_and_usage_are_preferred():
+    accumulator = ResponsesStreamAccumulator()
+    accumulator.add(event("response.output_text.delta", output_index=0, delta="partial"))
+    response = {
+        "output": [{"type": "message", "content": [{"type": "output_text", "text": "Hello"}]}],
+        "usage": {"input_tokens": 3, "output_tokens": 2, "input_tokens_details": {"cached_tokens": 1}},
+    }
+    accumulator.add(event("response.completed", response=SimpleNamespace(**response, error=None)))
+
+    assert accumulator.get_output() == {"role": "assistant", "content": "Hello"}
+    assert accumulator.get_token_usage() == {"completion": 2, "prompt": 3, "promptCached": 1}
+    assert accumulator.error is None
@@ -0,0 +1,74 @@
+import httpx
+import pytest
+
+import lunary
+from lunary import (
+    anthropic_stream_handler,
+    default_stream_handler,
+    ibm_stream_handler,
+    responses_stream_handler,
+)
+
+
+class APIError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def failing(error, calls=None):
+    def fn(*args, **kwargs):
+        if calls is not None:
+            calls.append(kwargs)
+        raise error
+
+    return fn
+
+
+@pytest.mark.parametrize(
+    "handler",
+    [default_stream_handler, responses_stream_handler, ibm_stream_handler, anthropic_stream_handler],
+)
+def test_api_errors_reach_the_caller(handler, events):
+    error = APIError("Invalid model")
+
+    with pytest.raises(APIError) as raised:
+        list(handler(failing(error), "run", "model", "llm"))
+
+    assert raised.value is error
+    assert events == []
+
+
+def test_stream_options_retry_error_reaches_the_caller(events):
+    calls = []
+    error = APIError("Unrecognized request argument supplied: stream_options")
+
+    with pytest.raises(APIError) as raised:
+        list(default_stream_handler(failing(error, calls), "run", "model", "llm"))
+
+    assert raised.value is error
+    # Retried once without `stream_options`
+    assert [("stream_options" in kwargs) for kwargs in calls] == [True, False]
+
+
+def test_other_bad_requests_are_not_retried(events):
+    calls = []
+
+    with pytest.raises(APIError, match="Invalid model"):
+        list(default_stream_handler(failing(APIError("Invalid model"), calls), "run", "model", "llm"))
+
+    assert len(calls) == 1
+
+
+def test_monitored_openai_client_raises_the_api_error(events):
+    openai = pytest.importorskip("openai")
+
+    def handler(request):
+        return httpx.Response(400, json={"error": {"message": "The model `nope` does not exist", "type": "invalid_request_error"}})
+
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    lunary.monitor(client)
+
+    with pytest.raises(openai.BadRequestError, match="does not exist"):
+        for _ in client.chat.completions.create(model="nope", messages=[{"role": "user", "content": "Hi"}], stream=True):
+            pass
@@ -0,0 +1,170 @@
+import json
+import time
+
+import httpx
+import pytest
+
+import lunary
+from lunary import ibm_stream_handler, stream_metrics
+from lunary.stream_metrics import MAX_SAMPLED_GAPS, StreamTimer
+
+# Delay before the first content chunk
+FIRST_TOKEN_DELAY = 0.2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stream_metrics, "perf_counter", clock)
+    return clock
+
+
+def _ticks(timer, clock, gaps):
+    timer.tick()
+    for gap in gaps:
+        clock.now += gap
+        timer.tick()
+
+
+def test_stream_timer_metrics(clock):
+    timer = StreamTimer()
+    clock.now += 0.5
+    _ticks(timer, clock, [0.01] * 8 + [0.05, 0.2])
+    clock.now += 0.1
+
+    assert timer.get_metrics(completion_tokens=20) == {
+        "streamDuration": 930.0,
+        "timeToFirstToken": 500.0,
+        "interTokenLatency": {"p50": 10.0, "p90": 50.0, "p99": 200.0, "max": 200.0},
+        "tokensPerSecond": 60.61,
+    }
+
+
+def test_stream_timer_without_chunks(clock):
+    timer = StreamTimer()
+    clock.now += 0.25
+
+    assert timer.get_metrics(completion_tokens=0) == {"streamDuration": 250.0}
+
+
+def test_stream_timer_with_a_single_chunk(clock):
+    timer = StreamTimer()
+    clock.now += 0.25
+    timer.tick()
+
+    assert timer.get_metrics(completion_tokens=1) == {"streamDuration": 250.0, "timeToFirstToken": 250.0}
+
+
+def test_long_streams_keep_a_bounded_sample_of_gaps(clock):
+    timer = StreamTimer()
+    gaps = [0.01] * (MAX_SAMPLED_GAPS * 20) + [1.5] + [0.01] * 100
+
+    _ticks(timer, clock, gaps)
+
+    assert len(timer._gaps) == MAX_SAMPLED_GAPS
+    latency = timer.get_metrics()["interTokenLatency"]
+    assert latency["p50"] == 10.0
+    # The longest gap is reported even when it isn't part of the sample
+    assert latency["max"] == 1500.0
+
+
+def test_sampled_percentiles_stay_close_to_the_exact_ones(clock):
+    timer = StreamTimer()
+    # 90% of short gaps and 10% of long ones
+    gaps = [0.01 if index % 10 else 0.1 for index in range(MAX_SAMPLED_GAPS * 10)]
+
+    _ticks(timer, clock, gaps)
+
+    latency = timer.get_metrics()["interTokenLatency"]
+    assert latency["p50"] == 10.0
+    assert latency["p99"] == 100.0
+
+
+def sse(data):
+    return f"data: {json.dumps(data)}\n\n".encode()
+
+
+def chat_chunk(delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def chat_stream_body():
+    yield sse(chat_chunk({"role": "assistant", "content": ""}))
+    time.sleep(FIRST_TOKEN_DELAY)
+    for text in ("Hel", "lo", "!"):
+        yield sse(chat_chunk({"content": text}))
+        time.sleep(0.01)
+    yield sse(chat_chunk({}, "stop"))
+    yield sse({**chat_chunk({}), "choices": [], "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}})
+    yield b"data: [DONE]\n\n"
+
+
+def end_metrics(events):
+    [end] = events.by_event("end")
+    return end["output"], end["metadata"]["metrics"]
+
+
+def test_openai_chat_streams_report_token_metrics(events):
+    openai = pytest.importorskip("openai")
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=chat_stream_body())
+
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    lunary.monitor(client)
+
+    chunks = list(
+        client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "Hi"}], stream=True)
+    )
+
+    # The usage chunk requested by the SDK is hidden from the caller
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert all(chunk.choices for chunk in chunks)
+    output, metrics = end_metrics(events)
+    assert output["content"] == "Hello!"
+    # The role chunk comes before the delay
+    assert metrics["timeToFirstToken"] < FIRST_TOKEN_DELAY * 1000
+    assert metrics["interTokenLatency"]["max"] >= FIRST_TOKEN_DELAY * 1000
+    assert metrics["streamDuration"] >= metrics["timeToFirstToken"]
+    assert metrics["tokensPerSecond"] > 0
+
+
+def ibm_chunk(delta, completion_tokens):
+    return {
+        "choices": [{"index": 0, "delta": delta}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": completion_tokens},
+    }
+
+
+def test_ibm_streams_report_token_metrics(events):
+    def chat_stream(*args, **kwargs):
+        time.sleep(FIRST_TOKEN_DELAY)
+        for index, text in enumerate(("Hel", "lo", "!")):
+            yield ibm_chunk({"content": text}, index + 1)
+            time.sleep(0.01)
+
+    chunks = list(ibm_stream_handler(chat_stream, "run", "granite", "llm"))
+
+    assert len(chunks) == 3
+    output, metrics = end_metrics(events)
+    assert output["content"] == "Hello!"
+    assert events.by_event("end")[0]["tokensUsage"] == {"prompt": 5, "completion": 3}
+    assert metrics["timeToFirstToken"] >= FIRST_TOKEN_DELAY * 1000
+    assert metrics["interTokenLatency"]["max"] < FIRST_TOKEN_DELAY * 1000
+    assert metrics["tokensPerSecond"] > 0
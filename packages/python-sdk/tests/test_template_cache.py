@@ -0,0 +1,320 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+import lunary  # noqa: F401
+from lunary.stats import stats
+
+# The package exposes a `template_cache` attribute that shadows the module
+template_cache_module = sys.modules["lunary.template_cache"]
+TemplateCache = template_cache_module.TemplateCache
+
+KEY = ("https://api.lunary.ai", "app", "greeting")
+
+
+class Fetcher:
+    """Fetch function returning the next version of the template, counting its calls."""
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.etags = []
+        self._lock = threading.Lock()
+
+    def _next(self, etag):
+        with self._lock:
+            self.calls += 1
+            self.etags.append(etag)
+            version = self.calls
+        if self.error is not None:
+            raise self.error
+        return {"id": version}, f'"{version}"'
+
+    def __call__(self, etag):
+        time.sleep(self.delay)
+        return self._next(etag)
+
+    async def fetch_async(self, etag):
+        await asyncio.sleep(self.delay)
+        return self._next(etag)
+
+
+def _run_threads(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_threads_share_a_single_fetch():
+    stats.reset()
+    cache = TemplateCache()
+    fetch = Fetcher(delay=0.1)
+
+    results = _run_threads(50, lambda: cache.get(KEY, fetch))
+
+    assert fetch.calls == 1
+    assert results == [{"id": 1}] * 50
+    assert stats.snapshot()["template_fetches_deduplicated"] == 49
+
+
+def test_concurrent_tasks_and_threads_share_a_single_fetch():
+    cache = TemplateCache()
+    fetch = Fetcher(delay=0.1)
+    thread_results = []
+
+    async def main():
+        tasks = [asyncio.create_task(cache.get_async(KEY, fetch.fetch_async)) for _ in range(50)]
+        await asyncio.sleep(0.02)
+        # Sync callers from other threads wait for the fetch made by the event loop
+        thread = threading.Thread(target=lambda: thread_results.append(cache.get(KEY, fetch)))
+        thread.start()
+        results = await asyncio.gather(*tasks)
+        await asyncio.to_thread(thread.join)
+        return results
+
+    results = asyncio.run(main())
+
+    assert fetch.calls == 1
+    assert results == [{"id": 1}] * 50
+    assert thread_results == [{"id": 1}]
+
+
+def test_least_recently_used_entries_are_evicted():
+    stats.reset()
+    cache = TemplateCache(max_size=2)
+    fetch = Fetcher()
+    first, second, third = (KEY[:2] + (slug,) for slug in ("first", "second", "third"))
+
+    cache.get(first, fetch)
+    cache.get(second, fetch)
+    cache.get(first, fetch)  # `second` is now the least recently used
+    cache.get(third, fetch)
+
+    assert len(cache) == 2
+    assert list(cache._entries) == [first, third]
+    assert stats.snapshot()["template_cache_evictions"] == 1
+    assert fetch.calls == 3
+
+
+def test_sync_get_during_an_async_fetch_of_the_same_thread_does_not_deadlock():
+    cache = TemplateCache()
+    fetch = Fetcher(delay=0.2)
+    results = []
+
+    async def main():
+        task = asyncio.create_task(cache.get_async(KEY, fetch.fetch_async))
+        await asyncio.sleep(0.02)
+        # e.g. a sync helper called from a coroutine: it can't wait for the event loop it blocks
+        results.append(cache.get(KEY, fetch))
+        results.append(await task)
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert fetch.calls == 2
+    assert len(results) == 2
+
+
+def test_fetch_errors_reach_every_waiter_and_are_not_cached():
+    cache = TemplateCache()
+    error = ConnectionError("API unreachable")
+    fetch = Fetcher(delay=0.1, error=error)
+    thread_results = []
+
+    async def main():
+        tasks = [asyncio.create_task(cache.get_async(KEY, fetch.fetch_async)) for _ in range(10)]
+        await asyncio.sleep(0.02)
+        thread = threading.Thread(target=lambda: thread_results.extend(_run_threads(10, lambda: cache.get(KEY, fetch))))
+        thread.start()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(thread.join)
+        return results
+
+    results = asyncio.run(main())
+
+    assert fetch.calls == 1
+    assert all(result is error for result in results + thread_results)
+    assert len(cache) == 0
+
+    fetch.error = None
+    assert cache.get(KEY, fetch) == {"id": 2}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(template_cache_module, "time", clock)
+    return clock
+
+
+def _wait_for_refresh(cache, key=KEY):
+    deadline = time.monotonic() + 5
+    while key in cache._flights:
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.001)
+
+
+def test_expired_entries_are_served_while_refreshed_in_the_background(clock):
+    cache = TemplateCache(ttl=60, max_stale=3600)
+    fetch = Fetcher()
+    assert cache.get(KEY, fetch) == {"id": 1}
+
+    clock.advance(59)
+    assert cache.get(KEY, fetch) == {"id": 1}
+    assert fetch.calls == 1
+
+    clock.advance(2)
+    fetch.delay = 0.05
+    assert cache.get(KEY, fetch) == {"id": 1}
+    # A single refresh runs at a time
+    assert cache.get(KEY, fetch) == {"id": 1}
+    _wait_for_refresh(cache)
+
+    assert fetch.calls == 2
+    assert cache.get(KEY, fetch) == {"id": 2}
+
+
+def test_expired_entries_are_refreshed_in_the_background_by_async_callers(clock):
+    cache = TemplateCache(ttl=60, max_stale=3600)
+    fetch = Fetcher()
+
+    async def main():
+        await cache.get_async(KEY, fetch.fetch_async)
+        clock.advance(61)
+        stale = await cache.get_async(KEY, fetch.fetch_async)
+        while KEY in cache._flights:
+            await asyncio.sleep(0.001)
+        return stale, await cache.get_async(KEY, fetch.fetch_async)
+
+    assert asyncio.run(main()) == ({"id": 1}, {"id": 2})
+
+
+def test_failed_refreshes_are_retried_after_an_interval(clock):
+    stats.reset()
+    cache = TemplateCache(ttl=60, max_stale=3600)
+    fetch = Fetcher()
+    cache.get(KEY, fetch)
+
+    clock.advance(61)
+    fetch.error = ConnectionError("API unreachable")
+    assert cache.get(KEY, fetch) == {"id": 1}
+    _wait_for_refresh(cache)
+    assert fetch.calls == 2
+
+    # The stale version keeps being served, without a new refresh until the retry interval
+    clock.advance(template_cache_module.REFRESH_RETRY_INTERVAL - 1)
+    assert cache.get(KEY, fetch) == {"id": 1}
+    assert KEY not in cache._flights
+    assert fetch.calls == 2
+
+    clock.advance(1)
+    fetch.error = None
+    assert cache.get(KEY, fetch) == {"id": 1}
+    _wait_for_refresh(cache)
+    assert fetch.calls == 3
+    assert cache.get(KEY, fetch) == {"id": 3}
+    assert stats.snapshot()["template_refresh_errors"] == 1
+
+
+def test_entries_past_max_stale_are_fetched_before_being_served(clock):
+    cache = TemplateCache(ttl=60, max_stale=3600)
+    fetch = Fetcher()
+    cache.get(KEY, fetch)
+
+    clock.advance(60 + 3600)
+    fetch.error = ConnectionError("API unreachable")
+    with pytest.raises(ConnectionError):
+        cache.get(KEY, fetch)
+    assert fetch.calls == 2
+
+    fetch.error = None
+    assert cache.get(KEY, fetch) == {"id": 3}
+
+
+class FakeTemplateAPI:
+    """Answers `requests.get` like /v1/template_versions/latest, honoring If-None-Match."""
+
+    def __init__(self):
+        self.version = {"id": "v1", "slug": "greeting", "content": "Hi"}
+        self.etag = '"v1-0"'
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers.get("If-None-Match"))
+        response = lunary.requests.models.Response()
+        response.headers["ETag"] = self.etag
+        if headers.get("If-None-Match") == self.etag:
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response._content = json.dumps(self.version).encode()
+        return response
+
+
+def test_expired_templates_are_revalidated_with_their_etag(clock, monkeypatch):
+    stats.reset()
+    api = FakeTemplateAPI()
+    monkeypatch.setattr(lunary.requests, "get", api.get)
+    monkeypatch.setattr(lunary, "template_cache", TemplateCache(ttl=60))
+    cache = lunary.template_cache
+    key = ("https://lunary.test", "app", "greeting")
+
+    assert lunary.get_raw_template("greeting", "app", "https://lunary.test") == api.version
+    assert api.requests == [None]
+
+    # Still the latest version: the API answers 304 and the cached entry is kept
+    clock.advance(61)
+    assert lunary.get_raw_template("greeting", "app", "https://lunary.test")["id"] == "v1"
+    _wait_for_refresh(cache, key)
+    assert api.requests == [None, '"v1-0"']
+    assert stats.snapshot()["template_not_modified"] == 1
+    assert cache._entries[key].etag == '"v1-0"'
+
+    # ...and its expiry moved forward by a full ttl
+    clock.advance(59)
+    lunary.get_raw_template("greeting", "app", "https://lunary.test")
+    assert len(api.requests) == 2
+
+    # A new version is downloaded when the ETag no longer matches
+    api.version = {"id": "v2", "slug": "greeting", "content": "Hello"}
+    api.etag = '"v2-0"'
+    clock.advance(2)
+    lunary.get_raw_template("greeting", "app", "https://lunary.test")
+    _wait_for_refresh(cache, key)
+    assert api.requests[-1] == '"v1-0"'
+    assert lunary.get_raw_template("greeting", "app", "https://lunary.test")["id"] == "v2"
+    assert cache._entries[key].etag == '"v2-0"'
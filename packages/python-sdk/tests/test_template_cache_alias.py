@@ -0,0 +1,37 @@
+import warnings
+
+import pytest
+
+import lunary
+
+
+def test_template_cache_alias_is_deprecated_and_clears_the_cache():
+    lunary.template_cache.invalidate()
+    lunary.template_cache.put(("https://api.lunary.ai", "app", "greeting"), {"id": 1, "content": "Hi"})
+
+    with pytest.warns(DeprecationWarning, match="template_cache"):
+        legacy = lunary.templateCache
+    assert len(legacy) == len(lunary.template_cache) == 1
+
+    legacy.clear()
+    assert len(lunary.template_cache) == 0
+
+
+def test_unknown_attributes_still_raise():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        with pytest.raises(AttributeError):
+            lunary.templateCacheTypo
+
+
+def test_template_cache_alias_keeps_the_versions_stored_on_disk(tmp_path, monkeypatch):
+    store = lunary.TemplateDiskStore(str(tmp_path))
+    monkeypatch.setattr(lunary.template_cache, "disk", store)
+    key = ("https://api.lunary.ai", "app", "greeting")
+    lunary.template_cache.put(key, {"id": 1, "content": "Hi"})
+
+    with pytest.warns(DeprecationWarning):
+        lunary.templateCache.clear()
+
+    assert len(lunary.template_cache) == 0
+    assert store.load(key)[0] == {"id": 1, "content": "Hi"}
@@ -0,0 +1,41 @@
+import sys
+
+import lunary  # noqa: F401 (the package exposes a `template_cache` attribute that shadows the module)
+
+template_cache = sys.modules["lunary.template_cache"]
+
+KEY = ("https://api.lunary.ai", "app", "greeting")
+
+
+def test_saved_versions_are_loaded(tmp_path):
+    store = template_cache.TemplateDiskStore(str(tmp_path))
+    store.save(KEY, {"id": 1, "content": "Hi"}, "etag-1")
+
+    data, etag, age = store.load(KEY)
+    assert data == {"id": 1, "content": "Hi"}
+    assert etag == "etag-1"
+    assert age < 5
+
+
+def test_clear_only_deletes_stored_templates(tmp_path):
+    (tmp_path / "settings.json").write_text("{}")
+    (tmp_path / "notes.txt").write_text("keep me")
+    store = template_cache.TemplateDiskStore(str(tmp_path))
+    store.save(KEY, {"id": 1}, None)
+    store.save(KEY[:2] + ("farewell",), {"id": 2}, None)
+
+    store.clear()
+
+    assert store.load(KEY) is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["notes.txt", "settings.json"]
+
+
+def test_invalidating_the_cache_keeps_unrelated_files(tmp_path):
+    (tmp_path / "settings.json").write_text("{}")
+    cache = template_cache.TemplateCache()
+    cache.disk = template_cache.TemplateDiskStore(str(tmp_path))
+    cache.put(KEY, {"id": 1})
+
+    cache.invalidate()
+
+    assert [path.name for path in tmp_path.iterdir()] == ["settings.json"]
@@ -0,0 +1,126 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import lunary
+from lunary.stats import stats
+
+# The package exposes a `template_cache` attribute that shadows the module
+template_cache_module = sys.modules["lunary.template_cache"]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        server.requests.append((url.path, params, time.monotonic()))
+
+        if url.path == "/v1/template_versions/latest":
+            version = server.versions[params["slug"]]
+            return self._send_json(200, version, [("ETag", f'"{version["id"]}"')])
+
+        since = params.get("since")
+        if since is None:
+            return self._send_json(200, {"cursor": "c0", "templates": []})
+        if server.failures:
+            server.failures -= 1
+            return self._send_json(500, {"error": "Database unavailable"})
+        if since in server.changes:
+            return self._send_json(200, server.changes.pop(since))
+        # Nothing changed before the timeout
+        time.sleep(float(params["timeout"]))
+        return self._send_json(200, {"cursor": since, "templates": []})
+
+
+class StandInAPI(ThreadingHTTPServer):
+    """Answers the template routes used by `subscribe_templates`, from scripted changes."""
+
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.requests = []
+        self.changes = {}
+        self.versions = {}
+        self.failures = 0
+
+    def changes_requests(self):
+        return [(params, at) for path, params, at in self.requests if path == "/v1/template-versions/changes"]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(lunary, "SUBSCRIPTION_POLL_TIMEOUT", 0.1)
+    server = StandInAPI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    lunary.unsubscribe_templates("app", server.url)
+    server.shutdown()
+    server.server_close()
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_changed_templates_are_refreshed_and_the_cursor_advances(api):
+    key = (api.url, "app", "greeting")
+    lunary.template_cache.invalidate()
+    lunary.template_cache.put(key, {"id": "1", "content": "Hello"})
+    api.versions["greeting"] = {"id": "2", "content": "Hi there"}
+    api.changes["c0"] = {"cursor": "c1", "templates": [{"id": "t1", "slug": "greeting"}]}
+
+    assert lunary.subscribe_templates("app", api.url)
+    assert not lunary.subscribe_templates("app", api.url)
+
+    # Requests that time out without changes keep the cursor
+    _wait_for(lambda: [params.get("since") for params, _ in api.changes_requests()][:4] == [None, "c0", "c1", "c1"])
+    assert all(params["timeout"] == "0.1" for params, _ in api.changes_requests())
+    assert lunary.get_raw_template("greeting", "app", api.url) == {"id": "2", "content": "Hi there"}
+    assert [path for path, _, _ in api.requests].count("/v1/template_versions/latest") == 1
+
+
+def test_errors_are_retried_with_a_backoff_from_the_last_cursor(api, monkeypatch):
+    monkeypatch.setattr(template_cache_module, "SUBSCRIPTION_RETRY_MIN", 0.05)
+    monkeypatch.setattr(template_cache_module, "SUBSCRIPTION_RETRY_MAX", 0.2)
+    stats.reset()
+    api.failures = 4
+    api.changes["c0"] = {"cursor": "c1", "templates": []}
+
+    lunary.subscribe_templates("app", api.url)
+
+    _wait_for(lambda: any(params.get("since") == "c1" for params, _ in api.changes_requests()))
+    requests = api.changes_requests()
+    assert [params.get("since") for params, _ in requests[:7]] == [None, "c0", "c0", "c0", "c0", "c0", "c1"]
+
+    # 4 failures, then the request that succeeds
+    delays = [later - earlier for (_, earlier), (_, later) in zip(requests[1:6], requests[2:6])]
+    for delay, expected in zip(delays, [0.05, 0.1, 0.2, 0.2]):
+        assert expected * 0.9 <= delay < expected + 0.15
+    assert stats.snapshot()["template_subscription_errors"] == 4
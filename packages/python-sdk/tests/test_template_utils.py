@@ -0,0 +1,116 @@
+import copy
+
+import chevron
+import pytest
+
+from lunary.template_utils import CompiledTemplate, CompiledText
+
+DATA = {
+    "name": "Ada & <Bob>",
+    "quote": 'say "hi"',
+    "user": {"name": "Ada", "address": {"city": "Paris"}},
+    "items": [{"name": "apple"}, {"name": "pear"}],
+    "tags": ["a", "b"],
+    "count": 0,
+    "enabled": False,
+    "empty": "",
+    "none": None,
+    "flag": True,
+    "price": 1.5,
+}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Hello",
+        "",
+        "Hello {{name}}",
+        "Hello {{ name }}!",
+        "{{quote}}",
+        "{{{name}}}",
+        "{{& name}}",
+        "{{user.name}} from {{user.address.city}}",
+        "{{user.address.country}}",
+        "{{missing}} and {{missing.key}}",
+        "{{tags.0}} {{tags.1}} {{tags.2}}",
+        "{{count}} {{enabled}} {{empty}} {{none}} {{flag}} {{price}}",
+        "{{user}}",
+        "{{=<% %>=}}<% name %> {{name}}",
+        "{{#items}}- {{name}}\n{{/items}}",
+        "{{#tags}}{{.}},{{/tags}}",
+        "{{^missing}}No items{{/missing}}",
+        "{{#user}}{{name}} in {{address.city}}{{/user}}",
+        "{{#flag}}{{name}}{{/flag}}",
+        "{{! a comment }}{{name}}",
+        "{{.}}",
+    ],
+)
+def test_compiled_text_renders_like_chevron(text):
+    assert CompiledText(text).render(DATA) == chevron.render(text, DATA)
+
+
+@pytest.mark.parametrize("data", [{}, {"name": 42}, {"name": ["a"]}, {"name": {"first": "Ada"}}, None, "text"])
+def test_compiled_text_renders_any_data_like_chevron(data):
+    text = "Hello {{name}} {{name.first}}"
+
+    assert CompiledText(text).render(data) == chevron.render(text, data)
+
+
+def test_only_templates_without_sections_skip_chevron():
+    assert CompiledText("Hello {{name}}").tokens is None
+    assert CompiledText("{{#items}}{{name}}{{/items}}").segments is None
+
+
+def _raw_template(content, extra=None):
+    return {"id": "version-1", "content": content, "extra": extra if extra is not None else {}}
+
+
+def test_compiled_messages_render_like_chevron():
+    content = [
+        {"role": "system", "content": "You help {{user.name}} & co."},
+        {"role": "user", "content": "{{#items}}{{name}} {{/items}}"},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "call", "function": {"name": "search"}}]},
+    ]
+
+    rendered = CompiledTemplate(_raw_template(content)).render(DATA)
+
+    assert [message["content"] for message in rendered["messages"]] == [
+        chevron.render(content[0]["content"], DATA),
+        chevron.render(content[1]["content"], DATA),
+        chevron.render(None, DATA),
+    ]
+    assert rendered["extra_headers"] == {"Template-Id": "version-1"}
+
+
+def test_rendering_never_modifies_the_cached_template():
+    content = [
+        {"role": "user", "content": "Hi {{name}}", "metadata": {"tags": ["a"]}},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "call", "function": {"name": "search"}}]},
+    ]
+    extra = {"model": "gpt-4o", "stop": ["\n"], "response_format": {"type": "json_object"}}
+    raw_template = _raw_template(content, extra)
+    original = copy.deepcopy(raw_template)
+    compiled = CompiledTemplate(raw_template)
+
+    first = compiled.render(DATA)
+    first["messages"][0]["metadata"]["tags"].append("b")
+    first["messages"][1]["tool_calls"][0]["function"]["name"] = "changed"
+    first["messages"].append({"role": "user", "content": "Added"})
+    first["stop"].append("END")
+    first["response_format"]["type"] = "text"
+    first["extra_headers"]["Template-Id"] = "changed"
+
+    assert raw_template == original
+    second = compiled.render(DATA)
+    assert second == CompiledTemplate(original).render(DATA)
+    assert second["messages"][0]["metadata"] is not first["messages"][0]["metadata"]
+
+
+def test_rendered_text_templates_do_not_share_their_extra():
+    compiled = CompiledTemplate(_raw_template("Hi {{name}}", {"stop": ["\n"]}))
+
+    first = compiled.render(DATA)
+    first["stop"].append("END")
+
+    assert compiled.render(DATA)["stop"] == ["\n"]
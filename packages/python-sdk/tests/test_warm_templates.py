@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import lunary
+from lunary.stats import stats
+
+API_URL = "https://lunary.test"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+        self._body = body
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+
+class FakeAPI:
+    """Answers `requests.get` with the live templates of the project."""
+
+    def __init__(self):
+        self.templates = []
+        self.status_code = 200
+        self.urls = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.urls.append(url)
+        assert headers["Authorization"] == "Bearer app"
+        if self.status_code != 200:
+            return FakeResponse(self.status_code, {"error": "This route requires a private API key"})
+        return FakeResponse(200, [dict(template) for template in self.templates])
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeAPI()
+    monkeypatch.setattr(lunary.requests, "get", api.get)
+    lunary.template_cache.invalidate()
+    yield api
+    lunary.stop_template_refresh("app", API_URL)
+    lunary.template_cache._ready.clear()
+    lunary.template_cache.invalidate()
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_live_templates_are_cached_and_marked_ready(api):
+    api.templates = [
+        {"id": "1", "slug": "greeting", "content": [{"role": "user", "content": "Hi", "toolCallId": "a"}]},
+        {"id": "2", "slug": "farewell", "content": "Bye"},
+    ]
+    assert not lunary.templates_ready("app", API_URL)
+
+    assert lunary.warm_templates("app", API_URL) == 2
+
+    assert api.urls == [f"{API_URL}/v1/templates/latest"]
+    assert lunary.templates_ready("app", API_URL)
+    # Served from the cache, with the same shape as the versions fetched one by one
+    greeting = lunary.get_raw_template("greeting", "app", API_URL)
+    assert greeting["content"] == [{"role": "user", "content": "Hi", "tool_call_id": "a"}]
+    assert lunary.get_raw_template("farewell", "app", API_URL)["content"] == "Bye"
+    assert len(api.urls) == 1
+
+
+def test_rejected_keys_raise_a_clear_error(api):
+    api.status_code = 401
+
+    with pytest.raises(lunary.TemplateError, match="Invalid or unauthorized API credentials"):
+        lunary.warm_templates("app", API_URL)
+    assert not lunary.templates_ready("app", API_URL)
+
+
+def test_live_templates_are_reloaded_until_stopped(api):
+    api.templates = [{"id": "1", "slug": "greeting", "content": "Hi"}]
+    lunary.warm_templates("app", API_URL, refresh_interval=0.05)
+
+    api.templates = [{"id": "2", "slug": "greeting", "content": "Hello"}]
+    _wait_for(lambda: lunary.get_raw_template("greeting", "app", API_URL)["id"] == "2")
+
+    lunary.stop_template_refresh("app", API_URL)
+    time.sleep(0.1)
+    requests_made = len(api.urls)
+    time.sleep(0.15)
+    assert len(api.urls) == requests_made
+
+
+def test_reload_errors_are_counted_and_logged(api, caplog):
+    stats.reset()
+    api.templates = [{"id": "1", "slug": "greeting", "content": "Hi"}]
+    lunary.warm_templates("app", API_URL, refresh_interval=0.05)
+
+    api.status_code = 401
+    _wait_for(lambda: stats.snapshot().get("template_poll_errors", 0) >= 2)
+
+    assert "Invalid or unauthorized API credentials" in caplog.text
+    # The templates loaded before keep being served
+    assert lunary.get_raw_template("greeting", "app", API_URL)["content"] == "Hi"
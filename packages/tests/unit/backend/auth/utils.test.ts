@@ -352,6 +352,40 @@ describe("authMiddleware", () => {
     expect(thrown.message).toBe("This route requires a private API key");
   });
 
+  test("accepts public API key on the template routes used by SDKs", async () => {
+    const publicKey = crypto.randomUUID();
+
+    setSqlResolver((query) => {
+      if (query.includes("from api_key")) {
+        return [{ type: "public", projectId: IDs.project1, orgId: IDs.org1 }];
+      }
+      throw new Error(`Unexpected query: ${query}`);
+    });
+
+    for (const path of [
+      "/v1/templates/latest",
+      "/v1/template-versions/latest",
+      "/v1/template-versions/changes",
+    ]) {
+      const ctx = createMockCtx({
+        path,
+        request: {
+          headers: {
+            authorization: `Bearer ${publicKey}`,
+          },
+        },
+        state: {},
+      });
+      const next = mock(async () => {});
+
+      await authMiddleware(ctx, next);
+
+      expect(ctx.state.projectId).toBe(IDs.project1);
+      expect(ctx.state.privateKey).toBeUndefined();
+      expect(next.mock.calls.length).toBe(1);
+    }
+  });
+
   test("throws session expired for expired JWT", async () => {
     const token = await new SignJWT({ userId: IDs.user12, orgId: IDs.org9 })
       .setProtectedHeader({ alg: "HS256" })
@@ -0,0 +1,229 @@
+import {
+  beforeAll,
+  beforeEach,
+  describe,
+  expect,
+  spyOn,
+  test,
+} from "bun:test";
+
+import { getSqlCalls, resetSqlMock, setSqlResolver } from "../utils/mockSql";
+import { IDs } from "../../_helpers/ids";
+
+type VersionsRouterModule = typeof import("@/src/api/v1/template-versions");
+
+let versionsRouter: VersionsRouterModule["default"];
+let getVersionEtag: VersionsRouterModule["getVersionEtag"];
+let templateChanges: typeof import("@/src/utils/template-changes")["templateChanges"];
+
+beforeAll(async () => {
+  const module = await import("@/src/api/v1/template-versions");
+  versionsRouter = module.default;
+  getVersionEtag = module.getVersionEtag;
+  ({ templateChanges } = await import("@/src/utils/template-changes"));
+});
+
+beforeEach(() => {
+  resetSqlMock();
+});
+
+function findRouteHandler(path: string, method: string) {
+  const layer = versionsRouter.stack.find(
+    (candidate) =>
+      candidate.path === path &&
+      candidate.methods.includes(method.toUpperCase()),
+  );
+
+  if (!layer) {
+    throw new Error(`Route not found for ${method} ${path}`);
+  }
+
+  return layer.stack[layer.stack.length - 1];
+}
+
+const versionId = "00000000-0000-4000-b000-000000000001";
+const publishedAt = new Date("2024-05-01T10:00:00.000Z");
+
+function latestVersionRow(overrides: Record<string, unknown> = {}) {
+  return {
+    id: versionId,
+    slug: "greeting",
+    content: [{ role: "user", content: "Hello {{name}}", toolCallId: "a" }],
+    extra: { maxTokens: 10 },
+    created_at: publishedAt,
+    version: 3,
+    published_at: publishedAt,
+    ...overrides,
+  };
+}
+
+function createCtx(
+  headers: Record<string, string> = {},
+  query: Record<string, string> = { slug: "greeting" },
+) {
+  const responseHeaders: Record<string, string> = {};
+  const ctx: any = {
+    state: { projectId: IDs.project1 },
+    request: { query, headers },
+    responseHeaders,
+    set(name: string, value: string) {
+      responseHeaders[name] = value;
+    },
+    throw(message: string, status: number) {
+      const error: any = new Error(message);
+      error.status = status;
+      throw error;
+    },
+  };
+  return ctx;
+}
+
+describe("GET /latest", () => {
+  test("returns the latest version with an ETag", async () => {
+    const handler = findRouteHandler("/latest", "GET");
+    setSqlResolver(() => [latestVersionRow()]);
+
+    const ctx = createCtx();
+    await handler(ctx);
+
+    expect(ctx.responseHeaders.ETag).toBe(
+      getVersionEtag(versionId, publishedAt),
+    );
+    expect(ctx.status).toBeUndefined();
+    expect(ctx.body.id).toBe(versionId);
+    expect(ctx.body.published_at).toBeUndefined();
+    expect(ctx.body.content[0].tool_call_id).toBe("a");
+    expect(ctx.body.extra.max_tokens).toBe(10);
+  });
+
+  test("returns a 304 without body when If-None-Match matches", async () => {
+    const handler = findRouteHandler("/latest", "GET");
+    setSqlResolver(() => [latestVersionRow()]);
+    const etag = getVersionEtag(versionId, publishedAt);
+
+    for (const header of [etag, `W/${etag}`, `"other", ${etag}`, "*"]) {
+      const ctx = createCtx({ "if-none-match": header });
+      await handler(ctx);
+
+      expect(ctx.status).toBe(304);
+      expect(ctx.body).toBeUndefined();
+      expect(ctx.responseHeaders.ETag).toBe(etag);
+    }
+  });
+
+  test("returns the version when it was published again since", async () => {
+    const handler = findRouteHandler("/latest", "GET");
+    const republishedAt = new Date("2024-05-02T10:00:00.000Z");
+    setSqlResolver(() => [latestVersionRow({ published_at: republishedAt })]);
+
+    const ctx = createCtx({
+      "if-none-match": getVersionEtag(versionId, publishedAt),
+    });
+    await handler(ctx);
+
+    expect(ctx.status).toBeUndefined();
+    expect(ctx.body.id).toBe(versionId);
+    expect(ctx.responseHeaders.ETag).toBe(
+      getVersionEtag(versionId, republishedAt),
+    );
+  });
+});
+
+describe("GET /changes", () => {
+  test("returns a cursor right away when called without one", async () => {
+    const handler = findRouteHandler("/changes", "GET");
+    const now = new Date("2024-05-03T10:00:00.000Z");
+    setSqlResolver(() => [{ now }]);
+
+    const ctx = createCtx({}, {});
+    await handler(ctx);
+
+    expect(ctx.body).toEqual({ cursor: now.toISOString(), templates: [] });
+  });
+
+  test("returns the templates published since the cursor", async () => {
+    const handler = findRouteHandler("/changes", "GET");
+    const since = "2024-05-01T10:00:00.000Z";
+    setSqlResolver(() => [
+      {
+        id: "1",
+        slug: "greeting",
+        changedAt: new Date("2024-05-02T10:00:00.000Z"),
+      },
+      {
+        id: "2",
+        slug: "farewell",
+        changedAt: new Date("2024-05-02T11:00:00.000Z"),
+      },
+    ]);
+
+    const ctx = createCtx({}, { since });
+    await handler(ctx);
+
+    expect(ctx.body).toEqual({
+      cursor: "2024-05-02T11:00:00.000Z",
+      templates: [
+        { id: "1", slug: "greeting" },
+        { id: "2", slug: "farewell" },
+      ],
+    });
+    const [call] = getSqlCalls();
+    expect(call.values).toContain(IDs.project1);
+    expect(call.values).toContainEqual(new Date(since));
+  });
+
+  test("returns the same cursor when nothing changed before the timeout", async () => {
+    const handler = findRouteHandler("/changes", "GET");
+    const since = "2024-05-01T10:00:00.000Z";
+    setSqlResolver(() => []);
+
+    const ctx = createCtx({}, { since, timeout: "0" });
+    await handler(ctx);
+
+    expect(ctx.body).toEqual({ cursor: since, templates: [] });
+    expect(getSqlCalls()).toHaveLength(1);
+  });
+
+  test("keeps checking for changes until the timeout", async () => {
+    const handler = findRouteHandler("/changes", "GET");
+    let checks = 0;
+    setSqlResolver(() => {
+      checks += 1;
+      return checks < 2
+        ? []
+        : [
+            {
+              projectId: IDs.project1,
+              id: "1",
+              slug: "greeting",
+              changedAt: new Date("2024-05-02T10:00:00.000Z"),
+            },
+          ];
+    });
+
+    const ctx = createCtx(
+      {},
+      { since: "2024-05-01T10:00:00.000Z", timeout: "5" },
+    );
+    await handler(ctx);
+
+    expect(checks).toBe(2);
+    expect(ctx.body.templates).toEqual([{ id: "1", slug: "greeting" }]);
+  });
+
+  test("cuts timeouts to 55 seconds", async () => {
+    const handler = findRouteHandler("/changes", "GET");
+    const wait = spyOn(templateChanges, "wait").mockResolvedValue([]);
+    const since = "2024-05-01T10:00:00.000Z";
+
+    try {
+      const ctx = createCtx({}, { since, timeout: "3600" });
+      await handler(ctx);
+
+      expect(ctx.body).toEqual({ cursor: since, templates: [] });
+      expect(wait.mock.calls[0][2]).toBe(55_000);
+    } finally {
+      wait.mockRestore();
+    }
+  });
+});
@@ -0,0 +1,76 @@
+import { beforeAll, beforeEach, describe, expect, test } from "bun:test";
+
+import { getSqlCalls, resetSqlMock, setSqlResolver } from "../utils/mockSql";
+import { IDs } from "../../_helpers/ids";
+
+type TemplatesRouterModule = typeof import("@/src/api/v1/templates");
+
+let templatesRouter: TemplatesRouterModule["default"];
+
+beforeAll(async () => {
+  const module = await import("@/src/api/v1/templates");
+  templatesRouter = module.default;
+});
+
+beforeEach(() => {
+  resetSqlMock();
+});
+
+function findRouteHandler(path: string, method: string) {
+  const layer = templatesRouter.stack.find(
+    (candidate) =>
+      candidate.path === path &&
+      candidate.methods.includes(method.toUpperCase()),
+  );
+
+  if (!layer) {
+    throw new Error(`Route not found for ${method} ${path}`);
+  }
+
+  return layer.stack[layer.stack.length - 1];
+}
+
+function createCtx(state: Record<string, unknown>) {
+  const ctx: any = {
+    state,
+    request: { query: {}, headers: {} },
+    throw(status: number, message: string) {
+      const error: any = new Error(message);
+      error.status = status;
+      throw error;
+    },
+  };
+  return ctx;
+}
+
+describe("GET /templates/latest", () => {
+  test("returns the latest versions of the key's project", async () => {
+    const handler = findRouteHandler("/templates/latest", "GET");
+    setSqlResolver(() => [
+      { id: "1", slug: "greeting", content: "Hi", extra: { maxTokens: 10 } },
+    ]);
+
+    const ctx = createCtx({ projectId: IDs.project1 });
+    await handler(ctx);
+
+    expect(ctx.body).toEqual([
+      { id: "1", slug: "greeting", content: "Hi", extra: { max_tokens: 10 } },
+    ]);
+    const [call] = getSqlCalls();
+    expect(call.values).toEqual([IDs.project1]);
+  });
+
+  test("requires an API key", async () => {
+    const handler = findRouteHandler("/templates/latest", "GET");
+
+    let thrown;
+    try {
+      await handler(createCtx({}));
+    } catch (error) {
+      thrown = error as any;
+    }
+
+    expect(thrown?.status).toBe(401);
+    expect(getSqlCalls()).toHaveLength(0);
+  });
+});
@@ -16,21 +16,28 @@ function isTemplateLiteralArg(
   );
 }
 
+const sqlMock = ((
+  first: TemplateStringsArray | Record<string, unknown>,
+  ...values: unknown[]
+) => {
+  if (!isTemplateLiteralArg(first)) {
+    // Support helper usages like sql(objectLiteral)
+    return first;
+  }
+
+  const query = (first as readonly string[]).join("?");
+  const result = resolver(query, values);
+  sqlCalls.push({ query, values });
+  return Promise.resolve(result);
+}) as any;
+
+// Values are passed through, so tests can check the arrays sent to queries
+sqlMock.array = (values: unknown[]) => values;
+
 mock.module("@/src/utils/db", () => ({
-  default: ((
-    first: TemplateStringsArray | Record<string, unknown>,
-    ...values: unknown[]
-  ) => {
-    if (!isTemplateLiteralArg(first)) {
-      // Support helper usages like sql(objectLiteral)
-      return first;
-    }
-
-    const query = (first as readonly string[]).join("?");
-    const result = resolver(query, values);
-    sqlCalls.push({ query, values });
-    return Promise.resolve(result);
-  }) as any,
+  default: sqlMock,
+  // Clients created with their own options (e.g. without camel casing) share the mock
+  createSqlClient: () => sqlMock,
 }));
 
 export function setSqlResolver(nextResolver: SqlResolver) {
@@ -0,0 +1,99 @@
+import { beforeEach, describe, expect, test } from "bun:test";
+
+import { getSqlCalls, resetSqlMock, setSqlResolver } from "../utils/mockSql";
+import { IDs } from "../../_helpers/ids";
+import { TemplateChangeNotifier } from "@/src/utils/template-changes";
+
+const since = new Date("2024-05-01T10:00:00.000Z");
+
+function change(projectId: string, id: string, changedAt: string) {
+  return { projectId, id, slug: `template-${id}`, changedAt: new Date(changedAt) };
+}
+
+describe("TemplateChangeNotifier", () => {
+  beforeEach(() => {
+    resetSqlMock();
+  });
+
+  test("checks every waiting project with a single query", async () => {
+    const notifier = new TemplateChangeNotifier(10);
+    setSqlResolver(() => [
+      change(IDs.project1, "1", "2024-05-02T10:00:00.000Z"),
+      change(IDs.project1, "2", "2024-05-04T10:00:00.000Z"),
+      change(IDs.project2, "3", "2024-05-02T10:00:00.000Z"),
+    ]);
+
+    const [first, second, other] = await Promise.all([
+      notifier.wait(IDs.project1, since, 5000),
+      notifier.wait(IDs.project1, new Date("2024-05-03T10:00:00.000Z"), 5000),
+      notifier.wait(IDs.project2, since, 5000),
+    ]);
+
+    expect(first.map(({ id }) => id)).toEqual(["1", "2"]);
+    expect(second.map(({ id }) => id)).toEqual(["2"]);
+    expect(other.map(({ id }) => id)).toEqual(["3"]);
+
+    const calls = getSqlCalls();
+    expect(calls).toHaveLength(1);
+    // Each project is read from its oldest cursor
+    expect(calls[0].values).toEqual([
+      [IDs.project1, IDs.project2],
+      [since.toISOString(), since.toISOString()],
+    ]);
+    expect(notifier.waiting).toBe(0);
+  });
+
+  test("keeps waiting until a change is published", async () => {
+    const notifier = new TemplateChangeNotifier(10);
+    let checks = 0;
+    setSqlResolver(() => {
+      checks += 1;
+      return checks < 3 ? [] : [change(IDs.project1, "1", "2024-05-02T10:00:00.000Z")];
+    });
+
+    const changes = await notifier.wait(IDs.project1, since, 5000);
+
+    expect(checks).toBe(3);
+    expect(changes).toEqual([
+      { id: "1", slug: "template-1", changedAt: new Date("2024-05-02T10:00:00.000Z") },
+    ]);
+  });
+
+  test("returns no changes after the timeout", async () => {
+    const notifier = new TemplateChangeNotifier(10);
+
+    const changes = await notifier.wait(IDs.project1, since, 50);
+
+    expect(changes).toEqual([]);
+    expect(notifier.waiting).toBe(0);
+  });
+
+  test("stops waiting when the request is aborted", async () => {
+    const notifier = new TemplateChangeNotifier(10);
+    const controller = new AbortController();
+
+    const waiting = notifier.wait(IDs.project1, since, 5000, controller.signal);
+    expect(notifier.waiting).toBe(1);
+    controller.abort();
+
+    expect(await waiting).toEqual([]);
+    expect(notifier.waiting).toBe(0);
+  });
+
+  test("keeps waiting when a check fails", async () => {
+    const notifier = new TemplateChangeNotifier(10);
+    let checks = 0;
+    setSqlResolver(() => {
+      checks += 1;
+      if (checks === 1) {
+        throw new Error("connection lost");
+      }
+      return [change(IDs.project1, "1", "2024-05-02T10:00:00.000Z")];
+    });
+
+    const changes = await notifier.wait(IDs.project1, since, 5000);
+
+    expect(checks).toBe(2);
+    expect(changes.map(({ id }) => id)).toEqual(["1"]);
+  });
+});